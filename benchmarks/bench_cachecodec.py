@@ -0,0 +1,108 @@
+"""bench_cachecodec.py
+
+Encode and decode throughput of cachecodec.py, and the cache capacity it
+gains, on ConferenceForms payloads of growing size
+
+Each payload is the JSON of a ConferenceForms of FORMS conferences with
+realistic fields, as a cached query result would be. Stored as is, a value
+takes its length in memcache and can't be cached past the 1 MB item
+limit; through the codec it takes the encoded bytes, chunked past it.
+Reports the bytes stored per entry, how many entries fit in CACHE_MB of
+memcache each way, encode and decode MB/s of the payload, and the
+setCached/getCached round trip with the chunks it takes.
+
+"""
+
+import random
+
+from common import Timer
+from common import activateTestbed
+
+FORMS = [10, 100, 1000, 10000]
+CACHE_MB = 64
+REPEAT = 20
+TOPICS = ['Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition', 'Cloud Computing']
+CITIES = ['London', 'Chicago', 'San Francisco', 'Paris', 'Tokyo', 'Berlin']
+WORDS = ('talks workshops keynote speakers hands-on sessions about the latest '
+         'research in practice for developers designers and researchers from '
+         'industry and academia join us').split()
+
+
+def _payload(rng, count):
+    """Return the JSON of a ConferenceForms of count conferences"""
+    from protorpc import protojson
+    from models import ConferenceForm
+    from models import ConferenceForms
+    forms = []
+    for i in range(count):
+        seats = rng.randint(10, 2000)
+        forms.append(ConferenceForm(
+            name='Conference %d on %s' % (i, rng.choice(TOPICS)),
+            description=' '.join(rng.choice(WORDS)
+                                 for _ in range(rng.randint(10, 60))),
+            organizerUserId='organizer%d@example.com' % rng.randint(1, 500),
+            organizerDisplayName='organizer%d' % rng.randint(1, 500),
+            topics=rng.sample(TOPICS, rng.randint(1, 3)),
+            city=rng.choice(CITIES),
+            startDate='2016-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)),
+            endDate='2016-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)),
+            month=rng.randint(1, 12),
+            maxAttendees=seats,
+            seatsAvailable=rng.randint(0, seats),
+            seatsVersion=rng.randint(0, 50),
+            latitude=rng.uniform(-60, 60),
+            longitude=rng.uniform(-180, 180),
+            websafeKey='ahhzfnB5dGhvbi1zY2FsYWJsZS1hcHAtMTE4NnI%025d' % i))
+    return protojson.encode_message(ConferenceForms(items=forms))
+
+
+def _throughput(function, arg, size):
+    """Return MB/s of size bytes through function(arg), best of REPEAT"""
+    best = None
+    for _ in range(REPEAT):
+        with Timer() as timer:
+            function(arg)
+        best = timer.seconds if best is None else min(best, timer.seconds)
+    return size / 1e6 / max(best, 1e-9)
+
+
+def main():
+    from cachecodec import CODEC_CHUNK_SIZE
+    from cachecodec import decodeValue
+    from cachecodec import encodeValue
+    from cachecodec import getCached
+    from cachecodec import setCached
+    tb = activateTestbed()
+    rng = random.Random(1)
+    budget = CACHE_MB * 1000000
+    print('ConferenceForms JSON; entries fitting in %d MB of memcache' % CACHE_MB)
+    print('%6s %10s %10s %7s %9s %9s %10s %10s %7s %8s' % (
+        'forms', 'raw bytes', 'encoded', 'ratio', 'raw fit', 'codec fit',
+        'enc MB/s', 'dec MB/s', 'chunks', 'get ms'))
+    try:
+        for count in FORMS:
+            payload = _payload(rng, count)
+            encoded = encodeValue(payload)
+            assert decodeValue(encoded) == payload
+            raw_fit = budget // len(payload) if len(payload) <= 1000000 else 0
+            chunks = -(-len(encoded) // CODEC_CHUNK_SIZE) \
+                if len(encoded) > CODEC_CHUNK_SIZE else 0
+
+            key = 'bench:%d' % count
+            assert setCached(key, payload)
+            with Timer() as timer:
+                assert getCached(key) == payload
+            print('%6d %10d %10d %6.1fx %9d %9d %10.1f %10.1f %7d %8.2f' % (
+                count, len(payload), len(encoded),
+                len(payload) / float(len(encoded)), raw_fit,
+                budget // len(encoded),
+                _throughput(encodeValue, payload, len(payload)),
+                _throughput(decodeValue, encoded, len(payload)),
+                chunks, timer.seconds * 1000))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""bench_geo.py
+
+Proximity search over many conferences: cells queried, conferences read
+per conference found, latency, and recall against a brute-force scan
+
+CONFERENCES conferences, half spread over the globe and half clustered
+around a few cities, searched around those cities at growing radii.
+
+"""
+
+import random
+
+from common import Timer
+from common import activateTestbed
+
+from google.appengine.ext import ndb
+
+CONFERENCES = 5000
+CITIES = [(52.52, 13.40), (40.71, -74.01), (35.68, 139.65), (-33.87, 151.21)]
+RADII = [10, 100, 500, 2000]
+
+
+def _points(rng):
+    points = [(rng.uniform(-70, 70), rng.uniform(-180, 180))
+              for _ in range(CONFERENCES // 2)]
+    while len(points) < CONFERENCES:
+        latitude, longitude = rng.choice(CITIES)
+        points.append((latitude + rng.gauss(0, 2), longitude + rng.gauss(0, 2)))
+    return points
+
+
+def main():
+    import geo
+    from geohash import coveringCells
+    from geohash import haversine
+    from models import Conference
+    tb = activateTestbed()
+    points = _points(random.Random(1))
+    for start in range(0, len(points), 500):
+        ndb.put_multi([Conference(name='c%d' % i, latitude=lat, longitude=lng)
+                       for i, (lat, lng) in enumerate(points[start:start + 500],
+                                                      start)])
+
+    print('%d conferences' % CONFERENCES)
+    print('%8s %6s %8s %8s %10s %8s' % ('radius', 'cells', 'found', 'read',
+                                        'read/found', 'ms'))
+    for radius in RADII:
+        cells = found = read = missed = 0
+        seconds = 0.0
+        for latitude, longitude in CITIES:
+            with Timer() as timer:
+                results = geo.conferencesNear(latitude, longitude, radius,
+                                              CONFERENCES)
+            seconds += timer.seconds
+            covering = coveringCells(latitude, longitude, radius)
+            cells += len(covering)
+            read += sum(len(geo._cellConferencesAsync(cell).get_result())
+                        for cell in covering)
+            expected = sum(1 for lat, lng in points
+                           if haversine(latitude, longitude, lat, lng) <= radius)
+            found += len(results)
+            missed += expected - len(results)
+        assert missed == 0, 'search missed %d conferences' % missed
+        print('%8d %6.1f %8.1f %8.1f %10.2f %8.1f' % (radius,
+              float(cells) / len(CITIES), float(found) / len(CITIES),
+              float(read) / len(CITIES), float(read) / max(found, 1),
+              1000 * seconds / len(CITIES)))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""bench_ratelimit.py
+
+Cost of rejecting a flood of calls: one client sends FLOOD calls to a
+limited method within one window, next to a well-behaved client
+
+Compares the limiter asking memcache on every call (the instance-local set
+of blocked keys cleared before each call) with the limiter as shipped,
+which answers calls of an already blocked key without a memcache round
+trip. Reports memcache calls and p50/p99 latency of the rejected calls and
+of the well-behaved client's calls.
+
+"""
+
+from common import activateTestbed
+from common import percentile
+
+import time
+
+FLOOD = 5000
+METHOD = 'registerForConference'
+
+
+def _flood(remember_blocked):
+    import ratelimit
+    from errors import TooManyRequestsException
+    tb = activateTestbed()
+    ratelimit._blocked.clear()
+    memcache_calls = [0]
+    offset_multi = ratelimit.memcache.offset_multi
+
+    def counted(*args, **kwargs):
+        memcache_calls[0] += 1
+        return offset_multi(*args, **kwargs)
+    ratelimit.memcache.offset_multi = counted
+    rejected, allowed = [], []
+    try:
+        for i in range(FLOOD):
+            if not remember_blocked:
+                ratelimit._blocked.clear()
+            start = time.time()
+            try:
+                ratelimit.checkRateLimit(METHOD, user_id='flood@example.com')
+            except TooManyRequestsException:
+                rejected.append(time.time() - start)
+            if i % 100 == 0:
+                start = time.time()
+                ratelimit.checkRateLimit(METHOD, user_id='user%d@example.com' % i)
+                allowed.append(time.time() - start)
+    finally:
+        ratelimit.memcache.offset_multi = offset_multi
+        tb.deactivate()
+    return memcache_calls[0], rejected, allowed
+
+
+def main():
+    print('%d calls of one client to %s in one window' % (FLOOD, METHOD))
+    print('%-16s %10s %12s %12s %12s' % ('', 'memcache', 'rejected p50',
+                                         'rejected p99', 'others p99'))
+    for name, remember in (('memcache always', False), ('blocked set', True)):
+        calls, rejected, allowed = _flood(remember)
+        print('%-16s %10d %10.1fus %10.1fus %10.1fus' % (name, calls,
+            1e6 * percentile(rejected, 50), 1e6 * percentile(rejected, 99),
+            1e6 * percentile(allowed, 99)))
+
+
+if __name__ == '__main__':
+    main()
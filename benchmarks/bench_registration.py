@@ -0,0 +1,123 @@
+"""bench_registration.py
+
+Goodput of registerForConference with injected datastore errors: calls
+that succeed, calls that fail, and whether attendees, seats and stats
+still agree afterwards
+
+Each commit fails with probability FAILED (TransactionFailedError, not
+applied) or times out with probability UNKNOWN (Timeout raised after the
+commit was applied). Clients send a requestId or not. Side effects run
+from the tasks queued by the committed transactions.
+
+"""
+
+import logging
+import random
+import time
+
+from common import Timer
+from common import activateTestbed
+from common import signIn
+
+from google.appengine.api.datastore_errors import Timeout
+from google.appengine.api.datastore_errors import TransactionFailedError
+from google.appengine.ext import ndb
+
+USERS = 300
+SEATS = 1000
+FAILED = 0.2
+UNKNOWN = 0.1
+
+
+def _setUp():
+    from models import Conference
+    from models import Profile
+    from settings import RATE_LIMITS
+    RATE_LIMITS.pop('registerForConference', None)
+    tb = activateTestbed()
+    p_key = Profile(id='organizer@example.com').put()
+    wsck = Conference(parent=p_key, name='Launch', organizerUserId=p_key.id(),
+                      maxAttendees=SEATS, seatsAvailable=SEATS).put().urlsafe()
+    return tb, wsck
+
+
+def _injectFaults(rng):
+    """Make ndb transactions fail or time out at random"""
+    import transactions
+    transaction = ndb.transaction
+
+    def faulty(callback, **kwargs):
+        roll = rng.random()
+        if roll < FAILED:
+            raise TransactionFailedError()
+        result = transaction(callback, **kwargs)
+        if roll < FAILED + UNKNOWN:
+            raise Timeout()
+        return result
+    sleep = transactions.time.sleep
+    transactions.ndb.transaction = faulty
+    transactions.time.sleep = lambda seconds: None
+    return transaction, sleep
+
+
+def _runEffects(tb, wsck):
+    """Run the queued side effect tasks, then flush the stats"""
+    from google.appengine.ext import testbed as gae_testbed
+    from registration import applyRegistrationEffects
+    from stats import flushStatsDeltas
+    stub = tb.get_stub(gae_testbed.TASKQUEUE_SERVICE_NAME)
+    for task in stub.get_filtered_tasks(url='/tasks/registration_effects'):
+        params = task.extract_params()
+        applyRegistrationEffects(params['conference_key'], params['user_id'],
+                                 int(params['delta']), task.name,
+                                 float(params['at']))
+    flushStatsDeltas(wsck)
+
+
+def scenario(api, with_request_id):
+    import conference
+    import errors
+    from models import ConferenceStats
+    from models import Profile
+    tb, wsck = _setUp()
+    transaction, sleep = _injectFaults(random.Random(42))
+    ok = conflicts = 0
+    try:
+        with Timer() as timer:
+            for i in range(USERS):
+                signIn('user%d@example.com' % i)
+                request = conference.CONF_REGISTER_REQUEST.combined_message_class(
+                    websafeConferenceKey=wsck,
+                    requestId='r%d' % i if with_request_id else None)
+                try:
+                    api.registerForConference(request)
+                    ok += 1
+                except errors.ConflictException:
+                    conflicts += 1
+    finally:
+        ndb.transaction = transaction
+        time.sleep = sleep
+    _runEffects(tb, wsck)
+    attendees = Profile.query(Profile.conferenceKeysToAttend == wsck).count()
+    seats = ndb.Key(urlsafe=wsck).get().seatsAvailable
+    stats = ndb.Key(ConferenceStats, wsck).get()
+    tb.deactivate()
+    return ok, conflicts, attendees, SEATS - seats, stats.attendees, timer.seconds
+
+
+def main():
+    import conference
+    logging.disable(logging.WARNING)
+    api = conference.ConferenceApi()
+    print('%d users, %.0f%% failed and %.0f%% unknown commits' % (
+        USERS, 100 * FAILED, 100 * UNKNOWN))
+    print('%-12s %6s %10s %10s %10s %8s %8s' % ('', 'ok', 'conflicts',
+          'attendees', 'seats out', 'stats', 'ms/call'))
+    for name, with_id in (('no id', False), ('requestId', True)):
+        ok, conflicts, attendees, taken, counted, seconds = scenario(api, with_id)
+        print('%-12s %6d %10d %10d %10d %8d %8.2f' % (name, ok, conflicts,
+              attendees, taken, counted, 1000.0 * seconds / USERS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""bench_startup.py
+
+Loading request cost of a new instance: time to import each WSGI app and
+to serve its first request, each in a fresh interpreter as on a cold
+instance
+
+main.app (cron and task handlers) serves a stats flush task; conference.api
+(the Endpoints API) serves the API configuration the Endpoints frontend
+asks for, and an API call. Every measurement is made RUNS times and the
+median is reported, together with the number of modules loaded.
+
+"""
+
+import os
+import subprocess
+import sys
+
+from common import ROOT
+from common import percentile
+
+RUNS = 5
+
+# (label, module, WSGI app, path, method, content type, body)
+FIRST_REQUESTS = [
+    ('main task', 'main', 'app', '/tasks/flush_conference_stats', 'POST',
+     'application/x-www-form-urlencoded', 'conference_key=none'),
+    ('api config', 'conference', 'api', '/_ah/spi/BackendService.getApiConfigs',
+     'POST', 'application/json', '{}'),
+    ('api call', 'conference', 'api', '/_ah/spi/ConferenceApi.getAnnouncement',
+     'POST', 'application/json', '{}'),
+]
+
+FIRST_REQUEST = '''
+import sys, time
+start = time.time()
+from %(module)s import %(app)s
+imported = time.time()
+import webob
+from common import activateTestbed
+activateTestbed()
+request = webob.Request.blank(%(path)r, method=%(method)r,
+    body=%(body)r.encode('utf-8'), content_type=%(content_type)r)
+served = time.time()
+response = request.get_response(%(app)s)
+print('%%f %%f %%d %%d' %% (imported - start, time.time() - served,
+                             len(sys.modules), response.status_int))
+'''
+
+
+def _firstRequest(module, app, path, method, content_type, body):
+    """Return the median import and first request seconds, modules and status"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    script = FIRST_REQUEST % {'module': module, 'app': app, 'path': path,
+                              'method': method, 'content_type': content_type,
+                              'body': body}
+    imports, requests = [], []
+    for _ in range(RUNS):
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=ROOT, env=env)
+        imported, served, modules, status = output.decode('utf-8').split()
+        imports.append(float(imported))
+        requests.append(float(served))
+    return (percentile(imports, 50), percentile(requests, 50), int(modules),
+            int(status))
+
+
+def main():
+    print('median of %d cold instances' % RUNS)
+    print('%-12s %10s %14s %10s %8s' % ('', 'import ms', 'first req ms',
+                                        'modules', 'status'))
+    for label, module, app, path, method, content_type, body in FIRST_REQUESTS:
+        imported, served, modules, status = _firstRequest(
+            module, app, path, method, content_type, body)
+        print('%-12s %10.1f %14.1f %10d %8d' % (label, 1000 * imported,
+                                                1000 * served, modules, status))
+
+
+if __name__ == '__main__':
+    main()
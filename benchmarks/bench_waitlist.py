@@ -0,0 +1,82 @@
+"""bench_waitlist.py
+
+Registration transactions run during a launch: clients retrying a sold out
+conference (before the waitlist) against clients given a waitlist position
+
+SEATS seats, USERS users arriving at once. Without the waitlist every
+refused user retries RETRIES times, and every try is a transaction on the
+Conference entity group. With it, users arriving after the conference
+sold out (or while others are queued) are queued without a transaction.
+
+"""
+
+from common import Timer
+from common import activateTestbed
+from common import signIn
+
+from google.appengine.ext import ndb
+
+SEATS = 100
+USERS = 1000
+RETRIES = 5
+
+
+def _setUp():
+    from models import Conference
+    from models import Profile
+    from settings import RATE_LIMITS
+    RATE_LIMITS.pop('registerForConference', None)
+    tb = activateTestbed()
+    p_key = Profile(id='organizer@example.com').put()
+    wsck = Conference(parent=p_key, name='Launch', organizerUserId=p_key.id(),
+                      maxAttendees=SEATS, seatsAvailable=SEATS).put().urlsafe()
+    return tb, wsck
+
+
+def _request(wsck):
+    import conference
+    return conference.CONF_REGISTER_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+
+
+def retrying(api):
+    """Users retry a sold out conference, as clients did before the waitlist"""
+    tb, wsck = _setUp()
+    calls = 0
+    with Timer() as timer:
+        for i in range(USERS):
+            signIn('user%d@example.com' % i)
+            for attempt in range(RETRIES + 1):
+                calls += 1
+                if api._conferenceRegistration(_request(wsck))[0]:
+                    break
+    return tb, calls, timer.seconds
+
+
+def waitlisted(api):
+    """Users call registerForConference once and get a position if it is full"""
+    tb, wsck = _setUp()
+    with Timer() as timer:
+        for i in range(USERS):
+            signIn('user%d@example.com' % i)
+            api.registerForConference(_request(wsck))
+    return tb, USERS, timer.seconds
+
+
+def main():
+    import conference
+    from transactions import getTransactionMetrics
+    api = conference.ConferenceApi()
+    print('%d users, %d seats, %d retries when refused' % (USERS, SEATS, RETRIES))
+    print('%-12s %8s %14s %10s' % ('', 'calls', 'transactions', 'ms/call'))
+    for scenario in (retrying, waitlisted):
+        tb, calls, seconds = scenario(api)
+        attempts = getTransactionMetrics('registration')['attempts']
+        print('%-12s %8d %14d %10.2f' % (scenario.__name__, calls, attempts,
+                                          1000.0 * seconds / calls))
+        ndb.get_context().clear_cache()
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
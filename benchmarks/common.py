@@ -0,0 +1,70 @@
+"""common.py
+
+Setup shared by the benchmarks: App Engine service stubs of the SDK's
+testbed and a signed-in Endpoints user, as in tests/conftest.py
+
+Run a benchmark from the project directory with the SDK and its bundled
+libraries on PYTHONPATH, e.g. `python benchmarks/bench_waitlist.py`.
+The stubs run in one process, so the numbers compare designs (datastore
+calls, transactions, bytes) rather than predict production latency.
+
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed as gae_testbed
+
+
+def activateTestbed():
+    """Activate strongly consistent datastore, memcache and taskqueue stubs"""
+    tb = gae_testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id='python-scalable-app-1186', overwrite=True)
+    tb.init_datastore_v3_stub(consistency_policy=
+        datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    ndb.get_context().set_cache_policy(False)
+    return tb
+
+
+class User(object):
+    """Signed-in user returned by endpoints.get_current_user"""
+    def __init__(self, email):
+        self._email = email
+
+    def email(self):
+        return self._email
+
+    def nickname(self):
+        return self._email.split('@')[0]
+
+
+def signIn(email):
+    """Make endpoints.get_current_user return a user with an email"""
+    import endpoints
+    user = User(email)
+    endpoints.get_current_user = lambda: user
+
+
+def percentile(values, p):
+    """Return the p-th percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+class Timer(object):
+    """Context manager measuring wall time in seconds"""
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.time() - self.start
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Memcache entries of the conference API, refreshed by cron jobs and tasks
+
+Lives outside conference.py so that main.py can refresh them without
+importing the Endpoints and ProtoRPC service stack. Values are written and
+read through cachecodec.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from cachecodec import setCached
+from speakers import getSpeakerSessions
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+FEED_VERSION_KEY = "FEED_VERSION:%s"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+
+
+def nearlySoldOut(confs):
+    """Return the names of the nearly sold out conferences of a batch"""
+    return {'nearlySoldOut': [conf.name for conf in confs
+                              if 0 < (conf.seatsAvailable or 0) <= 5]}
+
+
+def cacheAnnouncement(result):
+    """
+    Create announcement and assign to memcache; the reducer of the
+    set_announcement job
+    """
+    names = sorted(result.get('nearlySoldOut', []))
+
+    if names:
+        # If there are almost sold out conferences,
+        # format announcement and set it in memcache
+        announcement = ANNOUNCEMENT_TPL % ', '.join(names)
+        setCached(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    else:
+        # If there are no sold out conferences
+        # delete the memcache announcements entry
+        announcement = ""
+        memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+
+    return announcement
+
+
+def cacheFeaturedSpeaker(speaker, conference_key):
+    """
+    Cache speaker data and the Sessions of this speaker if he is a
+    featured one (has more than one session)
+    """
+    parent_key = ndb.Key(urlsafe=conference_key)
+    speaker_sessions_objects = getSpeakerSessions(speaker, parent_key)
+    speaker_sessions_names = [speaker_session_object.name for speaker_session_object in speaker_sessions_objects]
+    if(len(speaker_sessions_names) > 1):
+        speaker_sessions = ', '.join(speaker_sessions_names)
+        cache_data = {}
+        cache_data['speaker'] = speaker
+        cache_data['speaker_sessions'] = speaker_sessions
+        setCached(FEATURED_SPEAKER_KEY+conference_key, cache_data)
+
+
+def bumpFeedVersion(user_id):
+    """
+    Invalidate the cached iCalendar feed of a user (see feeds.py); when the
+    version was evicted, the next read starts a new one anyway
+    """
+    memcache.incr(FEED_VERSION_KEY % user_id)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""cachecodec.py
+
+Compact, compressed and chunked encoding of memcache values
+
+Values are pickled with the highest protocol and zlib compressed when they
+are over CODEC_COMPRESS_THRESHOLD bytes and compression pays off. Every
+encoded value starts with a format version and flags byte, so values
+written by another format version read as misses instead of garbage.
+
+Values still over CODEC_CHUNK_SIZE after that are split into chunks under
+keys carrying a random generation id, written with one set_multi, and the
+key itself gets a small manifest (generation, chunk count, length, CRC32).
+Readers get the manifest, then every chunk with one get_multi, and verify
+the checksum; a missing chunk or a mismatch is a miss. A rewrite uses a new
+generation, so readers never mix chunks of two writes.
+
+"""
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import os
+import binascii
+import struct
+import zlib
+
+from google.appengine.api import memcache
+
+CODEC_VERSION = 1
+CODEC_COMPRESS_THRESHOLD = 1024     # bytes of pickle before trying zlib
+CODEC_COMPRESS_LEVEL = 6
+CODEC_CHUNK_SIZE = 1000000 - 1024   # under the 1 MB item limit, with key room
+CODEC_CHUNK_KEY = '%s:chunk:%s:%d'
+
+_FLAG_ZLIB = 1
+_FLAG_CHUNKED = 2
+_HEADER = struct.Struct('!BB')
+_MANIFEST = struct.Struct('!8sIII')     # generation, chunks, length, crc32
+
+
+def encodeValue(value):
+    """Return the bytes of a value: header, then pickle, compressed if it pays"""
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    flags = 0
+    if len(data) > CODEC_COMPRESS_THRESHOLD:
+        compressed = zlib.compress(data, CODEC_COMPRESS_LEVEL)
+        if len(compressed) < len(data):
+            data, flags = compressed, _FLAG_ZLIB
+    return _HEADER.pack(CODEC_VERSION, flags) + data
+
+
+def _decode(data):
+    """Return (flags, payload) of encoded bytes, or None if not decodable"""
+    if not isinstance(data, bytes) or len(data) < _HEADER.size:
+        return None
+    version, flags = _HEADER.unpack(data[:_HEADER.size])
+    if version != CODEC_VERSION:
+        return None
+    return flags, data[_HEADER.size:]
+
+
+def decodeValue(data):
+    """Return the value of bytes from encodeValue, or None if they don't decode"""
+    decoded = _decode(data)
+    if not decoded or decoded[0] & _FLAG_CHUNKED:
+        return None
+    flags, payload = decoded
+    if flags & _FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    return pickle.loads(payload)
+
+
+def setCached(key, value, time=0):
+    """Cache a value under a key, in chunks if it is too big; return success"""
+    data = encodeValue(value)
+    if len(data) <= CODEC_CHUNK_SIZE:
+        return memcache.set(key, data, time=time)
+
+    generation = binascii.hexlify(os.urandom(4))
+    chunks = [data[i:i + CODEC_CHUNK_SIZE]
+              for i in range(0, len(data), CODEC_CHUNK_SIZE)]
+    mapping = dict((CODEC_CHUNK_KEY % (key, generation.decode('ascii'), i), chunk)
+                   for i, chunk in enumerate(chunks))
+    mapping[key] = _HEADER.pack(CODEC_VERSION, _FLAG_CHUNKED) + _MANIFEST.pack(
+        generation, len(chunks), len(data), zlib.crc32(data) & 0xffffffff)
+    failed = memcache.set_multi(mapping, time=time)
+    if failed:
+        # never leave a manifest pointing at missing chunks
+        memcache.delete(key)
+        return False
+    return True
+
+
+def decodeCached(key, data):
+    """
+    Return the value of what memcache held under a key, fetching its chunks
+    if it is a manifest; None when it is missing, stale or corrupt
+    """
+    decoded = _decode(data)
+    if not decoded:
+        return None
+    flags, payload = decoded
+    if not flags & _FLAG_CHUNKED:
+        return decodeValue(data)
+
+    generation, count, length, crc = _MANIFEST.unpack(payload)
+    keys = [CODEC_CHUNK_KEY % (key, generation.decode('ascii'), i)
+            for i in range(count)]
+    chunks = memcache.get_multi(keys)
+    if len(chunks) != count:
+        return None
+    data = b''.join(chunks[k] for k in keys)
+    if len(data) != length or zlib.crc32(data) & 0xffffffff != crc:
+        return None
+    return decodeValue(data)
+
+
+def getCached(key):
+    """Return the value cached under a key by setCached, or None"""
+    return decodeCached(key, memcache.get(key))
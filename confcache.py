@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""confcache.py
+
+Bounded-staleness memcache copy of conferences, for getConference reads
+with consistency=eventual
+
+Each entry holds a Conference, its organizer's display name and when they
+were read. Entries younger than CONF_CACHE_FRESH seconds are served as is.
+Older ones are still served, stale-while-revalidate, while a
+/tasks/refresh_conference task re-reads them. Nothing older than
+CONF_CACHE_MAX_STALENESS seconds is ever served.
+
+Only the holder of a per-conference memcache lease refreshes an entry, so
+when a hot entry goes stale or expires a single request or task reads the
+datastore. Everyone else keeps serving the stale copy or, when there is
+none, waits briefly for the lease holder before reading the datastore
+themselves.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+from cachecodec import getCached
+from cachecodec import setCached
+from utils import keyFromUrlsafe
+
+CONF_CACHE_KEY = 'CONF_CACHE:%s'
+CONF_CACHE_LEASE_KEY = 'CONF_CACHE_LEASE:%s'
+CONF_CACHE_FRESH = 5                # seconds an entry is served without refresh
+CONF_CACHE_MAX_STALENESS = 30       # seconds an entry may be served at all
+CONF_CACHE_LEASE_TTL = 10
+CONF_CACHE_WAITS = 3                # polls for a missing entry being filled
+CONF_CACHE_WAIT_INTERVAL = 0.05
+
+
+def _readConference(conf_key):
+    """Return (conference, organizer displayName) from the datastore"""
+    conf = conf_key.get()
+    if not conf:
+        return None, None
+    prof = conf.key.parent().get()
+    return conf, getattr(prof, 'displayName', None)
+
+
+def _store(conf_key, conf, displayName):
+    """Cache a conference as read now"""
+    setCached(CONF_CACHE_KEY % conf_key.urlsafe(),
+              {'conf': conf, 'displayName': displayName,
+               'fetched': time.time()},
+              time=CONF_CACHE_MAX_STALENESS)
+
+
+def _acquireLease(wsck):
+    """Return whether this caller got the right to refresh an entry"""
+    return memcache.add(CONF_CACHE_LEASE_KEY % wsck, 1,
+                        time=CONF_CACHE_LEASE_TTL)
+
+
+def refreshConference(wsck):
+    """Re-read a cached conference and release its lease"""
+    conf_key = keyFromUrlsafe(wsck, 'Conference')
+    if not conf_key:
+        return
+    try:
+        conf, displayName = _readConference(conf_key)
+        if conf:
+            _store(conf_key, conf, displayName)
+        else:
+            memcache.delete(CONF_CACHE_KEY % wsck)
+    finally:
+        memcache.delete(CONF_CACHE_LEASE_KEY % wsck)
+
+
+def getConferenceEventually(conf_key):
+    """
+    Return (conference, organizer displayName) of a Conference key, at most
+    CONF_CACHE_MAX_STALENESS seconds old; conference is None if not found
+    """
+    wsck = conf_key.urlsafe()
+    key = CONF_CACHE_KEY % wsck
+    for i in range(CONF_CACHE_WAITS + 1):
+        entry = getCached(key)
+        if entry:
+            age = time.time() - entry['fetched']
+            if age <= CONF_CACHE_FRESH:
+                return entry['conf'], entry['displayName']
+            if age <= CONF_CACHE_MAX_STALENESS:
+                # serve it stale and have one task refresh it
+                if _acquireLease(wsck):
+                    taskqueue.add(params={'conference_key': wsck},
+                                  url='/tasks/refresh_conference')
+                return entry['conf'], entry['displayName']
+
+        # missing or too stale: the lease holder reads the datastore
+        if _acquireLease(wsck):
+            try:
+                conf, displayName = _readConference(conf_key)
+                if conf:
+                    _store(conf_key, conf, displayName)
+                return conf, displayName
+            finally:
+                memcache.delete(CONF_CACHE_LEASE_KEY % wsck)
+        if i < CONF_CACHE_WAITS:
+            time.sleep(CONF_CACHE_WAIT_INTERVAL)
+
+    # the lease holder is slow; don't wait on it any longer
+    return _readConference(conf_key)
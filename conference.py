@@ -14,8 +14,7 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
 from datetime import datetime, timedelta, time as timed
-import json
-import os
+import logging
 import time
 
 import endpoints
@@ -23,30 +22,80 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
-from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 
+from google.appengine.api.datastore_errors import InternalError
+from google.appengine.api.datastore_errors import Timeout
+from google.appengine.api.datastore_errors import TransactionFailedError
 from google.appengine.ext import ndb
 
+from cache import FEATURED_SPEAKER_KEY
+from cache import MEMCACHE_ANNOUNCEMENTS_KEY
+from cachecodec import getCached
+from confcache import getConferenceEventually
+from errors import ConflictException
+from feeds import feedToken
+from facets import facetCounts
+from geo import GEO_MAX_RADIUS_KM
+from geo import conferencesNear
+from geo import locateConference
+from geohash import geocodeCity
+from models import BatchRequestForm
+from models import BatchResultForm
+from models import BatchResultForms
 from models import BooleanMessage
 from models import StringMessage
-from models import ConflictException
+from models import IdempotencyRecord
 from models import Profile
+from models import RelatedConferenceForm
+from models import RelatedConferenceForms
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import RegistrationMessage
+from models import SeatUpdateForm
+from models import SeatUpdatesForm
 from models import TeeShirtSize
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
-from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceStats
+from models import ConferenceStatsForm
+from models import FacetCountForm
+from models import FacetForm
+from models import StatCountForm
 from models import Session
 from models import SessionForm
 from models import SessionForms
 from models import SpeakerForm
+from ratelimit import rateLimited
+from registration import queueRegistrationEffects
+from related import getRelatedConferences
+from related import queueCoRegistration
+from seatfeed import appendSeatChange
+from seatfeed import getSeatUpdates
+from seatfeed import queueSeatChange
 from settings import WEB_CLIENT_ID
 from settings import IOS_CLIENT_ID
+from schedule import conferencesOverlap
+from schedule import nextSession
+from schedule import rangeWeeks
+from schedule import sessionsInWindow
+from speakers import getSpeakerSessions
+from speakers import putSession
+from speakers import speakerKey
+from stats import recordStatsDelta
+from stats import sessionDelta
+from transactions import runInTransaction
 from utils import getUserId
+from utils import keyFromUrlsafe
+from waitlist import getWaitlistPosition
+from waitlist import hasWaitlist
+from waitlist import joinWaitlist
+from waitlist import leaveWaitlist
+from waitlist import schedulePromotion
+from wishlist import getWishlist
+from wishlist import recordWishlistOp
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
@@ -63,8 +112,26 @@ FIELDS = {
     'TOPIC': 'topics',
     'MONTH': 'month',
     'MAX_ATTENDEES': 'maxAttendees',
+    'DATE_RANGE': 'weeks',
 }
 
+# DATE_RANGE values are "YYYY-MM-DD/YYYY-MM-DD", matched with an IN filter
+# on the weeks they cover, which takes at most 30 values
+DATE_RANGE_MAX_WEEKS = 26
+
+# fields of the composite indexes in index.yaml that serve DATE_RANGE with
+# other filters; an inequality filter must be on the last field
+DATE_RANGE_INDEXES = (
+    ('weeks',),
+    ('city', 'weeks'),
+    ('topics', 'weeks'),
+    ('weeks', 'month'),
+    ('weeks', 'maxAttendees'),
+    ('city', 'weeks', 'maxAttendees'),
+    ('topics', 'weeks', 'maxAttendees'),
+    ('city', 'topics', 'weeks', 'maxAttendees'),
+)
+
 OPERATORS = {
     'EQ':   '=',
     'GT':   '>',
@@ -79,6 +146,22 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey = messages.StringField(1, required=True),
 )
 
+# consistency=eventual serves a cached copy at most
+# CONF_CACHE_MAX_STALENESS seconds old (see confcache.py)
+CONF_READ_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey = messages.StringField(1, required=True),
+    consistency = messages.StringField(2, default='strong'),
+)
+
+# requestId is an optional client-chosen token; retrying a call with the
+# same requestId can't register (or unregister) the user twice
+CONF_REGISTER_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey = messages.StringField(1, required=True),
+    requestId = messages.StringField(2),
+)
+
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey = messages.StringField(1, required=True),
@@ -90,16 +173,53 @@ SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     speaker = messages.StringField(1, required=True)
 )
 
+SESSION_WINDOW_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    start = messages.StringField(1, required=True),
+    end = messages.StringField(2, required=True),
+    websafeConferenceKey = messages.StringField(3),
+    limit = messages.IntegerField(4, variant=messages.Variant.INT32)
+)
+SESSION_WINDOW_MAX_DAYS = 31
+SESSION_WINDOW_DEFAULT_LIMIT = 100
+SESSION_WINDOW_MAX_LIMIT = 500
+
+# read-only methods that can be batched, with the fields they require
+BATCH_METHODS = {
+    'getProfile': (),
+    'getConference': ('websafeConferenceKey',),
+    'getConferencesToAttend': (),
+    'getConferenceSessions': ('websafeConferenceKey',),
+    'getConferenceSessionsByType': ('websafeConferenceKey', 'typeOfSession'),
+    'getSessionsBySpeaker': ('speaker',),
+    'getSessionsInWishlist': (),
+}
+BATCH_MAX_ITEMS = 20
+
+SEAT_UPDATES_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    sinceToken = messages.StringField(1),
+    timeout = messages.IntegerField(2, variant=messages.Variant.INT32),
+    websafeConferenceKeys = messages.StringField(3, repeated=True)
+)
+
+CONF_NEAR_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    latitude = messages.FloatField(1),
+    longitude = messages.FloatField(2),
+    city = messages.StringField(3),
+    radiusKm = messages.FloatField(4),
+    limit = messages.IntegerField(5, variant=messages.Variant.INT32)
+)
+CONF_NEAR_DEFAULT_RADIUS_KM = 100
+CONF_NEAR_DEFAULT_LIMIT = 20
+CONF_NEAR_MAX_LIMIT = 100
+
 WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey = messages.StringField(1, required=True)
 )
 
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
-
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 @endpoints.api( name='conference',
@@ -186,8 +306,24 @@ class ConferenceApi(remote.Service):
         """Update & return user profile."""
         return self._doProfile(request)
 
+    @endpoints.method(message_types.VoidMessage, StringMessage,
+            path='profile/calendar', http_method='GET',
+            name='getCalendarFeedUrl')
+    def getCalendarFeedUrl(self, request):
+        """Return the path of the user's iCalendar feed, for calendar apps"""
+        prof = self._getProfileFromUser()
+        return StringMessage(data='/feeds/%s.ics' % feedToken(prof.key.id()))
+
 # - - - Conference objects - - - - - - - - - - - - - - - - - - -
 
+    def _conferenceKey(self, wsck):
+        """Return the key of a websafeConferenceKey, NotFoundException if it isn't one"""
+        conf_key = keyFromUrlsafe(wsck, 'Conference')
+        if not conf_key:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        return conf_key
+
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm"""
         cf = ConferenceForm()
@@ -220,6 +356,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['distanceKm']
+        del data['seatsVersion']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -252,7 +390,11 @@ class ConferenceApi(remote.Service):
         data['organizerUserId'] = request.organizerUserId = user_id
 
         # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        conf = Conference(**data)
+        locateConference(conf)
+        request.latitude, request.longitude = conf.latitude, conf.longitude
+        conf.put()
+        appendSeatChange(c_key.urlsafe(), data['seatsAvailable'], conf.seatsVersion)
 
         taskqueue.add(params={'email': user.email(), 'conferenceInfo': repr(request)},
                         url='/tasks/send_confirmation_email')
@@ -261,24 +403,29 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @rateLimited('createConference')
     def createConference(self, request):
         """Create new conference"""
         return self._createConferenceObject(request)
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_READ_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)"""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        wsck = request.websafeConferenceKey
+        if request.consistency == 'strong':
+            return self._conferenceFormAsync(wsck,
+                self._entityFetcher()).get_result()
+        if request.consistency != 'eventual':
+            raise endpoints.BadRequestException("'consistency' must be \
+                'strong' or 'eventual'.")
+
+        conf, displayName = getConferenceEventually(self._conferenceKey(wsck))
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey
-            )
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+                'No conference found with key: %s' % wsck)
+        return self._copyConferenceToForm(conf, displayName)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='getConferencesCreated',
@@ -322,8 +469,13 @@ class ConferenceApi(remote.Service):
         )
 
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters"""
+        """
+        Return formatted query from the submitted filters, and the
+        (start, end) of the DATE_RANGE filter if any, which its results
+        must still be checked against
+        """
         q = Conference.query()
+        date_range = None
         inequality_filter, filters = self._formatFilters(request.filters)
 
         # If exists, sort on inequality filter first
@@ -335,11 +487,17 @@ class ConferenceApi(remote.Service):
 
         # Create a query using all of the submitted filters
         for filtr in filters:
+            if filtr["field"] == "weeks":
+                # conferences sharing a week with the range; the caller
+                # checks the exact overlap
+                date_range = filtr["value"]
+                q = q.filter(Conference.weeks.IN(rangeWeeks(*date_range)))
+                continue
             if filtr["field"] in ["month", "maxAttendees"]:
                 filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
-        return q
+        return q, date_range
 
 
     def _formatFilters(self, filters):
@@ -357,6 +515,11 @@ class ConferenceApi(remote.Service):
                 raise endpoints.BadRequestException("Filter contains invalid \
                     field or operator.")
 
+            if filtr["field"] == "weeks":
+                filtr["value"] = self._parseDateRange(filtr, formatted_filters)
+                formatted_filters.append(filtr)
+                continue
+
             if filtr["operator"] != "=":
                 if inequality_field and inequality_field != filtr["field"]:
                     raise endpoints.BadRequestException("Inequality filter is \
@@ -364,14 +527,45 @@ class ConferenceApi(remote.Service):
                 else:
                     inequality_field = filtr["field"]
             formatted_filters.append(filtr)
+
+        fields = set(f["field"] for f in formatted_filters)
+        if "weeks" in fields and not any(
+                set(index) == fields and inequality_field in (None, index[-1])
+                for index in DATE_RANGE_INDEXES):
+            raise endpoints.BadRequestException("DATE_RANGE can't be combined \
+                with these filters.")
         return (inequality_field, formatted_filters)
 
+    def _parseDateRange(self, filtr, previous):
+        """Return the (start, end) dates of a DATE_RANGE filter"""
+        if filtr["operator"] != "=" or any(
+                f["field"] == "weeks" for f in previous):
+            raise endpoints.BadRequestException("DATE_RANGE is allowed once, \
+                with the EQ operator.")
+        try:
+            start, end = [datetime.strptime(day.strip(), "%Y-%m-%d").date()
+                          for day in (filtr["value"] or '').split('/')]
+        except ValueError:
+            raise endpoints.BadRequestException("DATE_RANGE must be \
+                YYYY-MM-DD/YYYY-MM-DD.")
+        if end < start:
+            raise endpoints.BadRequestException("DATE_RANGE ends before it \
+                starts.")
+        if len(rangeWeeks(start, end)) > DATE_RANGE_MAX_WEEKS:
+            raise endpoints.BadRequestException("DATE_RANGE may span at most \
+                %d weeks." % DATE_RANGE_MAX_WEEKS)
+        return start, end
+
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                     path='queryConferences', http_method='POST',
                     name='queryConferences')
     def queryConferences(self, request):
         """Query for conferences"""
-        conferences = self._getQuery(request)
+        query, date_range = self._getQuery(request)
+        conferences = query.fetch()
+        if date_range:
+            conferences = [conf for conf in conferences
+                           if conferencesOverlap(conf, *date_range)]
 
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
@@ -384,22 +578,124 @@ class ConferenceApi(remote.Service):
             names[profile.key.id()] = profile.displayName
 
         # Return individual ConferenceForm object per Conference
-        return ConferenceForms(
+        forms = ConferenceForms(
             items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
             conferences]
         )
+        if request.facets:
+            forms.facets = self._facetForms(request.filters)
+        return forms
+
+    def _facetForms(self, filters):
+        """Return the FacetForms of the conferences passing filters"""
+        counts = facetCounts(self._formatFilters(filters)[1]) or {}
+        # report facets under the names filters use
+        return [FacetForm(field=name, counts=[
+                    FacetCountForm(value=value, count=count)
+                    for value, count in sorted(counts[field].items(),
+                                               key=lambda item: -item[1])])
+                for name, field in sorted(FIELDS.items()) if field in counts]
+
+    @endpoints.method(CONF_NEAR_REQUEST, ConferenceForms,
+                    path='conferences/near', http_method='GET',
+                    name='searchConferencesNear')
+    def searchConferencesNear(self, request):
+        """Return conferences within radiusKm of a point or city, nearest first"""
+        if request.latitude is not None and request.longitude is not None:
+            latitude, longitude = request.latitude, request.longitude
+        elif request.city and geocodeCity(request.city):
+            latitude, longitude = geocodeCity(request.city)
+        else:
+            raise endpoints.BadRequestException("Give 'latitude' and \
+                'longitude', or a known 'city'.")
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise endpoints.BadRequestException("Invalid coordinates.")
+
+        radius = request.radiusKm or CONF_NEAR_DEFAULT_RADIUS_KM
+        if not 0 < radius <= GEO_MAX_RADIUS_KM:
+            raise endpoints.BadRequestException("'radiusKm' must be between \
+                0 and %d." % GEO_MAX_RADIUS_KM)
+        limit = min(request.limit or CONF_NEAR_DEFAULT_LIMIT,
+                    CONF_NEAR_MAX_LIMIT)
+
+        found = conferencesNear(latitude, longitude, radius, limit)
+
+        # fetch organiser displayNames with one get_multi
+        profiles = ndb.get_multi(
+            [ndb.Key(Profile, conf.organizerUserId) for _, conf in found])
+        names = dict((prof.key.id(), prof.displayName)
+                     for prof in profiles if prof)
+
+        items = []
+        for distance, conf in found:
+            cf = self._copyConferenceToForm(
+                conf, names.get(conf.organizerUserId))
+            cf.distanceKm = round(distance, 1)
+            items.append(cf)
+        return ConferenceForms(items=items)
+
+    @endpoints.method(CONF_GET_REQUEST, RelatedConferenceForms,
+                    path='conference/{websafeConferenceKey}/related',
+                    http_method='GET', name='getRelatedConferences')
+    def getRelatedConferences(self, request):
+        """Return the conferences most often registered for by the attendees
+        of a conference"""
+        return RelatedConferenceForms(items=[
+            RelatedConferenceForm(websafeKey=wsck, name=name,
+                                  coRegistrations=count)
+            for wsck, count, name in getRelatedConferences(
+                request.websafeConferenceKey)])
 
-    # The function is changing two different kind of entities, Profile and Conference.
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference"""
+        """
+        Register or unregister user for selected conference; return whether
+        anything changed and the seats now available, or what an earlier call
+        with the same requestId returned
+        """
+        # make sure the profile exists before the transaction, so creating
+        # it is not part of what gets retried
+        p_key = self._getProfileFromUser().key
+        wsck = request.websafeConferenceKey
+        request_id = getattr(request, 'requestId', None)
+
+        try:
+            # only with a requestId is it safe to retry when the commit
+            # outcome is unknown: the retry then replays the first commit
+            return runInTransaction(
+                'registration' if reg else 'unregistration',
+                lambda: self._registrationTxn(p_key, wsck, reg, request_id),
+                idempotent=bool(request_id), xg=True)
+        except (TransactionFailedError, Timeout, InternalError):
+            raise ConflictException('The conference is busy, please retry.')
+
+    def _replayedRegistration(self, request):
+        """Return what an earlier call with the requestId of request returned, if any"""
+        request_id = getattr(request, 'requestId', None)
+        user = endpoints.get_current_user()
+        if not request_id or not user:
+            return None
+        record = ndb.Key(Profile, getUserId(user),
+                         IdempotencyRecord, request_id).get()
+        return record.result if record else None
+
+    def _registrationTxn(self, p_key, wsck, reg, request_id):
+        """Transaction body of _conferenceRegistration"""
+        # The function is changing two different kind of entities, Profile and Conference.
         retval = None
-        prof = self._getProfileFromUser() # get user profile
+        conf_key = ndb.Key(urlsafe=wsck)
+        keys = [p_key, conf_key]
+        if request_id:
+            keys.append(ndb.Key(IdempotencyRecord, request_id, parent=p_key))
+        entities = ndb.get_multi(keys)
+        prof, conf = entities[:2]
+
+        # a retried call returns what the first one did
+        if request_id and entities[2]:
+            retval, seats = entities[2].result
+            return retval, seats
 
         # check if conf exists give websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
@@ -411,14 +707,17 @@ class ConferenceApi(remote.Service):
                 raise ConflictException("You have already registered for this \
                 conference")
 
-            # check if seats available
+            # check if seats available; the caller waitlists the user if not
             if conf.seatsAvailable <= 0:
-                raise ConflictException("There are not seats available for \
-                this conference.")
+                return False, conf.seatsAvailable
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
             conf.seatsAvailable -= 1
+            conf.seatsVersion += 1
+            queueCoRegistration(wsck, prof.conferenceKeysToAttend)
+            queueSeatChange(wsck, conf.seatsAvailable, conf.seatsVersion)
+            queueRegistrationEffects(wsck, p_key.id())
             retval = True
 
         # unregister
@@ -427,97 +726,130 @@ class ConferenceApi(remote.Service):
             if wsck in prof.conferenceKeysToAttend:
                 prof.conferenceKeysToAttend.remove(wsck)
                 conf.seatsAvailable += 1
+                conf.seatsVersion += 1
+                queueCoRegistration(wsck, prof.conferenceKeysToAttend, reg=False)
+                queueSeatChange(wsck, conf.seatsAvailable, conf.seatsVersion)
+                queueRegistrationEffects(wsck, p_key.id(), reg=False)
+                # hand the freed seat to the waitlist in a task, not inline;
+                # always, as a query may not show who just joined it yet
+                schedulePromotion(wsck)
                 retval = True
             else:
                 retval = False
 
         # write things back to db and return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        entities = [prof, conf]
+        if request_id:
+            entities.append(IdempotencyRecord(key=keys[2],
+                result=[retval, conf.seatsAvailable]))
+        ndb.put_multi(entities)
+        return retval, conf.seatsAvailable
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                     path='conferences/attending', http_method='GET',
                     name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for"""
-        prof = self._getProfileFromUser()
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organisers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier use
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        return ConferenceForms(items=self._conferencesToAttendAsync(
+            self._entityFetcher()).get_result())
 
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-            for conf in conferences])
-
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    def _joinWaitlist(self, wsck, seats):
+        """
+        Put user on the waitlist of a conference, returning their position;
+        seats is what the conference had free when the user was turned away
+        """
+        prof = self._getProfileFromUser()
+        if wsck in prof.conferenceKeysToAttend:
+            raise ConflictException("You have already registered for this \
+            conference")
+        position = joinWaitlist(wsck, prof.key.id())
+        # queued behind others while seats are free: hand them out now
+        # rather than when somebody unregisters
+        if seats > 0:
+            schedulePromotion(wsck)
+        return RegistrationMessage(data=False, waitlistPosition=position)
+
+    @endpoints.method(CONF_REGISTER_REQUEST, RegistrationMessage,
         path='conference/{websafeConferenceKey}', http_method='POST',
         name='registerForConference')
+    @rateLimited('registerForConference')
     def registerForConference(self, request):
-        """Register user for selected conference"""
-        return self._conferenceRegistration(request)
+        """Register user for selected conference, or waitlist them if it is full"""
+        wsck = request.websafeConferenceKey
+        conf = self._conferenceKey(wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+        # a retry returns what the first call did, even if the conference
+        # has sold out since
+        registered, seats = self._replayedRegistration(request) or \
+            (False, conf.seatsAvailable)
+        # a sold out conference, or one with users already queued, goes
+        # straight to the waitlist instead of a contended transaction
+        if not registered and seats > 0 and not hasWaitlist(wsck):
+            registered, seats = self._conferenceRegistration(request)
+        if registered:
+            return RegistrationMessage(data=True)
+        return self._joinWaitlist(wsck, seats)
+
+    @endpoints.method(CONF_REGISTER_REQUEST, BooleanMessage,
         path='conference/{websafeConferenceKey}', http_method='DELETE',
         name='unregisterFromConference')
+    @rateLimited('unregisterFromConference')
     def unregisterFromConference(self, request):
-        """Unregister user for selected conference"""
-        return self._conferenceRegistration(request, reg=False)
+        """Unregister user for selected conference, or remove them from its waitlist"""
+        wsck = request.websafeConferenceKey
+        unregistered, seats = self._conferenceRegistration(request, reg=False)
+        if unregistered:
+            return BooleanMessage(data=True)
+        user_id = getUserId(endpoints.get_current_user())
+        return BooleanMessage(data=leaveWaitlist(wsck, user_id))
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationMessage,
+        path='conference/{websafeConferenceKey}/waitlist', http_method='GET',
+        name='getWaitlistPosition')
+    def getWaitlistPosition(self, request):
+        """Return whether user is registered, or their position on the waitlist"""
+        prof = self._getProfileFromUser()
+        wsck = request.websafeConferenceKey
+        if wsck in prof.conferenceKeysToAttend:
+            return RegistrationMessage(data=True)
+        return RegistrationMessage(data=False,
+            waitlistPosition=getWaitlistPosition(wsck, prof.key.id()))
+
+    @endpoints.method(SEAT_UPDATES_REQUEST, SeatUpdatesForm,
+        path='conferences/seats', http_method='GET', name='getSeatUpdates')
+    def getSeatUpdates(self, request):
+        """
+        Return seatsAvailable of conferences changed since sinceToken, waiting
+        up to timeout seconds for a change
+        """
+        updates, next_token, resync = getSeatUpdates(request.sinceToken,
+            request.timeout, request.websafeConferenceKeys)
+        return SeatUpdatesForm(
+            items=[SeatUpdateForm(websafeConferenceKey=wsck, seatsAvailable=seats,
+                                  seatsVersion=version)
+                for wsck, (seats, version) in sorted(updates.items())],
+            nextToken=next_token,
+            resync=resync)
 
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
         path='conference/{websafeConferenceKey}/sessions', http_method='GET',
         name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Get all sessions from a specific conference"""
-
-        # fetch existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        # check that conference exists
-        if not conf:
-            raise endpoints.NotFoundException('No conference found with \
-                key: %s' % request.websafeConferenceKey)
-
-        # create ancestor query for all key matches for this conference
-        sessions = Session.query(ancestor=conf.key)
-
-        # return set of SessionForm objects per Session
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return SessionForms(items=self._conferenceSessionsAsync(
+            request.websafeConferenceKey, None, self._entityFetcher()).get_result())
 
     @endpoints.method(SESSION_GET_REQUEST, SessionForms,
         path='conference/{websafeConferenceKey}/sessions/by_type/{typeOfSession}',
         http_method='GET', name='getConferenceSessionsByType')
     def getConferenceSessionsByType(self, request):
         """Get all sessions with a specific type from a specific conference"""
-
-        typeOfSession = getattr(request, 'typeOfSession')
-
-        # fetch existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        # check that conference exists
-        if not conf:
-            raise endpoints.NotFoundException('No conference found with \
-                key %s' % request.websafeConferenceKey)
-
-        # create ancestor query for all key matches for this conference
-        sessions = Session.query(Session.typeOfSession == typeOfSession,
-            ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
-
-        # return set of ConferenceForm objects per conference
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return SessionForms(items=self._conferenceSessionsAsync(
+            request.websafeConferenceKey, request.typeOfSession,
+            self._entityFetcher()).get_result())
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
         http_method='GET', name='getLastChanceConferences')
@@ -558,23 +890,51 @@ class ConferenceApi(remote.Service):
         path='sessions/speaker/{speaker}', http_method='GET', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
         """Return all sessions given by a certain speaker, across all conferences"""
-
-        # query sessions by speaker
-        sessions = Session.query(Session.speaker == request.speaker)
-
-        # return set of ConferenceForm objects per Conference
+        return SessionForms(items=self._speakerSessionsAsync(
+            request.speaker, self._entityFetcher()).get_result())
+
+    def _parseDateTime(self, value, name):
+        """Parse a 'YYYY-MM-DDTHH:MM' request value into a datetime"""
+        try:
+            return datetime.strptime(value[:16].replace(' ', 'T'), "%Y-%m-%dT%H:%M")
+        except ValueError:
+            raise endpoints.BadRequestException("'%s' must be formatted as \
+                YYYY-MM-DDTHH:MM" % name)
+
+    @endpoints.method(SESSION_WINDOW_REQUEST, SessionForms,
+        path='sessions/window', http_method='GET', name='getSessionsInWindow')
+    def getSessionsInWindow(self, request):
+        """Return sessions starting between start and end, optionally of one conference"""
+        start = self._parseDateTime(request.start, 'start')
+        end = self._parseDateTime(request.end, 'end')
+        if end <= start:
+            raise endpoints.BadRequestException("'end' must be after 'start'.")
+        if end - start > timedelta(days=SESSION_WINDOW_MAX_DAYS):
+            raise endpoints.BadRequestException("The window may span at most \
+                %d days." % SESSION_WINDOW_MAX_DAYS)
+        if request.limit is not None and request.limit < 1:
+            raise endpoints.BadRequestException("'limit' must be positive.")
+        limit = min(request.limit or SESSION_WINDOW_DEFAULT_LIMIT,
+                    SESSION_WINDOW_MAX_LIMIT)
+        conf_key = None
+        if request.websafeConferenceKey:
+            conf_key = self._conferenceKey(request.websafeConferenceKey)
+
+        sessions = sessionsInWindow(start, end, conf_key).fetch(limit)
         return SessionForms(
             items=[self._copySessionToForm(session) for session in sessions]
         )
 
     @endpoints.method(SessionForm, SessionForm, path='createSession', http_method='POST',
         name='createSession')
+    @rateLimited('createSession')
     def createSession(self, request):
         """The organizer of the conference can use this method to create a session"""
         return self._createSessionObject(request)
 
     @endpoints.method(WISHLIST_POST_REQUEST, SessionForm, path='profile/wishlist',
         http_method='POST', name='addSessionToWishlist')
+    @rateLimited('addSessionToWishlist')
     def addSessionToWishList(self, request):
         """Saves a session to a user's wishlist"""
         user = endpoints.get_current_user()
@@ -593,18 +953,18 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser()
 
         # check if session already added to wishlist
-        if session.key in prof.sessionsToAttend:
+        if session.key in getWishlist(prof):
             raise endpoints.BadRequestException('Session already saved to \
                 wishlist: %s' % request.websafeSessionKey)
 
-        # append to user profile's wishlist
-        prof.sessionsToAttend.append(session.key)
-        prof.put()
+        # journal the append; the profile is written behind by a task
+        recordWishlistOp(prof, 'add', session.key.urlsafe())
 
         return self._copySessionToForm(session)
 
     @endpoints.method(WISHLIST_POST_REQUEST, BooleanMessage, path='profile/wishlist',
         http_method='DELETE', name='deleteSessionInWishlist')
+    @rateLimited('deleteSessionInWishlist')
     def deleteSessionInWishList(self, request):
         """Delete a session from a user's wishlist"""
         retval = None
@@ -623,9 +983,8 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser()
 
         # check if session already added to wishlist
-        if session.key in prof.sessionsToAttend:
-            prof.sessionsToAttend.remove(session.key)
-            prof.put()
+        if session.key in getWishlist(prof):
+            recordWishlistOp(prof, 'remove', session.key.urlsafe())
             retval = True
         else:
             retval = False
@@ -636,19 +995,8 @@ class ConferenceApi(remote.Service):
         http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
         """Return a user's wishlist of sessions"""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required.')
-
-        # fetch profile and wishlist
-        prof = self._getProfileFromUser()
-        session_keys = prof.sessionsToAttend
-        sessions = [session_key.get() for session_key in session_keys]
-
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return SessionForms(items=self._wishlistSessionsAsync(
+            self._entityFetcher()).get_result())
 
     @endpoints.method(message_types.VoidMessage, SessionForms, http_method='GET',
         name='getNonWorkshopsBeforeSevenPm')
@@ -677,7 +1025,7 @@ class ConferenceApi(remote.Service):
         for field in sf.all_fields():
             if hasattr(session, field.name):
                  # convert Date and Time to date string
-                if field.name in ['startTime', 'date']:
+                if field.name in ['startTime', 'date', 'startDateTime', 'endDateTime']:
                     setattr(sf, field.name, str(getattr(session, field.name)))
                 # if fields are not Date or Time, just copy the string
                 else:
@@ -696,6 +1044,9 @@ class ConferenceApi(remote.Service):
 
         if not request.name:
             raise endpoints.BadRequestException("Session 'name' field required.")
+        if request.speaker is not None and not speakerKey(request.speaker):
+            raise endpoints.BadRequestException(
+                "Session 'speaker' must contain a name.")
 
         # fetch and check conference
         conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
@@ -724,11 +1075,20 @@ class ConferenceApi(remote.Service):
         child_id = Session.allocate_ids(size=1, parent=parent_key)[0]
         child_key = ndb.Key(Session, child_id, parent=parent_key)
         data['key'] = child_key
+        data['speakerKey'] = speakerKey(data['speaker'])
 
         del data['websafeConferenceKey']
         del data['websafeKey']
+        # computed from date, startTime and duration
+        del data['startDateTime']
+        del data['endDateTime']
 
-        Session(**data).put()
+        # the session and its speaker's index of sessions, in one transaction
+        session = Session(**data)
+        created = time.time()
+        putSession(session)
+        recordStatsDelta(request.websafeConferenceKey,
+                         sessionDelta(session, at=created))
 
         # When a new session is added to a conference, check the speaker.
         # If there is more than one session by this speaker at this conference,
@@ -744,58 +1104,193 @@ class ConferenceApi(remote.Service):
 
         return self._copySessionToForm(child_key.get())
 
-# - - - Announcements - - - - - - - - - - - - - - - - - - - -
+# - - - Conference Stats - - - - - - - - - - - - - - - - - - -
 
-    @staticmethod
-    def _cacheAnnouncement():
-        """
-        Create announcement and assign to memcache; used by memcache cron job
-        and putAnnouncement()
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+    def _copyStatsToForm(self, stats, websafeConferenceKey):
+        """Copy relevant fields from ConferenceStats to ConferenceStatsForm"""
+        sf = ConferenceStatsForm(websafeConferenceKey=websafeConferenceKey)
+        for field in sf.all_fields():
+            value = getattr(stats, field.name, None)
+            if value is None:
+                continue
+            # convert histograms to sorted name/value pairs, datetimes to strings
+            if isinstance(value, dict):
+                setattr(sf, field.name, [StatCountForm(name=k, value=v)
+                    for k, v in sorted(value.items())])
+            elif field.name.startswith('last'):
+                setattr(sf, field.name, str(value))
+            else:
+                setattr(sf, field.name, value)
+        sf.check_initialized()
+        return sf
+
+    @endpoints.method(CONF_GET_REQUEST, ConferenceStatsForm,
+        path='conference/{websafeConferenceKey}/stats', http_method='GET',
+        name='getConferenceStats')
+    def getConferenceStats(self, request):
+        """Return pre-aggregated statistics of a conference to its organizer"""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
 
-        return announcement
+        wsck = request.websafeConferenceKey
+        conf = self._conferenceKey(wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if conf.organizerUserId != getUserId(user):
+            raise endpoints.ForbiddenException(
+                'Only the conference organizer can view its stats.')
+
+        stats = ndb.Key(ConferenceStats, wsck).get() or ConferenceStats()
+        return self._copyStatsToForm(stats, wsck)
+
+# - - - Batch - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _entityFetcher(self):
+        """Return a get_async that fetches each key at most once"""
+        futures = {}
+        def fetch(key):
+            if key not in futures:
+                futures[key] = key.get_async()
+            return futures[key]
+        return fetch
+
+    @ndb.tasklet
+    def _profileAsync(self, fetch):
+        """Return user Profile, creating new one if non-existent"""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        prof = yield fetch(ndb.Key(Profile, getUserId(user)))
+        raise ndb.Return(prof or self._getProfileFromUser())
+
+    @ndb.tasklet
+    def _conferenceFormAsync(self, wsck, fetch):
+        """Return the ConferenceForm of a conference (by websafeConferenceKey)"""
+        # get Conference object from request; bail if not found
+        conf = yield fetch(self._conferenceKey(wsck))
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        prof = yield fetch(conf.key.parent())
+        raise ndb.Return(self._copyConferenceToForm(conf, getattr(prof, 'displayName')))
+
+    @ndb.tasklet
+    def _conferencesToAttendAsync(self, fetch):
+        """Return the ConferenceForms of the conferences user registered for"""
+        prof = yield self._profileAsync(fetch)
+        conferences = yield [fetch(ndb.Key(urlsafe=wsck))
+            for wsck in prof.conferenceKeysToAttend]
+        conferences = [conf for conf in conferences if conf]
+
+        # get organisers
+        profiles = yield [fetch(ndb.Key(Profile, conf.organizerUserId))
+            for conf in conferences]
+        names = dict((p.key.id(), p.displayName) for p in profiles if p)
+        raise ndb.Return([self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+            for conf in conferences])
+
+    @ndb.tasklet
+    def _conferenceSessionsAsync(self, wsck, typeOfSession, fetch):
+        """Return the SessionForms of a conference, optionally of one type only"""
+        # fetch the conference and run the ancestor query in parallel
+        conf_key = self._conferenceKey(wsck)
+        query = Session.query(ancestor=conf_key)
+        if typeOfSession:
+            query = query.filter(Session.typeOfSession == typeOfSession)
+        conf, sessions = yield fetch(conf_key), query.fetch_async()
+
+        # check that conference exists
+        if not conf:
+            raise endpoints.NotFoundException('No conference found with \
+                key: %s' % wsck)
+        raise ndb.Return([self._copySessionToForm(session) for session in sessions])
+
+    @ndb.tasklet
+    def _speakerSessionsAsync(self, speaker, fetch):
+        """Return the SessionForms of a speaker, across all conferences"""
+        # read the speaker's index of sessions instead of querying all sessions
+        key = speakerKey(speaker)
+        spk = (yield fetch(key)) if key else None
+        if not spk:
+            raise ndb.Return([])
+        sessions = yield [fetch(key) for key in spk.sessionKeys]
+        raise ndb.Return([self._copySessionToForm(s) for s in sessions if s])
+
+    @ndb.tasklet
+    def _wishlistSessionsAsync(self, fetch):
+        """Return the SessionForms of user's wishlist"""
+        # fetch profile and wishlist, including mutations not written yet
+        prof = yield self._profileAsync(fetch)
+        sessions = yield [fetch(key) for key in getWishlist(prof)]
+        raise ndb.Return([self._copySessionToForm(s) for s in sessions if s])
+
+    @ndb.tasklet
+    def _batchItemAsync(self, item, fetch):
+        """Run one call of a batch, returning its result or error"""
+        result = BatchResultForm(method=item.method, code=200)
+        try:
+            if item.method not in BATCH_METHODS:
+                raise endpoints.BadRequestException(
+                    'Method cannot be batched: %s' % item.method)
+            for field in BATCH_METHODS[item.method]:
+                if not getattr(item, field):
+                    raise endpoints.BadRequestException(
+                        "'%s' field required for %s" % (field, item.method))
+
+            if item.method == 'getProfile':
+                prof = yield self._profileAsync(fetch)
+                result.profile = self._copyProfileToForm(prof)
+            elif item.method == 'getConference':
+                result.conference = yield self._conferenceFormAsync(
+                    item.websafeConferenceKey, fetch)
+            elif item.method == 'getConferencesToAttend':
+                result.conferences = yield self._conferencesToAttendAsync(fetch)
+            elif item.method == 'getConferenceSessions':
+                result.sessions = yield self._conferenceSessionsAsync(
+                    item.websafeConferenceKey, None, fetch)
+            elif item.method == 'getConferenceSessionsByType':
+                result.sessions = yield self._conferenceSessionsAsync(
+                    item.websafeConferenceKey, item.typeOfSession, fetch)
+            elif item.method == 'getSessionsBySpeaker':
+                result.sessions = yield self._speakerSessionsAsync(item.speaker, fetch)
+            elif item.method == 'getSessionsInWishlist':
+                result.sessions = yield self._wishlistSessionsAsync(fetch)
+        except endpoints.ServiceException as e:
+            result.code = e.http_status
+            result.error = str(e)
+        except Exception:
+            # one failing call must not fail the calls batched with it
+            logging.exception('Batched %s failed', item.method)
+            result.code = 500
+            result.error = 'Internal error'
+        raise ndb.Return(result)
+
+    @endpoints.method(BatchRequestForm, BatchResultForms,
+        path='batch', http_method='POST', name='batch')
+    def batch(self, request):
+        """Run several read-only methods concurrently, returning results in order"""
+        if len(request.items) > BATCH_MAX_ITEMS:
+            raise endpoints.BadRequestException(
+                'A batch can hold at most %d calls.' % BATCH_MAX_ITEMS)
+
+        # all calls share one fetcher, so keys they have in common are read once
+        fetch = self._entityFetcher()
+        futures = [self._batchItemAsync(item, fetch) for item in request.items]
+        return BatchResultForms(items=[future.get_result() for future in futures])
+
+# - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                         path='conference/announcement/get',
                         http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return announcement from memcache"""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        return StringMessage(data=getCached(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
 
 # - - - Featured Speaker - - - - - - - - - - - - - - - - - - - -
 
-    @staticmethod
-    def _cacheFeaturedSpeaker(speaker, conference_key):
-        """
-        Cache speaker data and the Sessions of this speaker if he is a
-        featured one (has more than one session)
-        """
-        parent_key = ndb.Key(urlsafe=conference_key)
-        speaker_sessions_objects = Session.query(Session.speaker == speaker, ancestor=parent_key)
-        speaker_sessions_names = [speaker_session_object.name for speaker_session_object in speaker_sessions_objects]
-        if(len(speaker_sessions_names) > 1):
-            speaker_sessions = ', '.join(speaker_sessions_names)
-            cache_data = {}
-            cache_data['speaker'] = speaker
-            cache_data['speaker_sessions'] = speaker_sessions
-            memcache.set(FEATURED_SPEAKER_KEY+conference_key, cache_data)
-
     @endpoints.method(CONF_GET_REQUEST, SpeakerForm,
                         path='conference/featured_speaker/get',
                         http_method='GET', name='getFeaturedSpeaker')
@@ -804,7 +1299,7 @@ class ConferenceApi(remote.Service):
         conference_key = request.websafeConferenceKey
 
         # get data from memcache
-        data = memcache.get(FEATURED_SPEAKER_KEY+conference_key)
+        data = getCached(FEATURED_SPEAKER_KEY+conference_key)
 
         sessions = []
         speaker_sessions = []
@@ -819,11 +1314,10 @@ class ConferenceApi(remote.Service):
         else:
             # if data does not exist or keys do not exist, then get the data of
             #the next upcoming session to return it
-            upcoming_session = Session.query(Session.date >= datetime.now())\
-                                .order(Session.date, Session.startTime).get()
+            upcoming_session = nextSession(datetime.now())
             if upcoming_session:
                 speaker = upcoming_session.speaker
-                sessions = Session.query(Session.speaker == speaker)
+                sessions = getSpeakerSessions(speaker)
                 speaker_sessions = ', '.join([session.name for session in sessions])
 
         speaker_form = SpeakerForm()
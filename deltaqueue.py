@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""deltaqueue.py
+
+Write-behind deltas on a pull queue, applied by one named flush per window
+
+Shared by stats.py (ConferenceStats) and related.py (RelatedConferences).
+Writers add each delta as a pull task tagged with the websafe conference
+key of the row it changes, and schedule a named push task that flushes
+that row when the current window is over. Every delta enqueued during a
+window is therefore followed by exactly one flush, which leases all
+pending deltas of the row, merges them and applies them in a single write.
+
+Deltas are durable once enqueued, but a flush that commits and then fails
+to delete its leased deltas will re-apply them after the lease expires;
+the rebuild jobs recompute the rows from scratch to reconcile that.
+
+"""
+
+import json
+import time
+
+from google.appengine.api import taskqueue
+
+DELTA_LEASE_SECONDS = 60
+DELTA_LEASE_BATCH = 500
+DELTA_ADD_BATCH = 100           # tasks per Queue.add call
+
+
+def recordDeltas(queue_name, deltas, flush_url, window_seconds, name=None):
+    """
+    Queue the {websafeConferenceKey: delta} of one write and make sure a
+    flush of each row is scheduled for them; named deltas are queued once
+    """
+    tasks = [taskqueue.Task(name='%s-%d' % (name, i) if name else None,
+                            payload=json.dumps(delta), method='PULL', tag=row)
+             for i, (row, delta) in enumerate(sorted(deltas.items()))]
+    queue = taskqueue.Queue(queue_name)
+    for start in range(0, len(tasks), DELTA_ADD_BATCH):
+        try:
+            queue.add(tasks[start:start + DELTA_ADD_BATCH])
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            # queued by an earlier call with the same name, which may have
+            # died before the other batches or the flush; the rest of the
+            # batch is still added
+            pass
+
+    # one named flush per row and window coalesces bursts of deltas
+    window = int(time.time() / window_seconds)
+    for row in deltas:
+        try:
+            taskqueue.add(
+                name='%s-%s-%d' % (queue_name, row, window),
+                params={'conference_key': row},
+                url=flush_url,
+                countdown=window_seconds)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+
+def flushDeltas(queue_name, row, merge, apply):
+    """
+    Lease all pending deltas of a row and apply them: merge(total, delta)
+    folds each into one, apply(row, total) writes it
+    """
+    queue = taskqueue.Queue(queue_name)
+    while True:
+        tasks = queue.lease_tasks_by_tag(DELTA_LEASE_SECONDS,
+            DELTA_LEASE_BATCH, tag=row)
+        if not tasks:
+            break
+        total = {}
+        for task in tasks:
+            merge(total, json.loads(task.payload))
+        apply(row, total)
+        queue.delete_tasks(tasks)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+"""errors.py
+
+Endpoints exceptions of the conference API
+
+Kept apart from models.py so that the datastore models can be imported by
+cron and task handlers without loading Google Cloud Endpoints.
+
+"""
+
+import httplib
+import endpoints
+
+
+class ConflictException(endpoints.ServiceException):
+    """ConflictException -- exception mapped to HTTP 409 response"""
+    http_status = httplib.CONFLICT
+
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 503 response
+
+    Endpoints v1 turns 4xx codes it doesn't know, 429 included, into 404, so
+    over-limit calls use 503, which clients already retry with backoff. It
+    only sends the message to clients, so the seconds to wait are part of
+    it, as "retry after <n> seconds"; retry_after holds them for callers on
+    the server.
+    """
+    http_status = httplib.SERVICE_UNAVAILABLE
+
+    def __init__(self, message=None, retry_after=None):
+        super(TooManyRequestsException, self).__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Facet counts for queryConferences from a columnar, per-instance read model
+
+The /crons/build_facets job scans all conferences with a cursor and stores
+their filterable fields as zlib compressed JSON columns: city and topics
+dictionary encoded, topics as offsets into a flat column of codes, month,
+maxAttendees and the first and last day (as date ordinals) as integers (-1
+when unset). The compressed columns are split into FacetSnapshotPart
+entities under the datastore's 1 MB entity limit and written first; the
+FacetSnapshot pointer then switches to the new version in one transaction,
+and the version goes to memcache. Each instance keeps the decoded columns
+in arrays and reloads them when the memcache version changes, checking at
+most every FACET_VERSION_CHECK seconds.
+
+Filters are evaluated the way the datastore evaluates them (a repeated
+property matches when any value does, an unset one sorts before every
+value), once per dictionary entry for city and topic and once per row for
+the integer columns. The facet counts are
+over the matching rows, as of the last snapshot.
+
+"""
+
+from array import array
+from datetime import datetime
+import json
+import operator
+import time
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import FacetSnapshot
+from models import FacetSnapshotPart
+
+FACET_BATCH_SIZE = 500
+FACET_PART_MAX_BYTES = 900000   # compressed, under the 1 MB entity limit
+FACET_PUT_MAX_PARTS = 4         # parts written per put_multi
+FACET_SNAPSHOT_ID = 'current'
+FACET_VERSION_KEY = 'FACETS_VERSION'
+FACET_VERSION_CHECK = 10        # seconds between memcache version checks
+# lower bounds of the maxAttendees facet buckets
+FACET_ATTENDEE_BUCKETS = (0, 100, 500, 1000)
+
+COMPARATORS = {
+    '=': operator.eq,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
+
+# operators an unset value passes: the datastore orders null before any value
+UNSET_OPERATORS = ('<', '<=', '!=')
+
+# columns of the current snapshot on this instance, swapped as a whole
+_state = {'model': None, 'checked': 0}
+
+
+def _encode(value, dictionary, codes):
+    """Return the dictionary code of a value, adding it if new"""
+    if value not in codes:
+        codes[value] = len(dictionary)
+        dictionary.append(value)
+    return codes[value]
+
+
+def buildFacetSnapshot():
+    """Scan all conferences into a new columnar snapshot and publish its version"""
+    cities, city_codes = [], {}
+    topics, topic_codes = [], {}
+    columns = {'city': [], 'month': [], 'maxAttendees': [],
+               'startDay': [], 'endDay': [],
+               'topicOffsets': [0], 'topicCodes': []}
+
+    query = Conference.query()
+    cursor, more = None, True
+    while more:
+        confs, cursor, more = query.fetch_page(FACET_BATCH_SIZE,
+                                               start_cursor=cursor)
+        for conf in confs:
+            columns['city'].append(_encode(conf.city, cities, city_codes))
+            columns['month'].append(-1 if conf.month is None else conf.month)
+            columns['maxAttendees'].append(
+                -1 if conf.maxAttendees is None else conf.maxAttendees)
+            start = conf.startDate
+            end = max(conf.endDate or start, start) if start else None
+            columns['startDay'].append(start.toordinal() if start else -1)
+            columns['endDay'].append(end.toordinal() if end else -1)
+            columns['topicCodes'].extend(
+                _encode(topic, topics, topic_codes) for topic in set(conf.topics))
+            columns['topicOffsets'].append(len(columns['topicCodes']))
+
+    version = datetime.now().strftime('%Y%m%d%H%M%S')
+    columns.update(cities=cities, topics=topics)
+    data = zlib.compress(json.dumps(columns).encode('utf-8'))
+
+    # write the new version first; nobody reads it until the pointer moves
+    parts = [FacetSnapshotPart(id='%s/%d' % (version, i), version=version,
+                               data=data[start:start + FACET_PART_MAX_BYTES])
+             for i, start in enumerate(range(0, len(data), FACET_PART_MAX_BYTES))]
+    for start in range(0, len(parts), FACET_PUT_MAX_PARTS):
+        ndb.put_multi(parts[start:start + FACET_PUT_MAX_PARTS])
+    previous = _swapSnapshot(version, len(parts))
+    memcache.set(FACET_VERSION_KEY, version)
+
+    # keep the previous version for instances still loading it, drop the rest
+    stale = FacetSnapshotPart.query(
+        FacetSnapshotPart.version < (previous or version)).fetch(keys_only=True)
+    ndb.delete_multi(stale)
+    return version
+
+
+@ndb.transactional
+def _swapSnapshot(version, parts):
+    """Point the facet read model to a new version, returning the previous one"""
+    pointer = FacetSnapshot.get_by_id(FACET_SNAPSHOT_ID)
+    previous = pointer.version if pointer else None
+    FacetSnapshot(id=FACET_SNAPSHOT_ID, version=version, parts=parts).put()
+    return previous
+
+
+def _snapshotData(snapshot):
+    """Return the compressed columns of a snapshot, None if a part is gone"""
+    if not snapshot.parts:
+        # stored inline, before snapshots had parts
+        return snapshot.data
+    parts = ndb.get_multi([
+        ndb.Key(FacetSnapshotPart, '%s/%d' % (snapshot.version, i))
+        for i in range(snapshot.parts)])
+    if not all(parts):
+        return None
+    return b''.join(part.data for part in parts)
+
+
+def _loadModel():
+    """Return the columns of the current snapshot, reloading them if stale"""
+    model = _state['model']
+    now = time.time()
+    if model and now - _state['checked'] < FACET_VERSION_CHECK:
+        return model
+    _state['checked'] = now
+    version = memcache.get(FACET_VERSION_KEY)
+    if model and version == model['version']:
+        return model
+
+    snapshot = FacetSnapshot.get_by_id(FACET_SNAPSHOT_ID)
+    if not snapshot:
+        return None
+    if not version:
+        memcache.add(FACET_VERSION_KEY, snapshot.version)
+    if not model or snapshot.version != model['version']:
+        data = _snapshotData(snapshot)
+        if data is None:
+            # replaced and dropped while we read it; keep what we have
+            return model
+        columns = json.loads(zlib.decompress(data))
+        # snapshots built before the date columns existed
+        unset = [-1] * len(columns['city'])
+        columns.setdefault('startDay', unset)
+        columns.setdefault('endDay', unset)
+        model = {
+            'version': snapshot.version,
+            'cities': columns['cities'],
+            'topics': columns['topics'],
+            'city': array('i', columns['city']),
+            'month': array('i', columns['month']),
+            'maxAttendees': array('i', columns['maxAttendees']),
+            'startDay': array('i', columns['startDay']),
+            'endDay': array('i', columns['endDay']),
+            'topicOffsets': array('i', columns['topicOffsets']),
+            'topicCodes': array('i', columns['topicCodes']),
+        }
+        _state['model'] = model
+    return model
+
+
+def _dictionaryMask(dictionary, compare, value, unset):
+    """Return, per dictionary code, whether its value passes a filter"""
+    return [compare(entry, value) if entry is not None else unset
+            for entry in dictionary]
+
+
+def _matchingRows(model, filters):
+    """Return the indexes of the rows passing every filter"""
+    rows = range(len(model['city']))
+    for filtr in filters:
+        compare = COMPARATORS[filtr['operator']]
+        unset = filtr['operator'] in UNSET_OPERATORS
+        field, value = filtr['field'], filtr['value']
+        if field == 'city':
+            mask = _dictionaryMask(model['cities'], compare, value, unset)
+            column = model['city']
+            rows = [i for i in rows if mask[column[i]]]
+        elif field == 'weeks':
+            # DATE_RANGE: the exact overlap with the (start, end) dates
+            first, last = value[0].toordinal(), value[1].toordinal()
+            starts, ends = model['startDay'], model['endDay']
+            rows = [i for i in rows
+                    if 0 <= starts[i] <= last and ends[i] >= first]
+        elif field == 'topics':
+            mask = _dictionaryMask(model['topics'], compare, value, False)
+            offsets, codes = model['topicOffsets'], model['topicCodes']
+            rows = [i for i in rows
+                    if any(mask[c] for c in codes[offsets[i]:offsets[i + 1]])]
+        else:
+            column, value = model[field], int(value)
+            rows = [i for i in rows if (compare(column[i], value)
+                                        if column[i] >= 0 else unset)]
+    return rows
+
+
+def _attendeeBucket(value):
+    """Return the label of the maxAttendees bucket of a value"""
+    bounds = FACET_ATTENDEE_BUCKETS
+    for low, high in zip(bounds, bounds[1:]):
+        if value < high:
+            return '%d-%d' % (low, high - 1)
+    return '%d+' % bounds[-1]
+
+
+def facetCounts(filters):
+    """
+    Return {field: {value: count}} over the conferences passing filters
+    (as formatted by ConferenceApi._formatFilters), or None when no
+    snapshot has been built yet
+    """
+    model = _loadModel()
+    if not model:
+        return None
+    rows = _matchingRows(model, filters)
+
+    city_counts = [0] * len(model['cities'])
+    topic_counts = [0] * len(model['topics'])
+    months = {}
+    attendees = {}
+    offsets, codes = model['topicOffsets'], model['topicCodes']
+    for i in rows:
+        city_counts[model['city'][i]] += 1
+        for c in codes[offsets[i]:offsets[i + 1]]:
+            topic_counts[c] += 1
+        month = model['month'][i]
+        if month > 0:
+            months[str(month)] = months.get(str(month), 0) + 1
+        if model['maxAttendees'][i] >= 0:
+            bucket = _attendeeBucket(model['maxAttendees'][i])
+            attendees[bucket] = attendees.get(bucket, 0) + 1
+
+    return {
+        'city': dict((city, n) for city, n in zip(model['cities'], city_counts)
+                     if n and city is not None),
+        'topics': dict((topic, n) for topic, n in zip(model['topics'], topic_counts)
+                       if n),
+        'month': months,
+        'maxAttendees': attendees,
+    }
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""fanout.py
+
+Sharded, checkpointed fan-out of maintenance jobs over a datastore kind
+
+startJob splits the keyspace of the job's kind into key ranges, sampling
+split points from the __scatter__ property, and queues one
+/tasks/fanout_shard task per range. Each task maps one batch of its range,
+then in a transaction merges the batch result into the shard, saves the
+query cursor and queues the task of the next batch. Each shard marks
+itself done and queues /tasks/fanout_reduce in its own last checkpoint,
+so finishing shards never write the FanoutJob entity. The reduce task
+counts the shards that are done. The one that finds all of them done
+claims the job, merges the shard results and hands them to the job's
+reducer.
+
+Tasks carry the step they were queued for, so a task delivered twice, or
+retried after its checkpoint committed, does nothing. A batch whose
+checkpoint fails is mapped again, so mappers must be idempotent. Only the
+reduce task that claimed a job runs its reducer, and again if that task
+is retried.
+
+Only the datastore and the task queue are used, so jobs run the same way
+on the dev server stubs. The stubs don't maintain __scatter__; there every
+job runs as a single shard.
+
+Jobs are registered with registerJob (see jobs.py) and started by name.
+
+"""
+
+from datetime import datetime
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.datastore.datastore_query import PropertyOrder
+from google.appengine.ext import ndb
+
+from models import FanoutJob
+from models import FanoutShard
+
+FANOUT_SHARDS = 8
+FANOUT_BATCH_SIZE = 100
+FANOUT_OVERSAMPLE = 32          # __scatter__ samples drawn per shard
+
+# registered jobs, by name
+JOBS = {}
+
+
+def registerJob(name, kind, mapper, reducer=None, shards=FANOUT_SHARDS,
+                batch_size=FANOUT_BATCH_SIZE, keys_only=False):
+    """
+    Register a job mapping batches of entities (or keys) of a kind.
+    mapper(batch) returns a dict merged into the job result with
+    mergeResults; reducer(result) is called once with the merged result.
+    """
+    JOBS[name] = {'kind': kind, 'mapper': mapper, 'reducer': reducer,
+                  'shards': shards, 'batch_size': batch_size,
+                  'keys_only': keys_only}
+
+
+def mergeResults(total, partial):
+    """Merge a partial result into total: numbers add, lists concatenate"""
+    for name, value in (partial or {}).items():
+        if isinstance(value, dict):
+            mergeResults(total.setdefault(name, {}), value)
+        elif isinstance(value, list):
+            total[name] = total.get(name, []) + value
+        else:
+            total[name] = total.get(name, 0) + value
+    return total
+
+
+def _scatterSplits(kind, shards):
+    """Return up to shards - 1 keys splitting a kind into even ranges"""
+    if shards <= 1:
+        return []
+    query = ndb.Query(kind=kind, orders=PropertyOrder('__scatter__'))
+    keys = sorted(query.fetch(shards * FANOUT_OVERSAMPLE, keys_only=True))
+    if len(keys) < shards:
+        return keys
+    stride = len(keys) / float(shards)
+    splits = []
+    for i in range(1, shards):
+        key = keys[int(stride * i)]
+        if not splits or key != splits[-1]:
+            splits.append(key)
+    return splits
+
+
+def _shardKey(job_id, number):
+    """Return the key of a shard of a job"""
+    return ndb.Key(FanoutShard, '%d-%d' % (job_id, number))
+
+
+def _queueShard(job_id, number, step, transactional=False):
+    """Queue the task mapping the next batch of a shard"""
+    taskqueue.add(params={'job_id': job_id, 'shard': number, 'step': step},
+                  url='/tasks/fanout_shard', transactional=transactional)
+
+
+def startJob(name):
+    """Split the keyspace of a registered job and queue its shards; return the job id"""
+    job = JOBS[name]
+    bounds = [None] + _scatterSplits(job['kind'], job['shards']) + [None]
+
+    job_key = FanoutJob(name=name, shards=len(bounds) - 1).put()
+    job_id = job_key.id()
+    ndb.put_multi([FanoutShard(key=_shardKey(job_id, i), jobId=job_id,
+                               start=bounds[i], end=bounds[i + 1])
+                   for i in range(len(bounds) - 1)])
+    for i in range(len(bounds) - 1):
+        _queueShard(job_id, i, 0)
+    logging.info('Started job %s %d with %d shards', name, job_id,
+                 len(bounds) - 1)
+    return job_id
+
+
+@ndb.transactional
+def _checkpoint(job_id, number, step, partial, processed, cursor, more):
+    """Record a mapped batch and queue the next one, or the reduce check"""
+    shard = _shardKey(job_id, number).get()
+    if shard.done or shard.step != step:
+        return
+    shard.result = mergeResults(shard.result or {}, partial)
+    shard.processed += processed
+    shard.cursor = cursor.urlsafe() if cursor else None
+    shard.step = step + 1
+    shard.done = not more
+    shard.put()
+    if more:
+        _queueShard(job_id, number, step + 1, transactional=True)
+    else:
+        taskqueue.add(params={'job_id': job_id},
+                      url='/tasks/fanout_reduce', transactional=True)
+
+
+def runShard(job_id, number, step):
+    """Map the next batch of a shard and checkpoint it"""
+    fanout_job, shard = ndb.get_multi([ndb.Key(FanoutJob, job_id),
+                                       _shardKey(job_id, number)])
+    if not fanout_job or not shard or shard.done or shard.step != step:
+        return
+    job = JOBS[fanout_job.name]
+
+    query = ndb.Query(kind=job['kind'])
+    if shard.start:
+        query = query.filter(ndb.Model._key >= shard.start)
+    if shard.end:
+        query = query.filter(ndb.Model._key < shard.end)
+    batch, cursor, more = query.order(ndb.Model._key).fetch_page(
+        job['batch_size'], keys_only=job['keys_only'],
+        start_cursor=Cursor(urlsafe=shard.cursor) if shard.cursor else None)
+
+    partial = job['mapper'](batch) or {}
+    _checkpoint(job_id, number, step, partial, len(batch), cursor,
+                more and bool(cursor))
+
+
+@ndb.transactional
+def _claimReduce(job_key, task_name):
+    """Return whether reduce task task_name may reduce a job, claiming it if free"""
+    fanout_job = job_key.get()
+    if fanout_job.status == 'running':
+        fanout_job.status = 'reducing'
+        fanout_job.reduceTask = task_name
+        fanout_job.put()
+        return True
+    # a retry of the task that claimed it
+    return fanout_job.status == 'reducing' and fanout_job.reduceTask == task_name
+
+
+def runReduce(job_id, task_name):
+    """Once every shard is done, merge their results and hand them to the reducer"""
+    job_key = ndb.Key(FanoutJob, job_id)
+    fanout_job = job_key.get()
+    if not fanout_job or fanout_job.status == 'done':
+        return
+    shards = ndb.get_multi([_shardKey(job_id, i)
+                            for i in range(fanout_job.shards)])
+    # the shards count themselves: other shards queue their own check
+    if not all(shard.done for shard in shards):
+        return
+    if not _claimReduce(job_key, task_name):
+        return
+
+    result = {}
+    for shard in shards:
+        mergeResults(result, shard.result)
+    result['processed'] = sum(shard.processed for shard in shards)
+
+    reducer = JOBS[fanout_job.name]['reducer']
+    if reducer:
+        reducer(result)
+
+    fanout_job = job_key.get()
+    fanout_job.result = result
+    fanout_job.status = 'done'
+    fanout_job.finished = datetime.now()
+    fanout_job.put()
+    logging.info('Finished job %s %d: %d entities', fanout_job.name, job_id,
+                 result['processed'])
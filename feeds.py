@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+"""feeds.py
+
+iCalendar feed of a user's registered conferences and wishlisted sessions,
+served unauthenticated at /feeds/<token>.ics for calendar apps to poll
+
+The token is random and stored on the user's Profile, so it reveals
+nothing about the user. It is put in memcache when it is handed out, so a
+new token resolves before the feedToken query sees it; unknown tokens are
+cached briefly too, so polling one does not query the datastore every
+time. A rendered feed is cached in memcache together
+with the feed version it was rendered at; registration and wishlist
+changes bump the version (see cache.bumpFeedVersion). The ETag is the
+version itself, so a poll with a matching If-None-Match costs a single
+memcache read, and any other poll of an unchanged feed one more.
+
+"""
+
+import base64
+from datetime import datetime, timedelta
+import os
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from cache import FEED_VERSION_KEY
+from cachecodec import decodeCached
+from cachecodec import getCached
+from cachecodec import setCached
+from models import Profile
+from wishlist import getWishlist
+
+FEED_KEY = 'FEED:%s'
+FEED_TOKEN_KEY = 'FEED_TOKEN:%s'
+FEED_TOKEN_BYTES = 24
+FEED_TOKEN_MISS = ''             # cached for tokens that resolve to nobody
+FEED_TOKEN_MISS_TTL = 60
+FEED_TTL = 24 * 3600
+FEED_LINE_LENGTH = 75
+
+
+@ndb.transactional
+def _profileToken(user_id):
+    """Return the feed token of a user, creating it on their Profile if needed"""
+    prof = ndb.Key(Profile, user_id).get()
+    if not prof.feedToken:
+        prof.feedToken = base64.urlsafe_b64encode(
+            os.urandom(FEED_TOKEN_BYTES)).decode('ascii')
+        prof.put()
+    return prof.feedToken
+
+
+def feedToken(user_id):
+    """Return the feed token of a user and cache it once it is stored"""
+    token = _profileToken(user_id)
+    memcache.set(FEED_TOKEN_KEY % token, user_id, time=FEED_TTL)
+    return token
+
+
+def userIdFromToken(token):
+    """Return the user id of a feed token, or None if it is not known"""
+    user_id = memcache.get(FEED_TOKEN_KEY % token)
+    if user_id is not None:
+        return user_id or None
+    p_key = Profile.query(Profile.feedToken == token).get(keys_only=True)
+    if not p_key:
+        memcache.set(FEED_TOKEN_KEY % token, FEED_TOKEN_MISS,
+                     time=FEED_TOKEN_MISS_TTL)
+        return None
+    memcache.set(FEED_TOKEN_KEY % token, p_key.id(), time=FEED_TTL)
+    return p_key.id()
+
+
+def _escape(text):
+    """Escape a TEXT value of an iCalendar property"""
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;')\
+        .replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """
+    Split a content line into lines of at most FEED_LINE_LENGTH octets of
+    UTF-8, never inside a character
+    """
+    data = line.encode('utf-8')
+    parts = []
+    start, length = 0, FEED_LINE_LENGTH
+    while len(data) - start > length:
+        end = start + length
+        # back off continuation octets (10xxxxxx) to a character boundary
+        while ord(data[end:end + 1]) & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end])
+        # continuation lines start with a space
+        start, length = end, FEED_LINE_LENGTH - 1
+    parts.append(data[start:])
+    return '\r\n '.join(part.decode('utf-8') for part in parts)
+
+
+def _conferenceEvent(conf, stamp):
+    """Return the VEVENT lines of a conference, all-day from start to end date"""
+    end = max(conf.endDate or conf.startDate, conf.startDate) + timedelta(days=1)
+    return ['BEGIN:VEVENT',
+            'UID:%s@conference-central' % conf.key.urlsafe(),
+            'DTSTAMP:%s' % stamp,
+            'DTSTART;VALUE=DATE:%s' % conf.startDate.strftime('%Y%m%d'),
+            'DTEND;VALUE=DATE:%s' % end.strftime('%Y%m%d'),
+            'SUMMARY:%s' % _escape(conf.name),
+            'LOCATION:%s' % _escape(conf.city),
+            'DESCRIPTION:%s' % _escape(conf.description),
+            'END:VEVENT']
+
+
+def _sessionEvent(session, conf, stamp):
+    """Return the VEVENT lines of a session, timed if it has a startTime"""
+    lines = ['BEGIN:VEVENT',
+             'UID:%s@conference-central' % session.key.urlsafe(),
+             'DTSTAMP:%s' % stamp]
+    if session.startTime:
+        lines += ['DTSTART:%s' % session.startDateTime.strftime('%Y%m%dT%H%M%S'),
+                  'DTEND:%s' % session.endDateTime.strftime('%Y%m%dT%H%M%S')]
+    else:
+        lines += ['DTSTART;VALUE=DATE:%s' % session.date.strftime('%Y%m%d')]
+    lines += ['SUMMARY:%s' % _escape(session.name),
+              'DESCRIPTION:%s' % _escape('%s\n%s' % (session.speaker,
+                                                      session.highlights or ''))]
+    if conf:
+        lines.append('LOCATION:%s' % _escape('%s, %s' % (conf.name, conf.city)))
+    lines.append('END:VEVENT')
+    return lines
+
+
+def renderCalendar(user_id):
+    """Render the iCalendar feed of a user"""
+    prof = ndb.Key(Profile, user_id).get()
+    conf_keys = [ndb.Key(urlsafe=wsck)
+                 for wsck in (prof.conferenceKeysToAttend if prof else [])]
+    session_keys = getWishlist(prof) if prof else []
+
+    # conferences, sessions and the conferences of the sessions in one batch
+    keys = list(set(conf_keys) | set(k.parent() for k in session_keys))
+    entities = ndb.get_multi(keys + session_keys)
+    confs = dict(zip(keys, entities[:len(keys)]))
+    sessions = entities[len(keys):]
+
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    lines = ['BEGIN:VCALENDAR',
+             'VERSION:2.0',
+             'PRODID:-//Conference Central//Agenda//EN',
+             'CALSCALE:GREGORIAN',
+             'X-WR-CALNAME:Conference Central']
+    for key in conf_keys:
+        conf = confs.get(key)
+        if conf and conf.startDate:
+            lines += _conferenceEvent(conf, stamp)
+    for session in sessions:
+        if session and session.date:
+            lines += _sessionEvent(session, confs.get(session.key.parent()),
+                                   stamp)
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_fold(line) for line in lines) + '\r\n'
+
+
+def _currentVersion(user_id):
+    """Start the feed version of a user, one never used before"""
+    version = int(time.time() * 1000)
+    if not memcache.add(FEED_VERSION_KEY % user_id, version):
+        version = memcache.get(FEED_VERSION_KEY % user_id) or version
+    return version
+
+
+def getCalendarFeed(user_id, if_none_match=None):
+    """
+    Return (etag, feed) of a user; feed is None when if_none_match says
+    the caller already has the current one
+    """
+    version_key = FEED_VERSION_KEY % user_id
+    feed_key = FEED_KEY % user_id
+    # a conditional request only needs the version
+    cached = memcache.get_multi(
+        [version_key] if if_none_match else [version_key, feed_key])
+    version = cached.get(version_key) or _currentVersion(user_id)
+    etag = '"%d"' % version
+    if if_none_match == etag:
+        return etag, None
+
+    if if_none_match:
+        entry = getCached(feed_key)
+    else:
+        entry = decodeCached(feed_key, cached.get(feed_key))
+    if entry and entry['version'] == version:
+        return etag, entry['body']
+
+    body = renderCalendar(user_id)
+    setCached(feed_key, {'version': version, 'body': body}, time=FEED_TTL)
+    return etag, body
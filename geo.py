@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""geo.py
+
+Proximity search on conference location
+
+Conferences with a latitude and longitude (given, or looked up offline
+from their city) index the geohash of that point. A search covers the
+bounding box of the circle with the smallest geohash cells that take at
+most GEOHASH_MAX_CELLS of them, so the cells hold little beyond the circle
+whatever its radius. It runs one prefix range query per cell in parallel,
+reading each cell completely in pages, and ranks what comes back by exact
+haversine distance. Conferences written before the geohash existed are
+re-saved by backfillConferenceLocations.
+
+"""
+
+from google.appengine.ext import ndb
+
+from geohash import coveringCells
+from geohash import geocodeCity
+from geohash import haversine
+from models import Conference
+
+GEO_MAX_RADIUS_KM = 2000
+GEO_PAGE_SIZE = 500             # conferences read per cell query batch
+
+
+def _cellQuery(cell):
+    """Return the query of conferences whose geohash starts with a prefix"""
+    # '~' sorts after every geohash character
+    return Conference.query(Conference.geohash >= cell,
+                            Conference.geohash < cell + '~')
+
+
+@ndb.tasklet
+def _cellConferencesAsync(cell):
+    """Return every conference of a geohash cell, read in pages"""
+    query = _cellQuery(cell)
+    confs, cursor, more = yield query.fetch_page_async(GEO_PAGE_SIZE)
+    while more:
+        page, cursor, more = yield query.fetch_page_async(
+            GEO_PAGE_SIZE, start_cursor=cursor)
+        confs.extend(page)
+    raise ndb.Return(confs)
+
+
+def conferencesNear(latitude, longitude, radius_km, limit):
+    """Return up to limit (distance, Conference) within radius_km, nearest first"""
+    futures = [_cellConferencesAsync(cell)
+               for cell in coveringCells(latitude, longitude, radius_km)]
+
+    found = []
+    for future in futures:
+        for conf in future.get_result():
+            distance = haversine(latitude, longitude,
+                                 conf.latitude, conf.longitude)
+            if distance <= radius_km:
+                found.append((distance, conf))
+
+    found.sort(key=lambda item: item[0])
+    return found[:limit]
+
+
+def locateConference(conf):
+    """Fill in the coordinates of a conference from its city if it has none"""
+    if conf.latitude is None or conf.longitude is None:
+        coordinates = geocodeCity(conf.city)
+        if coordinates:
+            conf.latitude, conf.longitude = coordinates
+
+
+def backfillConferenceLocations(confs):
+    """
+    Geocode and re-save a batch of existing Conferences so their geohash
+    gets indexed (a mapper of the backfill_conference_locations job)
+    """
+    for conf in confs:
+        locateConference(conf)
+    ndb.put_multi(confs)
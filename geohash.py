@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""geohash.py
+
+Geohash encoding, great-circle distance and an offline city geocoding table
+
+Pure functions with no datastore access, so models.py can use them to
+compute Conference.geohash.
+
+"""
+
+import math
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9           # characters stored per conference, ~5 m
+GEOHASH_MAX_CELLS = 32          # cells, and so queries, per covering
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+# coordinates of the cities conferences are usually held in, by lowercase
+# name; conferences in other cities need explicit latitude and longitude
+CITY_COORDINATES = {
+    'amsterdam': (52.3676, 4.9041),
+    'atlanta': (33.7490, -84.3880),
+    'austin': (30.2672, -97.7431),
+    'bangalore': (12.9716, 77.5946),
+    'barcelona': (41.3851, 2.1734),
+    'beijing': (39.9042, 116.4074),
+    'berlin': (52.5200, 13.4050),
+    'boston': (42.3601, -71.0589),
+    'buenos aires': (-34.6037, -58.3816),
+    'cairo': (30.0444, 31.2357),
+    'chicago': (41.8781, -87.6298),
+    'copenhagen': (55.6761, 12.5683),
+    'dubai': (25.2048, 55.2708),
+    'dublin': (53.3498, -6.2603),
+    'hong kong': (22.3193, 114.1694),
+    'istanbul': (41.0082, 28.9784),
+    'lisbon': (38.7223, -9.1393),
+    'london': (51.5074, -0.1278),
+    'los angeles': (34.0522, -118.2437),
+    'madrid': (40.4168, -3.7038),
+    'melbourne': (-37.8136, 144.9631),
+    'mexico city': (19.4326, -99.1332),
+    'montreal': (45.5017, -73.5673),
+    'moscow': (55.7558, 37.6173),
+    'mountain view': (37.3861, -122.0839),
+    'mumbai': (19.0760, 72.8777),
+    'munich': (48.1351, 11.5820),
+    'new york': (40.7128, -74.0060),
+    'paris': (48.8566, 2.3522),
+    'prague': (50.0755, 14.4378),
+    'rome': (41.9028, 12.4964),
+    'san francisco': (37.7749, -122.4194),
+    'sao paulo': (-23.5505, -46.6333),
+    'seattle': (47.6062, -122.3321),
+    'seoul': (37.5665, 126.9780),
+    'singapore': (1.3521, 103.8198),
+    'stockholm': (59.3293, 18.0686),
+    'sydney': (-33.8688, 151.2093),
+    'tel aviv': (32.0853, 34.7818),
+    'tokyo': (35.6762, 139.6503),
+    'toronto': (43.6532, -79.3832),
+    'vancouver': (49.2827, -123.1207),
+    'vienna': (48.2082, 16.3738),
+    'warsaw': (52.2297, 21.0122),
+    'washington': (38.9072, -77.0369),
+    'zurich': (47.3769, 8.5417),
+}
+
+
+def geocodeCity(city):
+    """Return the (latitude, longitude) of a known city, or None"""
+    if not city:
+        return None
+    return CITY_COORDINATES.get(' '.join(city.lower().split()))
+
+
+def encodeGeohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Return the geohash of a point, precision characters long"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, longitude first
+        rng, coord = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cellSize(precision):
+    """Return the (latitude, longitude) span in degrees of a geohash cell"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def boundingBox(latitude, longitude, radius_km):
+    """
+    Return (south, north, west, east) in degrees of the smallest box holding
+    every point within radius_km; west > east when it crosses the antimeridian
+    """
+    delta = radius_km / EARTH_RADIUS_KM
+    south = latitude - math.degrees(delta)
+    north = latitude + math.degrees(delta)
+    if south <= -90 or north >= 90 or \
+            math.sin(delta) >= math.cos(math.radians(latitude)):
+        # the circle holds a pole: every longitude
+        return max(south, -90.0), min(north, 90.0), -180.0, 180.0
+    dlng = math.degrees(math.asin(math.sin(delta) /
+                                  math.cos(math.radians(latitude))))
+    west = (longitude - dlng + 180) % 360 - 180
+    east = (longitude + dlng + 180) % 360 - 180
+    return south, north, west, east
+
+
+def _boxCells(box, precision, max_cells):
+    """Return the geohash cells of a precision overlapping a box, None if too many"""
+    south, north, west, east = box
+    lat_span, lng_span = cellSize(precision)
+    rows, cols = int(round(180 / lat_span)), int(round(360 / lng_span))
+    first_row = int((south + 90) // lat_span)
+    last_row = min(int((north + 90) // lat_span), rows - 1)
+    if (west, east) == (-180.0, 180.0):
+        col_range = range(cols)
+    else:
+        first_col = int((west + 180) // lng_span)
+        last_col = int((east + 180) // lng_span)
+        if last_col < first_col:
+            last_col += cols
+        col_range = [c % cols for c in range(first_col, last_col + 1)]
+    if (last_row - first_row + 1) * len(col_range) > max_cells:
+        return None
+    return sorted(set(
+        encodeGeohash(-90 + (row + 0.5) * lat_span, -180 + (col + 0.5) * lng_span,
+                      precision)
+        for row in range(first_row, last_row + 1) for col in col_range))
+
+
+def coveringCells(latitude, longitude, radius_km, max_cells=GEOHASH_MAX_CELLS):
+    """
+    Return geohash prefixes whose cells together hold every point within
+    radius_km: the smallest cells that cover the circle's bounding box with
+    at most max_cells of them
+    """
+    box = boundingBox(latitude, longitude, radius_km)
+    for precision in range(GEOHASH_PRECISION, 1, -1):
+        cells = _boxCells(box, precision, max_cells)
+        if cells is not None:
+            return cells
+    return _boxCells(box, 1, len(GEOHASH_ALPHABET))
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Return the great-circle distance in km between two points"""
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = (math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) *
+         math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
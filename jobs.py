@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+"""jobs.py
+
+Maintenance jobs run by the fan-out framework (see fanout.py), by name
+
+Imported by main.py, which serves the cron and task URLs that start and
+run them.
+
+"""
+
+from cache import cacheAnnouncement
+from cache import nearlySoldOut
+from fanout import registerJob
+from geo import backfillConferenceLocations
+from related import rebuildRelated
+from schedule import backfillConferenceWeeks
+from schedule import backfillSessionTimes
+from speakers import backfillSpeakers
+from stats import rebuildStats
+
+registerJob('set_announcement', 'Conference', nearlySoldOut,
+            reducer=cacheAnnouncement, batch_size=500)
+# each conference reads its Sessions and counts its attendees
+registerJob('rebuild_stats', 'Conference', rebuildStats, batch_size=10,
+            keys_only=True)
+# each conference reads the Profiles of its attendees
+registerJob('rebuild_related', 'Conference', rebuildRelated, batch_size=5,
+            keys_only=True)
+registerJob('backfill_speakers', 'Session', backfillSpeakers)
+registerJob('backfill_session_times', 'Session', backfillSessionTimes)
+registerJob('backfill_conference_locations', 'Conference',
+            backfillConferenceLocations)
+registerJob('backfill_conference_weeks', 'Conference', backfillConferenceWeeks)
@@ -14,15 +14,54 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+#
+# This app serves cron jobs and tasks only. It must not import conference.py,
+# which loads the whole Endpoints/ProtoRPC stack, except when warming up.
+#
+import json
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
-from conference import ConferenceApi
+from cache import cacheFeaturedSpeaker
+from confcache import refreshConference
+from facets import buildFacetSnapshot
+from feeds import getCalendarFeed
+from feeds import userIdFromToken
+from fanout import runReduce
+from fanout import runShard
+from fanout import startJob
+import jobs # registers the maintenance jobs
+from registration import applyRegistrationEffects
+from related import flushRelatedDeltas
+from related import recordCoRegistration
+from seatfeed import appendSeatChange
+from seatfeed import purgeSeatFeed
+from snapshot import buildCatalogSnapshot
+from snapshot import getCatalogManifest
+from snapshot import getCatalogShard
+from snapshot import gunzip
+from stats import flushStatsDeltas
+from transactions import purgeIdempotencyRecords
+from waitlist import promoteWaitlist
+from wishlist import flushWishlist
 
-class SetAnnouncementHandler(webapp2.RequestHandler):
-    def get(self):
-        """Set Announcement in Memcache"""
-        ConferenceApi._cacheAnnouncement()
+class StartJobHandler(webapp2.RequestHandler):
+    def get(self, name):
+        """Start a sharded maintenance job (see jobs.py)"""
+        startJob(name)
+        self.response.set_status(204)
+
+class FanoutShardHandler(webapp2.RequestHandler):
+    def post(self):
+        """Map the next batch of a shard of a maintenance job"""
+        runShard(int(self.request.get('job_id')),
+                 int(self.request.get('shard')),
+                 int(self.request.get('step')))
+        self.response.set_status(204)
+
+class FanoutReduceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Merge the shard results of a maintenance job"""
+        runReduce(int(self.request.get('job_id')),
+                  self.request.headers['X-AppEngine-TaskName'])
         self.response.set_status(204)
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
@@ -30,6 +69,9 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         """
         Send email confirming conference creation
         """
+        # only this task sends mail, so only it pays for loading the mail API
+        from google.appengine.api import app_identity
+        from google.appengine.api import mail
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (app_identity.get_application_id()), # from
             self.request.get('email'), # to
@@ -41,14 +83,165 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def get(self):
         """Set Featured Speaker in Memcache"""
-        ConferenceApi._cacheFeaturedSpeaker(
+        cacheFeaturedSpeaker(
             self.request.get('speaker'),
             self.request.get('conference_key')
         )
         self.response.set_status(204)
 
+class FlushConferenceStatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply pending ConferenceStats deltas of a conference"""
+        flushStatsDeltas(self.request.get('conference_key'))
+        self.response.set_status(204)
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Register waitlisted users for freed seats, oldest first"""
+        promoteWaitlist(self.request.get('conference_key'))
+        self.response.set_status(204)
+
+class BuildCatalogSnapshotHandler(webapp2.RequestHandler):
+    def get(self):
+        """Render the public conference catalog into a new snapshot"""
+        buildCatalogSnapshot()
+        self.response.set_status(204)
+
+class CatalogManifestHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the shards of the current catalog snapshot"""
+        manifest = getCatalogManifest()
+        if not manifest:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['Cache-Control'] = 'public, max-age=60'
+        self.response.write(json.dumps(manifest))
+
+class CatalogShardHandler(webapp2.RequestHandler):
+    def get(self, version, name):
+        """Return a shard of a catalog snapshot; versioned so cached for long"""
+        data = getCatalogShard(version, name)
+        if data is None:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['Cache-Control'] = 'public, max-age=31536000'
+        # shared caches must not hand the gzip body to clients not asking for it
+        self.response.headers['Vary'] = 'Accept-Encoding'
+        if 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            self.response.headers['Content-Encoding'] = 'gzip'
+        else:
+            data = gunzip(data)
+        self.response.body = data
+
+class CalendarFeedHandler(webapp2.RequestHandler):
+    def get(self, token):
+        """Return the iCalendar feed of a user, 304 if the caller has it"""
+        user_id = userIdFromToken(token)
+        if not user_id:
+            self.abort(404)
+        etag, feed = getCalendarFeed(user_id,
+                                     self.request.headers.get('If-None-Match'))
+        self.response.headers['ETag'] = etag
+        self.response.headers['Cache-Control'] = 'private, no-cache'
+        if feed is None:
+            self.response.set_status(304)
+            return
+        self.response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+        self.response.write(feed)
+
+class FlushWishlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write the journaled wishlist mutations of a user to their Profile"""
+        flushWishlist(self.request.get('user_id'))
+        self.response.set_status(204)
+
+class RefreshConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Re-read a conference served from the bounded-staleness cache"""
+        refreshConference(self.request.get('conference_key'))
+        self.response.set_status(204)
+
+class RecordCoRegistrationHandler(webapp2.RequestHandler):
+    def post(self):
+        """Queue the related conferences deltas of a committed registration"""
+        recordCoRegistration(self.request.get('conference_key'),
+                             json.loads(self.request.get('others')),
+                             int(self.request.get('delta')),
+                             self.request.headers['X-AppEngine-TaskName'])
+        self.response.set_status(204)
+
+class RegistrationEffectsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply the side effects of a committed (un)registration"""
+        at = self.request.get('at')
+        applyRegistrationEffects(self.request.get('conference_key'),
+                                 self.request.get('user_id'),
+                                 int(self.request.get('delta')),
+                                 self.request.headers['X-AppEngine-TaskName'],
+                                 float(at) if at else None)
+        self.response.set_status(204)
+
+class FlushRelatedHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply pending related conferences deltas of a conference"""
+        flushRelatedDeltas(self.request.get('conference_key'))
+        self.response.set_status(204)
+
+class BuildFacetSnapshotHandler(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild the columnar read model behind the facet counts"""
+        buildFacetSnapshot()
+        self.response.set_status(204)
+
+class AppendSeatChangeHandler(webapp2.RequestHandler):
+    def post(self):
+        """Append a committed seat change to the seat changes feed"""
+        appendSeatChange(self.request.get('conference_key'),
+                         int(self.request.get('seats')),
+                         int(self.request.get('version')))
+        self.response.set_status(204)
+
+class PurgeSeatFeedHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete seat changes spilled to the datastore that readers can't reach"""
+        purgeSeatFeed()
+        self.response.set_status(204)
+
+class PurgeIdempotencyRecordsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete expired registration idempotency records"""
+        purgeIdempotencyRecords()
+        self.response.set_status(204)
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Load the Endpoints API before the instance serves user requests"""
+        import conference
+        self.response.set_status(200)
+
 app = webapp2.WSGIApplication([
-    ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/_ah/warmup', WarmupHandler),
+    (r'/crons/(set_announcement|rebuild_stats|rebuild_related)', StartJobHandler),
+    ('/crons/build_catalog_snapshot', BuildCatalogSnapshotHandler),
+    ('/crons/build_facets', BuildFacetSnapshotHandler),
+    ('/crons/purge_seat_feed', PurgeSeatFeedHandler),
+    ('/crons/purge_idempotency_records', PurgeIdempotencyRecordsHandler),
+    ('/catalog/manifest.json', CatalogManifestHandler),
+    (r'/catalog/(\w+)/([\w-]+)\.json', CatalogShardHandler),
+    (r'/feeds/([\w.-]+)\.ics', CalendarFeedHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler)
+    ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/flush_conference_stats', FlushConferenceStatsHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    (r'/tasks/(backfill_speakers|backfill_session_times|'
+     r'backfill_conference_locations|backfill_conference_weeks)',
+     StartJobHandler),
+    ('/tasks/refresh_conference', RefreshConferenceHandler),
+    ('/tasks/record_coregistration', RecordCoRegistrationHandler),
+    ('/tasks/flush_related', FlushRelatedHandler),
+    ('/tasks/fanout_shard', FanoutShardHandler),
+    ('/tasks/fanout_reduce', FanoutReduceHandler),
+    ('/tasks/flush_wishlist', FlushWishlistHandler),
+    ('/tasks/append_seat_change', AppendSeatChangeHandler),
+    ('/tasks/registration_effects', RegistrationEffectsHandler)
 ], debug=True)
@@ -12,25 +12,43 @@ created/forked from conferences.py by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
-import httplib
-import endpoints
+from datetime import datetime, timedelta, time
 from protorpc import messages
 from google.appengine.ext import ndb
 
+from geohash import encodeGeohash
 
-class ConflictException(endpoints.ServiceException):
-    """ConflictException -- exception mapped to HTTP 409 response"""
-    http_status = httplib.CONFLICT
+
+class Speaker(ndb.Model):
+    """Speaker -- Speaker object, keyed by normalized speaker name"""
+    name                    = ndb.StringProperty(required=True)
+    sessionKeys             = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+
+def _sessionStart(session):
+    """Return the start instant of a session, midnight if it has no startTime"""
+    if not session.date:
+        return None
+    return datetime.combine(session.date, session.startTime or time())
+
+def _sessionEnd(session):
+    """Return the end instant of a session from its start and duration"""
+    start = _sessionStart(session)
+    if not start:
+        return None
+    return start + timedelta(minutes=session.duration or 0)
 
 class Session(ndb.Model):
     """Session -- Session object"""
     name                    = ndb.StringProperty(required=True)
     highlights              = ndb.StringProperty()
     speaker                 = ndb.StringProperty(required=True)
+    speakerKey              = ndb.KeyProperty(kind=Speaker)
     duration                = ndb.IntegerProperty()
     typeOfSession           = ndb.StringProperty(repeated=True)
     date                    = ndb.DateProperty()
     startTime               = ndb.TimeProperty()
+    startDateTime           = ndb.ComputedProperty(_sessionStart)
+    endDateTime             = ndb.ComputedProperty(_sessionEnd)
 
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
@@ -43,6 +61,8 @@ class SessionForm(messages.Message):
     date                    = messages.StringField(7)
     startTime               = messages.StringField(8)
     websafeKey              = messages.StringField(9)
+    startDateTime           = messages.StringField(10)
+    endDateTime             = messages.StringField(11)
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
@@ -61,6 +81,8 @@ class Profile(ndb.Model):
     teeShirtSize            = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend  = ndb.StringProperty(repeated=True)
     sessionsToAttend        = ndb.KeyProperty(Session, repeated=True)
+    wishlistSeq             = ndb.IntegerProperty(default=0, indexed=False)
+    feedToken               = ndb.StringProperty()
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -86,6 +108,12 @@ class BooleanMessage(messages.Message):
     data                    = messages.BooleanField(1)
 
 
+class RegistrationMessage(messages.Message):
+    """RegistrationMessage -- outbound registration result message"""
+    data                    = messages.BooleanField(1)
+    waitlistPosition        = messages.IntegerField(2, variant=messages.Variant.INT32)
+
+
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
     NOT_SPECIFIED = 1
@@ -105,6 +133,27 @@ class TeeShirtSize(messages.Enum):
     XXXL_W = 15
 
 
+CONFERENCE_MAX_WEEKS = 53
+
+def weekBucket(day):
+    """Return the number of the Monday to Sunday week a date falls in"""
+    return (day.toordinal() - 1) // 7
+
+def _conferenceWeeks(conf):
+    """Return the week buckets a conference runs in, at most CONFERENCE_MAX_WEEKS"""
+    if not conf.startDate:
+        return []
+    end = max(conf.endDate or conf.startDate, conf.startDate)
+    first = weekBucket(conf.startDate)
+    last = min(weekBucket(end), first + CONFERENCE_MAX_WEEKS - 1)
+    return list(range(first, last + 1))
+
+def _conferenceGeohash(conf):
+    """Return the geohash of a conference location, None if it has none"""
+    if conf.latitude is None or conf.longitude is None:
+        return None
+    return encodeGeohash(conf.latitude, conf.longitude)
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name                    = ndb.StringProperty(required=True)
@@ -117,6 +166,11 @@ class Conference(ndb.Model):
     endDate                 = ndb.DateProperty()
     maxAttendees            = ndb.IntegerProperty()
     seatsAvailable          = ndb.IntegerProperty()
+    seatsVersion            = ndb.IntegerProperty(default=0, indexed=False)
+    latitude                = ndb.FloatProperty(indexed=False)
+    longitude               = ndb.FloatProperty(indexed=False)
+    geohash                 = ndb.ComputedProperty(_conferenceGeohash)
+    weeks                   = ndb.ComputedProperty(_conferenceWeeks, repeated=True)
 
     @property
     def sessions(self):
@@ -136,11 +190,28 @@ class ConferenceForm(messages.Message):
     endDate                 = messages.StringField(10) #DateTimeField()
     websafeKey              = messages.StringField(11)
     organizerDisplayName    = messages.StringField(12)
+    latitude                = messages.FloatField(13)
+    longitude               = messages.FloatField(14)
+    distanceKm              = messages.FloatField(15)
+    seatsVersion            = messages.IntegerField(16)
+
+
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- number of conferences with one facet value"""
+    value                   = messages.StringField(1)
+    count                   = messages.IntegerField(2, variant=messages.Variant.INT32)
+
+
+class FacetForm(messages.Message):
+    """FacetForm -- counts of the values of one filterable field"""
+    field                   = messages.StringField(1)
+    counts                  = messages.MessageField(FacetCountForm, 2, repeated=True)
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items                   = messages.MessageField(ConferenceForm, 1, repeated=True)
+    facets                  = messages.MessageField(FacetForm, 2, repeated=True)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -153,3 +224,175 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters                 = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    facets                  = messages.BooleanField(2)
+
+
+class ConferenceStats(ndb.Model):
+    """ConferenceStats -- pre-aggregated statistics, keyed by websafeConferenceKey"""
+    attendees               = ndb.IntegerProperty(default=0)
+    sessions                = ndb.IntegerProperty(default=0)
+    sessionsByType          = ndb.JsonProperty()
+    sessionsBySpeaker       = ndb.JsonProperty()
+    minutesBySpeaker        = ndb.JsonProperty()
+    registrationsByDay      = ndb.JsonProperty()
+    countedUntil            = ndb.FloatProperty(indexed=False)
+    lastRebuilt             = ndb.DateTimeProperty()
+    lastUpdated             = ndb.DateTimeProperty(auto_now=True)
+
+
+class StatCountForm(messages.Message):
+    """StatCountForm -- single named counter of a ConferenceStatsForm"""
+    name                    = messages.StringField(1)
+    value                   = messages.IntegerField(2)
+
+
+class ConferenceStatsForm(messages.Message):
+    """ConferenceStatsForm -- ConferenceStats outbound form message"""
+    websafeConferenceKey    = messages.StringField(1)
+    attendees               = messages.IntegerField(2)
+    sessions                = messages.IntegerField(3)
+    sessionsByType          = messages.MessageField(StatCountForm, 4, repeated=True)
+    sessionsBySpeaker       = messages.MessageField(StatCountForm, 5, repeated=True)
+    minutesBySpeaker        = messages.MessageField(StatCountForm, 6, repeated=True)
+    registrationsByDay      = messages.MessageField(StatCountForm, 7, repeated=True)
+    lastRebuilt             = messages.StringField(8)
+    lastUpdated             = messages.StringField(9)
+
+
+class RelatedConferences(ndb.Model):
+    """RelatedConferences -- co-registration counts, keyed by websafeConferenceKey"""
+    counts                  = ndb.JsonProperty()
+    neighbours              = ndb.JsonProperty()
+    lastRebuilt             = ndb.DateTimeProperty(indexed=False)
+    lastUpdated             = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class RelatedConferenceForm(messages.Message):
+    """RelatedConferenceForm -- conference registered for by the same attendees"""
+    websafeKey              = messages.StringField(1)
+    name                    = messages.StringField(2)
+    coRegistrations         = messages.IntegerField(3, variant=messages.Variant.INT32)
+
+
+class RelatedConferenceForms(messages.Message):
+    """RelatedConferenceForms -- multiple RelatedConferenceForm outbound form message"""
+    items                   = messages.MessageField(RelatedConferenceForm, 1, repeated=True)
+
+
+class WaitlistShard(ndb.Model):
+    """WaitlistShard -- entity group of WaitlistEntries, id websafeConferenceKey:shard"""
+    joined                  = ndb.DateTimeProperty(repeated=True, indexed=False)
+
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- user waiting for a seat, child of a WaitlistShard key"""
+    conferenceKey           = ndb.StringProperty(required=True)
+    userId                  = ndb.StringProperty(required=True)
+    joined                  = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class CatalogShard(ndb.Model):
+    """CatalogShard -- gzip compressed JSON of a snapshot shard, id version/name"""
+    version                 = ndb.StringProperty(required=True)
+    data                    = ndb.BlobProperty(required=True)
+
+
+class CatalogSnapshot(ndb.Model):
+    """CatalogSnapshot -- pointer to the current catalog snapshot version"""
+    version                 = ndb.StringProperty(required=True)
+    shards                  = ndb.JsonProperty()
+    created                 = ndb.DateTimeProperty(auto_now=True)
+
+
+class FacetSnapshot(ndb.Model):
+    """FacetSnapshot -- pointer to the current facet read model and its part count"""
+    version                 = ndb.StringProperty(required=True, indexed=False)
+    parts                   = ndb.IntegerProperty(indexed=False)
+    data                    = ndb.BlobProperty()    # inline, before parts
+
+
+class FacetSnapshotPart(ndb.Model):
+    """FacetSnapshotPart -- part of the zlib compressed JSON columns, id version/index"""
+    version                 = ndb.StringProperty(required=True)
+    data                    = ndb.BlobProperty(required=True)
+
+
+class BatchRequestItemForm(messages.Message):
+    """BatchRequestItemForm -- one read-only API call of a batch"""
+    method                  = messages.StringField(1, required=True)
+    websafeConferenceKey    = messages.StringField(2)
+    typeOfSession           = messages.StringField(3)
+    speaker                 = messages.StringField(4)
+
+
+class BatchRequestForm(messages.Message):
+    """BatchRequestForm -- batch of read-only API calls inbound form message"""
+    items                   = messages.MessageField(BatchRequestItemForm, 1, repeated=True)
+
+
+class BatchResultForm(messages.Message):
+    """BatchResultForm -- result or error of one call of a batch"""
+    method                  = messages.StringField(1)
+    code                    = messages.IntegerField(2, variant=messages.Variant.INT32)
+    error                   = messages.StringField(3)
+    profile                 = messages.MessageField(ProfileForm, 4)
+    conference              = messages.MessageField(ConferenceForm, 5)
+    conferences             = messages.MessageField(ConferenceForm, 6, repeated=True)
+    sessions                = messages.MessageField(SessionForm, 7, repeated=True)
+
+
+class BatchResultForms(messages.Message):
+    """BatchResultForms -- results of a batch, in request order"""
+    items                   = messages.MessageField(BatchResultForm, 1, repeated=True)
+
+
+class SeatChangeEvent(ndb.Model):
+    """SeatChangeEvent -- seat change spilled from the memcache seat feed"""
+    bucket                  = ndb.IntegerProperty(required=True)
+    conferenceKey           = ndb.StringProperty(required=True, indexed=False)
+    seatsAvailable          = ndb.IntegerProperty(indexed=False)
+    seatsVersion            = ndb.IntegerProperty(default=0, indexed=False)
+    created                 = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class SeatUpdateForm(messages.Message):
+    """SeatUpdateForm -- latest seatsAvailable of a changed conference"""
+    websafeConferenceKey    = messages.StringField(1)
+    seatsAvailable          = messages.IntegerField(2, variant=messages.Variant.INT32)
+    seatsVersion            = messages.IntegerField(3)
+
+
+class SeatUpdatesForm(messages.Message):
+    """SeatUpdatesForm -- seat changes since a feed token outbound form message"""
+    items                   = messages.MessageField(SeatUpdateForm, 1, repeated=True)
+    nextToken               = messages.StringField(2)
+    resync                  = messages.BooleanField(3)
+
+
+class IdempotencyRecord(ndb.Model):
+    """IdempotencyRecord -- result of a call made with a requestId, child of Profile"""
+    result                  = ndb.JsonProperty(indexed=False)
+    created                 = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class FanoutJob(ndb.Model):
+    """FanoutJob -- state of a sharded maintenance job, see fanout.py"""
+    name                    = ndb.StringProperty(required=True)
+    shards                  = ndb.IntegerProperty(indexed=False)
+    status                  = ndb.StringProperty(default='running')
+    reduceTask              = ndb.StringProperty(indexed=False)
+    result                  = ndb.JsonProperty()
+    created                 = ndb.DateTimeProperty(auto_now_add=True)
+    finished                = ndb.DateTimeProperty(indexed=False)
+
+
+class FanoutShard(ndb.Model):
+    """FanoutShard -- key range and checkpoint of one shard of a FanoutJob"""
+    jobId                   = ndb.IntegerProperty(required=True)
+    start                   = ndb.KeyProperty(indexed=False)
+    end                     = ndb.KeyProperty(indexed=False)
+    cursor                  = ndb.StringProperty(indexed=False)
+    step                    = ndb.IntegerProperty(default=0, indexed=False)
+    processed               = ndb.IntegerProperty(default=0, indexed=False)
+    done                    = ndb.BooleanProperty(default=False, indexed=False)
+    result                  = ndb.JsonProperty()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""ratelimit.py
+
+Admission control for the write endpoints
+
+Each limited method gets a budget of calls per user and per conference for
+every window of RATE_LIMITS[method]['window'] seconds: a token bucket that
+refills completely at the start of each window. Both counters are bumped
+with a single atomic memcache offset_multi on windowed keys, so stale
+windows simply age out of memcache. Once a key is over its limit the
+instance remembers it until the window ends and rejects further calls
+without a memcache round trip.
+
+If memcache is unavailable the limiter fails open.
+
+"""
+
+import functools
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from errors import TooManyRequestsException
+from settings import RATE_LIMITS
+from utils import getUserId
+from utils import keyFromUrlsafe
+
+RATE_LIMIT_KEY = 'RATE_LIMIT:%s:%s:%s:%d'
+# message of rejected calls; clients parse the seconds after "retry after"
+RATE_LIMIT_MESSAGE = 'Too many %s requests, retry after %d seconds.'
+MAX_BLOCKED_KEYS = 10000
+
+# keys known to be over their limit in the current window, on this instance
+_blocked = set()
+
+
+def _rejected(method_name, retry_after):
+    """Return the exception raised for an over-limit call"""
+    return TooManyRequestsException(
+        RATE_LIMIT_MESSAGE % (method_name, retry_after), retry_after=retry_after)
+
+
+def checkRateLimit(method_name, user_id=None, conference_key=None):
+    """Count a call to method_name, raising TooManyRequestsException if over limit"""
+    limits = RATE_LIMITS.get(method_name)
+    if not limits:
+        return
+
+    now = time.time()
+    window = int(now // limits['window'])
+    retry_after = int((window + 1) * limits['window'] - now) + 1
+
+    counters = {}
+    for scope, ident in (('user', user_id), ('conference', conference_key)):
+        if ident and scope in limits:
+            key = RATE_LIMIT_KEY % (method_name, scope, ident, window)
+            # instance-local fast path for callers already rejected
+            if key in _blocked:
+                raise _rejected(method_name, retry_after)
+            counters[key] = limits[scope]
+    if not counters:
+        return
+
+    counts = memcache.offset_multi(dict.fromkeys(counters, 1), initial_value=0)
+    for key, limit in counters.items():
+        if (counts.get(key) or 0) > limit:
+            if len(_blocked) >= MAX_BLOCKED_KEYS:
+                _blocked.clear()
+            _blocked.add(key)
+            raise _rejected(method_name, retry_after)
+
+
+def _conferenceKeyOf(request):
+    """Return the websafe conference key a request is about, if any"""
+    wsck = getattr(request, 'websafeConferenceKey', None)
+    if wsck:
+        return wsck
+    wssk = getattr(request, 'websafeSessionKey', None)
+    if wssk:
+        # sessions are children of their conference; a malformed key is
+        # left for the endpoint to reject
+        key = keyFromUrlsafe(wssk, 'Session')
+        return key.parent().urlsafe() if key and key.parent() else None
+    return None
+
+
+def rateLimited(method_name):
+    """Decorate an endpoints method with the RATE_LIMITS of method_name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, request):
+            user = endpoints.get_current_user()
+            limits = RATE_LIMITS.get(method_name, {})
+            checkRateLimit(method_name,
+                user_id=getUserId(user) if user else None,
+                conference_key=_conferenceKeyOf(request)
+                    if 'conference' in limits else None)
+            return func(self, request)
+        return wrapper
+    return decorator
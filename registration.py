@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+"""registration.py
+
+Side effects of a committed registration, unregistration or promotion
+
+These change a Profile and a Conference in one transaction. The stats
+delta and the invalidation of the user's agenda feed follow from it.
+queueRegistrationEffects queues them as a task inside that transaction,
+so they happen exactly when it commits: never for a transaction that
+failed, and still when a retry replays a commit whose outcome was unknown.
+
+Tasks can run more than once. The stats delta is queued under a name
+derived from the task's name, so a repeated run doesn't count it twice.
+It carries the time the transaction queued it, so a stats rebuild that
+counted the registration already can tell (see stats.py).
+
+"""
+
+import time
+
+from google.appengine.api import taskqueue
+
+from cache import bumpFeedVersion
+from stats import recordStatsDelta
+from stats import registrationDelta
+
+
+def queueRegistrationEffects(websafeConferenceKey, user_id, reg=True):
+    """Queue the side effects of a (un)registration; call inside its transaction"""
+    taskqueue.add(params={'conference_key': websafeConferenceKey,
+                          'user_id': user_id,
+                          'delta': 1 if reg else -1,
+                          'at': repr(time.time())},
+                  url='/tasks/registration_effects', transactional=True)
+
+
+def applyRegistrationEffects(websafeConferenceKey, user_id, delta, task_name,
+                             at=None):
+    """Record the stats delta of a committed (un)registration and refresh the user's feed"""
+    recordStatsDelta(websafeConferenceKey,
+                     registrationDelta(reg=delta > 0, at=at),
+                     name='registration-%s' % task_name)
+    bumpFeedVersion(user_id)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""related.py
+
+"Attendees of this conference also registered for" recommendations
+
+Each conference has a RelatedConferences row of the item-item
+co-registration matrix: how many of its attendees registered for every
+other conference, capped to the RELATED_TRACKED largest counts, and the
+RELATED_TOP_K largest with their names, so serving them is one get().
+
+The rebuild_related job (see jobs.py) recomputes rows a conference at a
+time, reading its attendees' Profiles in cursor batches, so memory is
+bounded by one row rather than the whole matrix. Registrations keep rows
+current in between the same way stats.py keeps ConferenceStats: deltas go
+to the 'related-deltas' pull queue, tagged with the row they change, and a
+named flush task per row and window applies them in one write (see
+deltaqueue.py).
+
+"""
+
+from datetime import datetime
+import json
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from deltaqueue import flushDeltas
+from deltaqueue import recordDeltas
+from models import Profile
+from models import RelatedConferences
+
+RELATED_QUEUE = 'related-deltas'
+RELATED_FLUSH_WINDOW = 30       # seconds of deltas coalesced per flush
+RELATED_TOP_K = 10
+RELATED_TRACKED = 200           # counts kept per row for incremental updates
+RELATED_MAX_CANDIDATES = 10000  # counts held while rebuilding one row
+RELATED_PROFILE_BATCH = 500
+RELATED_MAX_OTHERS = 99         # other conferences counted per registration
+
+
+def _topCounts(counts, n):
+    """Return the n largest positive (websafeConferenceKey, count), largest first"""
+    ranked = sorted(((k, v) for k, v in counts.items() if v > 0),
+                    key=lambda item: (-item[1], item[0]))
+    return ranked[:n]
+
+
+@ndb.non_transactional
+def _conferences(websafeConferenceKeys):
+    """Return the Conferences of websafe keys, None for deleted ones"""
+    return ndb.get_multi([ndb.Key(urlsafe=wsck)
+                          for wsck in websafeConferenceKeys])
+
+
+def _setRow(row, counts):
+    """Store the tracked counts and named top-K neighbours of a row"""
+    tracked = _topCounts(counts, RELATED_TRACKED)
+    row.counts = dict(tracked)
+    top = tracked[:RELATED_TOP_K]
+    confs = _conferences([wsck for wsck, _ in top])
+    row.neighbours = [[wsck, count, conf.name]
+                      for (wsck, count), conf in zip(top, confs) if conf]
+
+
+def getRelatedConferences(websafeConferenceKey):
+    """Return the top-K [websafeConferenceKey, count, name] of a conference"""
+    row = ndb.Key(RelatedConferences, websafeConferenceKey).get()
+    return row.neighbours if row and row.neighbours else []
+
+
+def queueCoRegistration(websafeConferenceKey, others, reg=True):
+    """
+    Queue the co-registration update of a user (un)registering for a
+    conference while attending others; call inside the registration
+    transaction so it happens exactly when the registration commits
+    """
+    # a batch of pull tasks holds at most 100, one per row
+    others = [wsck for wsck in others
+              if wsck != websafeConferenceKey][-RELATED_MAX_OTHERS:]
+    if others:
+        taskqueue.add(params={'conference_key': websafeConferenceKey,
+                              'others': json.dumps(others),
+                              'delta': 1 if reg else -1},
+                      url='/tasks/record_coregistration', transactional=True)
+
+
+def recordCoRegistration(websafeConferenceKey, others, delta, task_name):
+    """
+    Queue the deltas of every row a co-registration changes, named after
+    the task so a retried task queues them once
+    """
+    deltas = {websafeConferenceKey: dict((wsck, delta) for wsck in others)}
+    for wsck in others:
+        deltas[wsck] = {websafeConferenceKey: delta}
+    recordDeltas(RELATED_QUEUE, deltas, '/tasks/flush_related',
+                 RELATED_FLUSH_WINDOW, name='coreg-%s' % task_name)
+
+
+def _mergeCounts(total, delta):
+    """Add the counts of delta into total"""
+    for wsck, n in delta.items():
+        total[wsck] = total.get(wsck, 0) + n
+    return total
+
+
+@ndb.transactional
+def _applyRelatedDelta(websafeConferenceKey, delta):
+    """Apply a merged delta to a RelatedConferences row, creating it if needed"""
+    row_key = ndb.Key(RelatedConferences, websafeConferenceKey)
+    row = row_key.get() or RelatedConferences(key=row_key)
+    _setRow(row, _mergeCounts(dict(row.counts or {}), delta))
+    row.put()
+
+
+def flushRelatedDeltas(websafeConferenceKey):
+    """Lease all pending deltas of a row and apply them in one write"""
+    flushDeltas(RELATED_QUEUE, websafeConferenceKey, _mergeCounts,
+                _applyRelatedDelta)
+
+
+def _coRegistrations(websafeConferenceKey):
+    """Count the other conferences of a conference's attendees"""
+    counts = {}
+    attendees = Profile.query(
+        Profile.conferenceKeysToAttend == websafeConferenceKey)
+    for prof in attendees.iter(batch_size=RELATED_PROFILE_BATCH):
+        for wsck in prof.conferenceKeysToAttend:
+            if wsck != websafeConferenceKey:
+                counts[wsck] = counts.get(wsck, 0) + 1
+        if len(counts) > RELATED_MAX_CANDIDATES:
+            # keep memory bounded: drop the long tail of single co-registrations
+            counts = dict((k, v) for k, v in counts.items() if v > 1)
+    return counts
+
+
+def rebuildRelated(conf_keys):
+    """Recompute the RelatedConferences rows of a batch of conference keys"""
+    for conf_key in conf_keys:
+        wsck = conf_key.urlsafe()
+        # apply what is pending first so it isn't applied over the recount
+        flushRelatedDeltas(wsck)
+        row = RelatedConferences(key=ndb.Key(RelatedConferences, wsck),
+                                 lastRebuilt=datetime.now())
+        _setRow(row, _coRegistrations(wsck))
+        row.put()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Time-window queries on Session.startDateTime and Conference date ranges
+
+Session stores its date and startTime separately, which the datastore
+cannot range-scan as one instant. The computed startDateTime/endDateTime
+properties are indexed, so "sessions starting between T1 and T2" is a
+single range query; sessions written before they existed are re-saved by
+backfillSessionTimes.
+
+"Conferences running between D1 and D2" would need inequalities on both
+startDate and endDate. Instead every Conference indexes the weeks it runs
+in (Conference.weeks); a date range becomes an equality/IN filter on the
+weeks it covers, and conferencesOverlap drops the ones that only share a
+week with it.
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Session
+from models import weekBucket
+
+
+def sessionsInWindow(start, end, conference_key=None):
+    """Return the sessions starting in [start, end), optionally of one conference"""
+    query = Session.query(Session.startDateTime >= start,
+                          Session.startDateTime < end,
+                          ancestor=conference_key)
+    return query.order(Session.startDateTime)
+
+
+def nextSession(after):
+    """Return the first session starting at or after a given instant"""
+    return Session.query(Session.startDateTime >= after)\
+        .order(Session.startDateTime).get()
+
+
+def rangeWeeks(start, end):
+    """Return the week buckets of the dates from start to end, inclusive"""
+    return list(range(weekBucket(start), weekBucket(end) + 1))
+
+
+def conferencesOverlap(conf, start, end):
+    """Return whether a conference runs on any day from start to end"""
+    if not conf.startDate:
+        return False
+    return (conf.startDate <= end and
+            max(conf.endDate or conf.startDate, conf.startDate) >= start)
+
+
+def backfillConferenceWeeks(confs):
+    """
+    Re-save a batch of existing Conferences so the weeks they run in get
+    indexed (a mapper of the backfill_conference_weeks job)
+    """
+    ndb.put_multi(confs)
+
+
+def backfillSessionTimes(sessions):
+    """
+    Re-save a batch of existing Sessions so their computed start and end
+    instants get indexed (a mapper of the backfill_session_times job)
+    """
+    ndb.put_multi(sessions)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""seatfeed.py
+
+Change feed of Conference.seatsAvailable, for clients that would otherwise
+poll getConference and queryConferences
+
+Every change appends a compact (websafeConferenceKey, seatsAvailable,
+seatsVersion) event to the log of the current SEAT_FEED_BUCKET-second
+bucket in memcache. Events are appended by a task queued in the
+transaction that changed the seats, so they are never lost to a failed
+request, but they may land out of commit order: Conference.seatsVersion
+grows with every change and readers keep the highest version they saw.
+When memcache won't take the event (compare-and-set contention, a full
+bucket, memcache down) it spills to a SeatChangeEvent entity. Spills of a
+bucket are numbered by a memcache counter and keyed "<bucket>:<n>", so
+readers get them by key, which is strongly consistent, rather than by an
+eventually consistent query.
+
+Each bucket log links to the previous bucket that had events, and
+SEAT_FEED_HEAD_KEY names the latest one, so a reader can tell an empty
+bucket from an evicted one. When a bucket it should read is gone, the
+reader is told to resync.
+
+A writer may still append to a bucket for up to SEAT_FEED_BUCKET seconds
+after it closed (it picks the bucket before its compare-and-set retries or
+its spill), so a bucket is only settled once the next one has closed too.
+A feed token "<bucket>:<offset>:<next offset>" says the reader has seen
+every event of earlier buckets, which are settled, and the first offsets
+memcache events of <bucket> and the one after it, which may not be yet.
+Spilled events are only handed out once their bucket is settled, so
+offsets into unsettled buckets never shift under a reader.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatChangeEvent
+
+SEAT_FEED_BUCKET = 10               # seconds per log bucket
+SEAT_FEED_RETENTION = 90            # buckets (15 minutes) kept for readers
+SEAT_FEED_MAX_EVENTS = 2000         # events per memcache bucket before spilling
+SEAT_FEED_CAS_RETRIES = 3
+SEAT_FEED_LOG_KEY = 'SEAT_FEED_LOG:%d'
+SEAT_FEED_SPILL_KEY = 'SEAT_FEED_SPILL:%d'
+SEAT_FEED_HEAD_KEY = 'SEAT_FEED_HEAD'
+SEAT_FEED_POLL_INTERVAL = 1         # seconds between checks while long-polling
+SEAT_FEED_MAX_TIMEOUT = 20          # longest a request may long-poll
+
+
+def currentBucket():
+    """Return the number of the open log bucket"""
+    return int(time.time() // SEAT_FEED_BUCKET)
+
+
+def formatToken(bucket, offset, next_offset=0):
+    """Return the feed token of a position in the log"""
+    return '%d:%d:%d' % (bucket, offset, next_offset)
+
+
+def parseToken(token):
+    """
+    Return the (bucket, offset, next offset) of a feed token, or None if
+    it is invalid; tokens "<bucket>:<offset>" have seen nothing after bucket
+    """
+    try:
+        parts = [int(part) for part in token.split(':')]
+    except (AttributeError, ValueError):
+        return None
+    if len(parts) == 2:
+        parts.append(0)
+    return tuple(parts) if len(parts) == 3 else None
+
+
+def queueSeatChange(websafeConferenceKey, seatsAvailable, seatsVersion):
+    """
+    Queue the append of a seat change; call inside the transaction that
+    made it, so it is appended exactly when the change commits
+    """
+    taskqueue.add(params={'conference_key': websafeConferenceKey,
+                          'seats': seatsAvailable,
+                          'version': seatsVersion},
+                  url='/tasks/append_seat_change',
+                  transactional=ndb.in_transaction())
+
+
+def appendSeatChange(websafeConferenceKey, seatsAvailable, seatsVersion):
+    """Append a seat change event to the feed"""
+    bucket = currentBucket()
+    key = SEAT_FEED_LOG_KEY % bucket
+    ttl = SEAT_FEED_RETENTION * SEAT_FEED_BUCKET
+    event = (websafeConferenceKey, seatsAvailable, seatsVersion)
+    client = memcache.Client()
+
+    for i in range(SEAT_FEED_CAS_RETRIES):
+        log = client.gets(key)
+        if log is None:
+            # link the new bucket to the previous one that had events
+            stored = client.add(key, {'prev': client.get(SEAT_FEED_HEAD_KEY),
+                                      'events': [event]}, time=ttl)
+            if stored:
+                client.set(SEAT_FEED_HEAD_KEY, bucket)
+        elif len(log['events']) >= SEAT_FEED_MAX_EVENTS:
+            break
+        else:
+            stored = client.cas(key, dict(log, events=log['events'] + [event]),
+                                time=ttl)
+        if stored:
+            return
+
+    # spill to the datastore under the next number readers will get
+    client.add(SEAT_FEED_SPILL_KEY % bucket, 0, time=ttl)
+    number = client.incr(SEAT_FEED_SPILL_KEY % bucket)
+    SeatChangeEvent(id='%d:%d' % (bucket, number) if number else None,
+                    bucket=bucket, conferenceKey=websafeConferenceKey,
+                    seatsAvailable=seatsAvailable, seatsVersion=seatsVersion).put()
+
+
+def _missingBuckets(bucket, current, cached):
+    """Return whether a bucket from bucket to current with events was evicted"""
+    if SEAT_FEED_HEAD_KEY not in cached:
+        # memcache lost the feed, or it never had an event
+        memcache.add(SEAT_FEED_HEAD_KEY, -1)
+        return True
+    links = [cached[SEAT_FEED_HEAD_KEY]]
+    for b in range(bucket, current + 1):
+        log = cached.get(SEAT_FEED_LOG_KEY % b)
+        if not log:
+            continue
+        if log['prev'] is None:
+            # created while the head was gone: earlier buckets are unknown
+            if b > bucket:
+                return True
+            continue
+        links.append(log['prev'])
+    return any(bucket <= b <= current and SEAT_FEED_LOG_KEY % b not in cached
+               for b in links)
+
+
+def _spilledEvents(bucket, count):
+    """Return the events spilled to a bucket, by key"""
+    spilled = ndb.get_multi([ndb.Key(SeatChangeEvent, '%d:%d' % (bucket, n))
+                             for n in range(1, (count or 0) + 1)])
+    # a missing number is a spill whose put failed; its task appends again
+    return [(e.conferenceKey, e.seatsAvailable, e.seatsVersion)
+            for e in spilled if e]
+
+
+def _readFeed(bucket, offset, next_offset):
+    """
+    Return the events after a position, the position after them and
+    whether some of them were lost
+    """
+    current = currentBucket()
+    settled = current - 2
+    buckets = range(bucket, current + 1)
+    cached = memcache.get_multi(
+        [SEAT_FEED_LOG_KEY % b for b in buckets] +
+        [SEAT_FEED_SPILL_KEY % b for b in buckets if b <= settled] +
+        [SEAT_FEED_HEAD_KEY])
+    if _missingBuckets(bucket, current, cached):
+        return [], current, 0, 0, True
+
+    # memcache events seen of every bucket before reading
+    seen = {bucket: offset, bucket + 1: next_offset}
+    events = []
+    for b in buckets:
+        log = cached.get(SEAT_FEED_LOG_KEY % b)
+        size = len(log['events']) if log else 0
+        events.extend(log['events'][seen.get(b, 0):] if log else [])
+        seen[b] = max(seen.get(b, 0), size)
+        if b <= settled:
+            events.extend(_spilledEvents(b, cached.get(SEAT_FEED_SPILL_KEY % b)))
+
+    # move past settled buckets only
+    first = max(bucket, settled + 1)
+    return events, first, seen[first], seen.get(first + 1, 0), False
+def getSeatUpdates(since_token, timeout=0, conference_keys=None):
+    """
+    Return (updates, next_token, resync): the latest (seatsAvailable,
+    seatsVersion) of each conference changed since a token, waiting up to
+    timeout seconds for one. resync is True when events since the token
+    were lost and the client must reload.
+    """
+    position = parseToken(since_token) if since_token else None
+    if not position:
+        return {}, formatToken(currentBucket(), 0), bool(since_token)
+    bucket, offset, next_offset = position
+    if bucket < currentBucket() - SEAT_FEED_RETENTION:
+        return {}, formatToken(currentBucket(), 0), True
+
+    deadline = time.time() + min(timeout or 0, SEAT_FEED_MAX_TIMEOUT)
+    while True:
+        events, bucket, offset, next_offset, lost = _readFeed(
+            bucket, offset, next_offset)
+        if lost:
+            return {}, formatToken(bucket, offset, next_offset), True
+        updates = {}
+        for wsck, seats, version in events:
+            if conference_keys and wsck not in conference_keys:
+                continue
+            # appends may land out of commit order: keep the newest
+            if wsck not in updates or version > updates[wsck][1]:
+                updates[wsck] = (seats, version)
+        if updates or time.time() + SEAT_FEED_POLL_INTERVAL > deadline:
+            return updates, formatToken(bucket, offset, next_offset), False
+        time.sleep(SEAT_FEED_POLL_INTERVAL)
+
+
+def purgeSeatFeed():
+    """Delete spilled events older than the retention window"""
+    oldest = currentBucket() - SEAT_FEED_RETENTION
+    ndb.delete_multi(SeatChangeEvent.query(
+        SeatChangeEvent.bucket < oldest).fetch(keys_only=True))
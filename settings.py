@@ -14,3 +14,14 @@ created/forked from conference.py by wesc on 2014 may 24
 # Console or Cloud Console.
 WEB_CLIENT_ID = '805722458809-nq7p29fbohl7np94ocp1cgnvji2mdfk1.apps.googleusercontent.com'
 IOS_CLIENT_ID = '805722458809-m84tvh4i9ncnatff9e9592lrvr5cgp1j.apps.googleusercontent.com'
+
+# Rate limits of the write endpoints: calls allowed per user and per conference
+# in each window of 'window' seconds, by API method name.
+RATE_LIMITS = {
+    'createConference':         {'user': 10, 'window': 60},
+    'createSession':            {'user': 60, 'conference': 120, 'window': 60},
+    'registerForConference':    {'user': 5, 'conference': 200, 'window': 10},
+    'unregisterFromConference': {'user': 5, 'conference': 200, 'window': 10},
+    'addSessionToWishlist':     {'user': 30, 'window': 10},
+    'deleteSessionInWishlist':  {'user': 30, 'window': 10},
+}
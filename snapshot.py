@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""snapshot.py
+
+Offline snapshot of the public conference catalog, served as static JSON
+
+A cron job walks all conferences in cursor batches and renders them into
+gzip-compressed JSON shards, one per city and start month, split in parts
+when one would outgrow the datastore's 1 MB entity limit. Shards are
+written under a new version first; the CatalogSnapshot pointer is then
+switched to that version in one transaction, so readers never see a mix of
+two snapshots. Shard URLs embed the version, which makes them immutable and
+lets them be cached for a long time; only the small manifest is revalidated.
+
+"""
+
+from datetime import datetime
+import json
+import re
+import zlib
+
+from google.appengine.ext import ndb
+
+from cachecodec import getCached
+from cachecodec import setCached
+from models import CatalogShard
+from models import CatalogSnapshot
+from models import Conference
+from models import Profile
+
+CATALOG_BATCH_SIZE = 200
+CATALOG_SHARD_MAX_BYTES = 900000    # compressed, under the 1 MB entity limit
+CATALOG_PUT_MAX_BYTES = 4000000     # shard bytes written per put_multi
+CATALOG_POINTER_ID = 'current'
+CATALOG_MEMCACHE_KEY = 'CATALOG_SHARD:'
+CATALOG_FIELDS = ('name', 'description', 'topics', 'city', 'startDate', 'month',
+                  'maxAttendees', 'seatsAvailable', 'endDate', 'latitude',
+                  'longitude')
+
+
+def _gzip(data):
+    """Return data compressed in gzip format"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gunzip(data):
+    """Return the content of gzip compressed data"""
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def shardName(conf):
+    """Return the name of the catalog shard of a conference"""
+    city = re.sub(r'[^a-z0-9]+', '-', (conf.city or '').lower()).strip('-')
+    return '%s-%02d' % (city or 'none', conf.month or 0)
+
+
+def _conferenceToDict(conf, displayName):
+    """Render a Conference the way ConferenceForm is serialized"""
+    item = {}
+    for field in CATALOG_FIELDS:
+        value = getattr(conf, field)
+        if value not in (None, []):
+            item[field] = str(value) if field.endswith('Date') else value
+    item['websafeKey'] = conf.key.urlsafe()
+    if displayName:
+        item['organizerDisplayName'] = displayName
+    return item
+
+
+def splitShard(items):
+    """
+    Return the [(items, gzip compressed JSON)] parts of a shard, halving it
+    until every part is at most CATALOG_SHARD_MAX_BYTES
+    """
+    data = _gzip(json.dumps({'items': items}).encode('utf-8'))
+    if len(data) <= CATALOG_SHARD_MAX_BYTES or len(items) <= 1:
+        return [(items, data)]
+    half = len(items) // 2
+    return splitShard(items[:half]) + splitShard(items[half:])
+
+
+def buildCatalogSnapshot():
+    """Render all conferences into a new snapshot version and switch to it"""
+    version = datetime.now().strftime('%Y%m%d%H%M%S')
+    shards = {}
+    groups = {}
+
+    query = Conference.query().order(Conference.name)
+    cursor, more = None, True
+    while more:
+        confs, cursor, more = query.fetch_page(CATALOG_BATCH_SIZE,
+                                               start_cursor=cursor)
+        profiles = ndb.get_multi(
+            [ndb.Key(Profile, conf.organizerUserId) for conf in confs])
+        names = dict((p.key.id(), p.displayName) for p in profiles if p)
+        for conf in confs:
+            name = shardName(conf)
+            shards.setdefault(name, []).append(
+                _conferenceToDict(conf, names.get(conf.organizerUserId)))
+            groups[name] = (conf.city, conf.month or 0)
+
+    # write the new version first; nobody reads it until the pointer moves
+    manifest = []
+    batch, batch_bytes = [], 0
+    for name, items in sorted(shards.items()):
+        city, month = groups[name]
+        parts = splitShard(items)
+        for i, (part, data) in enumerate(parts):
+            part_name = name if len(parts) == 1 else '%s-part%d' % (name, i + 1)
+            if batch and batch_bytes + len(data) > CATALOG_PUT_MAX_BYTES:
+                ndb.put_multi(batch)
+                batch, batch_bytes = [], 0
+            batch.append(CatalogShard(id='%s/%s' % (version, part_name),
+                                      version=version, data=data))
+            batch_bytes += len(data)
+            manifest.append({'name': part_name, 'city': city, 'month': month,
+                             'count': len(part)})
+    ndb.put_multi(batch)
+    previous = _swapSnapshot(version, manifest)
+
+    # keep the previous version for clients still loading it, drop the rest
+    stale = CatalogShard.query(
+        CatalogShard.version < (previous or version)).fetch(keys_only=True)
+    ndb.delete_multi(stale)
+    return version
+
+
+@ndb.transactional
+def _swapSnapshot(version, manifest):
+    """Point the catalog to a new version, returning the previous one"""
+    pointer = CatalogSnapshot.get_by_id(CATALOG_POINTER_ID)
+    previous = pointer.version if pointer else None
+    CatalogSnapshot(id=CATALOG_POINTER_ID, version=version,
+                    shards=manifest).put()
+    return previous
+
+
+def getCatalogManifest():
+    """Return the current snapshot manifest, or None if there is none yet"""
+    pointer = CatalogSnapshot.get_by_id(CATALOG_POINTER_ID)
+    if not pointer:
+        return None
+    return {'version': pointer.version,
+            'created': str(pointer.created),
+            'shards': [dict(shard, url='/catalog/%s/%s.json' % (
+                pointer.version, shard['name'])) for shard in pointer.shards]}
+
+
+def getCatalogShard(version, name):
+    """Return the gzip compressed JSON of a shard, or None if it is unknown"""
+    shard_id = '%s/%s' % (version, name)
+    data = getCached(CATALOG_MEMCACHE_KEY + shard_id)
+    if data is None:
+        shard = CatalogShard.get_by_id(shard_id)
+        if not shard:
+            return None
+        # a versioned shard never changes, so it can be cached without expiry
+        data = shard.data
+        setCached(CATALOG_MEMCACHE_KEY + shard_id, data)
+    return data
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""speakers.py
+
+Speaker entities and the index of their sessions
+
+A Speaker is keyed by its normalized name, so "Jane  Doe" and "jane doe"
+are the same speaker and a Session can reference it without a read. Each
+Speaker keeps the keys of its sessions, which turns "all sessions of a
+speaker" into one get() plus one get_multi(). New sessions are stored
+together with that index in one transaction (see putSession).
+
+"""
+
+import unicodedata
+
+from google.appengine.ext import ndb
+
+from models import Speaker
+
+def displayName(name):
+    """Return a speaker name with its whitespace collapsed"""
+    if isinstance(name, bytes):
+        name = name.decode('utf-8')
+    return u' '.join(unicodedata.normalize('NFKC', name).split())
+
+
+def speakerKey(name):
+    """Return the Speaker key of a free-text speaker name, None if it is blank"""
+    normalized = displayName(name or u'').lower()
+    return ndb.Key(Speaker, normalized) if normalized else None
+
+
+@ndb.transactional
+def addSpeakerSessions(name, session_keys):
+    """Add sessions to the index of a speaker, creating the Speaker if needed"""
+    key = speakerKey(name)
+    if not key:
+        return None
+    speaker = key.get() or Speaker(key=key, name=displayName(name))
+    new_keys = [k for k in session_keys if k not in speaker.sessionKeys]
+    if new_keys:
+        speaker.sessionKeys.extend(new_keys)
+        speaker.put()
+    return speaker
+
+
+@ndb.transactional(xg=True)
+def putSession(session):
+    """Store a new Session and add it to the index of its speaker, atomically"""
+    session.put()
+    addSpeakerSessions(session.speaker, [session.key])
+    return session.key
+
+
+def getSpeakerSessions(name, conference_key=None):
+    """Return the sessions of a speaker, optionally only those of a conference"""
+    key = speakerKey(name)
+    speaker = key.get() if key else None
+    if not speaker:
+        return []
+    session_keys = speaker.sessionKeys
+    if conference_key:
+        session_keys = [k for k in session_keys if k.parent() == conference_key]
+    return [s for s in ndb.get_multi(session_keys) if s]
+
+
+def backfillSpeakers(sessions):
+    """
+    Index a batch of existing Sessions under their Speaker; safe to run more
+    than once (a mapper of the backfill_speakers job)
+    """
+    by_speaker = {}
+    for session in sessions:
+        session.speakerKey = speakerKey(session.speaker)
+        if not session.speakerKey:
+            continue
+        by_speaker.setdefault(session.speakerKey, (session.speaker, []))[1]\
+            .append(session.key)
+    for name, session_keys in by_speaker.values():
+        addSpeakerSessions(name, session_keys)
+    ndb.put_multi(sessions)
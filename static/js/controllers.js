@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, $http, $q, oauth2Provider, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -270,7 +270,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         {enumValue: 'CITY', displayName: 'City'},
         {enumValue: 'TOPIC', displayName: 'Topic'},
         {enumValue: 'MONTH', displayName: 'Start month'},
-        {enumValue: 'MAX_ATTENDEES', displayName: 'Max Attendees'}
+        {enumValue: 'MAX_ATTENDEES', displayName: 'Max Attendees'},
+        {enumValue: 'DATE_RANGE', displayName: 'Running (YYYY-MM-DD/YYYY-MM-DD)'}
     ]
 
     /**
@@ -424,9 +425,50 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Loads all conferences from the static catalog snapshot, falling back to
+     * the queryConferences API if there is no snapshot yet.
+     */
+    $scope.queryConferencesSnapshot = function () {
+        $scope.loading = true;
+        $http.get('/catalog/manifest.json').then(function (manifest) {
+            return $q.all(manifest.data.shards.map(function (shard) {
+                // shard urls are versioned, so they never go stale
+                return $http.get(shard.url, {cache: true});
+            }));
+        }).then(function (shards) {
+            $scope.loading = false;
+            $scope.conferences = [];
+            angular.forEach(shards, function (shard) {
+                angular.forEach(shard.data.items, function (conference) {
+                    $scope.conferences.push(conference);
+                });
+            });
+            $scope.conferences.sort(function (a, b) {
+                return a.name < b.name ? -1 : (a.name > b.name ? 1 : 0);
+            });
+            $scope.submitted = true;
+        }, function () {
+            $scope.loading = false;
+            $scope.queryConferencesApi();
+        });
+    };
+
+    /**
+     * Lists the conferences; anonymous users without filters are served from
+     * the static catalog snapshot instead of the API.
      */
     $scope.queryConferencesAll = function () {
+        if (!oauth2Provider.signedIn && $scope.filters.length == 0) {
+            $scope.queryConferencesSnapshot();
+        } else {
+            $scope.queryConferencesApi();
+        }
+    };
+
+    /**
+     * Invokes the conference.queryConferences API.
+     */
+    $scope.queryConferencesApi = function () {
         var sendFilters = {
             filters: []
         }
@@ -554,42 +596,41 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
 
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConference and conference.getProfile methods in one
+     * conference.batch call and sets the returned conference in the $scope.
      *
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
-            websafeConferenceKey: $routeParams.websafeConferenceKey
+        gapi.client.conference.batch({
+            items: [
+                {method: 'getConference', websafeConferenceKey: $routeParams.websafeConferenceKey},
+                {method: 'getProfile'}
+            ]
         }).execute(function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
-                if (resp.error) {
+                var conferenceResult = resp.items && resp.items[0];
+                var profileResult = resp.items && resp.items[1];
+                if (resp.error || conferenceResult.error) {
                     // The request has failed.
-                    var errorMessage = resp.error.message || '';
+                    var errorMessage = resp.error ? (resp.error.message || '') : conferenceResult.error;
                     $scope.messages = 'Failed to get the conference : ' + $routeParams.websafeKey
                         + ' ' + errorMessage;
                     $scope.alertStatus = 'warning';
                     $log.error($scope.messages);
-                } else {
-                    // The request has succeeded.
-                    $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
+                    return;
                 }
-            });
-        });
-
-        $scope.loading = true;
-        // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
-            $scope.$apply(function () {
-                $scope.loading = false;
-                if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
+                // The request has succeeded.
+                $scope.alertStatus = 'success';
+                $scope.conference = conferenceResult.conference;
+
+                // If the user is attending the conference, updates the status message and available function.
+                if (!profileResult.error) {
+                    var profile = profileResult.profile;
+                    var conferenceKeys = profile.conferenceKeysToAttend || [];
+                    for (var i = 0; i < conferenceKeys.length; i++) {
+                        if ($routeParams.websafeConferenceKey == conferenceKeys[i]) {
                             // The user is attending the conference.
                             $scope.alertStatus = 'info';
                             $scope.messages = 'You are attending this conference';
@@ -624,12 +665,17 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         return;
                     }
                 } else {
-                    if (resp.result) {
+                    if (resp.result && resp.result.data) {
                         // Register succeeded.
                         $scope.messages = 'Registered for the conference';
                         $scope.alertStatus = 'success';
                         $scope.isUserAttending = true;
                         $scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
+                    } else if (resp.result && resp.result.waitlistPosition) {
+                        // The conference is full, the user has been waitlisted.
+                        $scope.messages = 'The conference is full. You are number ' +
+                            resp.result.waitlistPosition + ' on the waitlist';
+                        $scope.alertStatus = 'info';
                     } else {
                         $scope.messages = 'Failed to register for the conference';
                         $scope.alertStatus = 'warning';
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""stats.py
+
+Pre-aggregated ConferenceStats: write-behind deltas and offline rebuild
+
+Write paths (session creation, registration) never touch the stats entity
+directly. They queue a compact delta on the 'stats-deltas' pull queue,
+which /tasks/flush_conference_stats applies once per conference and time
+window in a single transactional write (see deltaqueue.py). The rebuild
+job recomputes the totals from scratch.
+
+Deltas carry the time of their change ('at'). The rebuild records when it
+started counting (countedUntil) and a later flush drops the recounted parts
+of older deltas, which the count already includes. A change that commits
+while the count runs can still be off by one until the next rebuild.
+
+"""
+
+from datetime import datetime
+import time
+
+from google.appengine.ext import ndb
+
+from deltaqueue import flushDeltas
+from deltaqueue import recordDeltas
+from models import ConferenceStats
+from models import Profile
+from models import Session
+from speakers import displayName
+
+STATS_QUEUE = 'stats-deltas'
+STATS_FLUSH_WINDOW = 10         # seconds of deltas coalesced per flush
+STATS_COUNTERS = ('attendees', 'sessions')
+STATS_HISTOGRAMS = ('sessionsByType', 'sessionsBySpeaker', 'minutesBySpeaker',
+                    'registrationsByDay')
+# what rebuildConferenceStats recounts; registrationsByDay is kept
+STATS_RECOUNTED = STATS_COUNTERS + ('sessionsByType', 'sessionsBySpeaker',
+                                    'minutesBySpeaker')
+
+
+def _stamped(delta, at):
+    """Return delta with the time of its change, if known"""
+    if at is not None:
+        delta['at'] = at
+    return delta
+
+
+def registrationDelta(reg=True, at=None):
+    """Return the stats delta for one (un)registration made at time at"""
+    if not reg:
+        return _stamped({'attendees': -1}, at)
+    return _stamped({'attendees': 1,
+                     'registrationsByDay': {datetime.now().date().isoformat(): 1}},
+                    at)
+
+
+def sessionDelta(session, at=None):
+    """Return the stats delta for one newly created Session, created at time at"""
+    speaker = displayName(session.speaker)
+    return _stamped({'sessions': 1,
+                     'sessionsByType': dict((t, 1) for t in session.typeOfSession),
+                     'sessionsBySpeaker': {speaker: 1},
+                     'minutesBySpeaker': {speaker: session.duration or 0}},
+                    at)
+
+
+def mergeDeltas(total, delta):
+    """Add delta into total, summing counters and histogram buckets"""
+    for name, value in delta.items():
+        if isinstance(value, dict):
+            bucket = total.setdefault(name, {})
+            for k, v in value.items():
+                bucket[k] = bucket.get(k, 0) + v
+        else:
+            total[name] = total.get(name, 0) + value
+    return total
+
+
+def recordStatsDelta(websafeConferenceKey, delta, name=None):
+    """
+    Queue a stats delta and make sure a flush is scheduled for it; a named
+    delta is queued at most once
+    """
+    recordDeltas(STATS_QUEUE, {websafeConferenceKey: delta},
+                 '/tasks/flush_conference_stats', STATS_FLUSH_WINDOW, name=name)
+
+
+def _collectDeltas(total, delta):
+    """Keep the deltas of a flush apart; which count depends on the stats entity"""
+    total.setdefault('deltas', []).append(delta)
+    return total
+
+
+@ndb.transactional
+def _applyStatsDeltas(websafeConferenceKey, total):
+    """
+    Apply the collected deltas to the ConferenceStats entity, creating it if
+    needed; the recounted parts of deltas older than the last rebuild's count
+    are dropped
+    """
+    stats_key = ndb.Key(ConferenceStats, websafeConferenceKey)
+    stats = stats_key.get() or ConferenceStats(key=stats_key)
+    delta = {}
+    for change in total.get('deltas', []):
+        at = change.pop('at', None)
+        if at is not None and stats.countedUntil and at <= stats.countedUntil:
+            change = dict((name, value) for name, value in change.items()
+                          if name not in STATS_RECOUNTED)
+        mergeDeltas(delta, change)
+    for name in STATS_COUNTERS:
+        setattr(stats, name, (getattr(stats, name) or 0) + delta.get(name, 0))
+    for name in STATS_HISTOGRAMS:
+        histogram = mergeDeltas({name: getattr(stats, name) or {}},
+                                {name: delta.get(name, {})})[name]
+        # drop buckets that have been cancelled out
+        setattr(stats, name, dict((k, v) for k, v in histogram.items() if v))
+    stats.put()
+    return stats
+
+
+def flushStatsDeltas(websafeConferenceKey):
+    """Lease all pending deltas of a conference and apply them in one write"""
+    flushDeltas(STATS_QUEUE, websafeConferenceKey, _collectDeltas,
+                _applyStatsDeltas)
+
+
+def rebuildStats(conf_keys):
+    """Rebuild the ConferenceStats of a batch of conference keys"""
+    for conf_key in conf_keys:
+        rebuildConferenceStats(conf_key.urlsafe())
+
+
+def rebuildConferenceStats(websafeConferenceKey):
+    """Recompute ConferenceStats of a conference from Sessions and Profiles
+
+    registrationsByDay cannot be recovered from the datastore (Profiles do
+    not record when they registered), so its history is kept as is. Deltas
+    of changes made before the count started are included in it, so the
+    start is recorded as countedUntil for the flush to skip them.
+    """
+    # apply what is pending first so the registration history is not lost
+    flushStatsDeltas(websafeConferenceKey)
+
+    counted_until = time.time()
+
+    conf_key = ndb.Key(urlsafe=websafeConferenceKey)
+    totals = {'attendees': Profile.query(
+        Profile.conferenceKeysToAttend == websafeConferenceKey).count()}
+    for session in Session.query(ancestor=conf_key).iter(batch_size=200):
+        mergeDeltas(totals, sessionDelta(session))
+
+    @ndb.transactional
+    def _replace():
+        stats_key = ndb.Key(ConferenceStats, websafeConferenceKey)
+        stats = stats_key.get() or ConferenceStats(key=stats_key)
+        for name in STATS_COUNTERS:
+            setattr(stats, name, totals.get(name, 0))
+        for name in STATS_HISTOGRAMS:
+            if name != 'registrationsByDay':
+                setattr(stats, name, totals.get(name, {}))
+        stats.countedUntil = counted_until
+        stats.lastRebuilt = datetime.now()
+        stats.put()
+        return stats
+    return _replace()
@@ -0,0 +1,136 @@
+"""conftest.py
+
+Fixtures of the test suite: the App Engine service stubs of the SDK's
+testbed, a runner for queued push tasks and a signed-in API caller
+
+Tests need the App Engine SDK (datastore, memcache and taskqueue stubs);
+test modules skip themselves when it isn't importable. Tests calling the
+Endpoints API also skip without the endpoints library. Requests of an
+API method are built with CONTAINER.combined_message_class(...).
+
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed as gae_testbed
+except ImportError:
+    gae_testbed = None
+
+
+@pytest.fixture(autouse=True)
+def testbed():
+    """Activate fresh, strongly consistent service stubs for each test"""
+    if gae_testbed is None:
+        pytest.skip('App Engine SDK not available')
+    tb = gae_testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id='python-scalable-app-1186', overwrite=True)
+    tb.init_datastore_v3_stub(consistency_policy=
+        datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    # root_path makes the stub read queue.yaml, pull queues included
+    tb.init_taskqueue_stub(root_path=ROOT)
+    ndb.get_context().set_cache_policy(False)
+    ndb.get_context().clear_cache()
+    yield tb
+    tb.deactivate()
+
+
+@pytest.fixture
+def queued_tasks(testbed):
+    """Return a function listing the queued push tasks, optionally of one url"""
+    stub = testbed.get_stub(gae_testbed.TASKQUEUE_SERVICE_NAME)
+
+    def queued(url=None):
+        return [task for task in stub.get_filtered_tasks(queue_names=['default'])
+                if url is None or task.url.split('?')[0] == url]
+    return queued
+
+
+@pytest.fixture
+def run_tasks(testbed, queued_tasks):
+    """
+    Return a function running the queued push tasks through main.app, and
+    those they queue, until none are left (or only those of one url);
+    it returns the number of tasks run
+    """
+    import webapp2
+    import main
+    stub = testbed.get_stub(gae_testbed.TASKQUEUE_SERVICE_NAME)
+
+    def run(url=None, limit=1000):
+        count = 0
+        while count < limit:
+            tasks = queued_tasks(url)
+            if not tasks:
+                return count
+            task = tasks[0]
+            stub.DeleteTask('default', task.name)
+            request = webapp2.Request.blank(task.url, method=task.method,
+                body=task.payload if task.method != 'GET' else None,
+                headers={'X-AppEngine-TaskName': task.name,
+                         'Content-Type': 'application/x-www-form-urlencoded'})
+            response = request.get_response(main.app)
+            assert response.status_int < 300, (task.url, response.status)
+            count += 1
+        raise AssertionError('tasks keep queueing more tasks')
+    return run
+
+
+class _User(object):
+    """Signed-in user returned by endpoints.get_current_user"""
+    def __init__(self, email):
+        self._email = email
+
+    def email(self):
+        return self._email
+
+    def nickname(self):
+        return self._email.split('@')[0]
+
+
+@pytest.fixture
+def login(monkeypatch):
+    """Return a function signing a user in to the Endpoints API by email"""
+    endpoints = pytest.importorskip('endpoints')
+
+    def signIn(email):
+        user = _User(email) if email else None
+        monkeypatch.setattr(endpoints, 'get_current_user', lambda: user)
+        return user
+    return signIn
+
+
+@pytest.fixture
+def api(login):
+    """Return a ConferenceApi with organizer@example.com signed in"""
+    import conference
+    login('organizer@example.com')
+    return conference.ConferenceApi()
+
+
+@pytest.fixture
+def make_conference(testbed):
+    """Return a function storing a conference of organizer@example.com, returning its websafe key"""
+    from models import Conference
+    from models import Profile
+
+    def make(name='Conference', seats=10, organizer='organizer@example.com',
+             **fields):
+        p_key = ndb.Key(Profile, organizer)
+        if not p_key.get():
+            Profile(key=p_key, displayName=organizer.split('@')[0],
+                    mainEmail=organizer).put()
+        conf = Conference(parent=p_key, name=name, organizerUserId=organizer,
+                          maxAttendees=seats, seatsAvailable=seats, **fields)
+        return conf.put().urlsafe()
+    return make
@@ -0,0 +1,93 @@
+"""Tests of the batch endpoint and the isolation of its calls"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+from models import BatchRequestForm
+from models import BatchRequestItemForm
+
+
+def _batch(api, *items):
+    request = BatchRequestForm(items=[BatchRequestItemForm(**item) for item in items])
+    return [(r.method, r.code) for r in api.batch(request).items]
+
+
+def test_results_come_back_in_request_order(api, make_conference):
+    wsck = make_conference(name='PyCon')
+    results = api.batch(BatchRequestForm(items=[
+        BatchRequestItemForm(method='getConference', websafeConferenceKey=wsck),
+        BatchRequestItemForm(method='getProfile'),
+        BatchRequestItemForm(method='getConferenceSessions',
+                             websafeConferenceKey=wsck)])).items
+    assert [r.code for r in results] == [200, 200, 200]
+    assert results[0].conference.name == 'PyCon'
+    assert results[1].profile.mainEmail == 'organizer@example.com'
+
+
+def test_keys_repeated_across_calls_are_fetched_once(api, make_conference,
+                                                     monkeypatch):
+    from collections import Counter
+    wsck = make_conference()
+    prof = ndb.Key('Profile', 'organizer@example.com').get()
+    prof.conferenceKeysToAttend.append(wsck)
+    prof.put()
+
+    fetched = Counter()
+    get_async = ndb.Key.get_async
+
+    def counted(key, **kwargs):
+        fetched[key] += 1
+        return get_async(key, **kwargs)
+    monkeypatch.setattr(ndb.Key, 'get_async', counted)
+    assert _batch(api,
+        {'method': 'getConference', 'websafeConferenceKey': wsck},
+        {'method': 'getProfile'},
+        {'method': 'getConferencesToAttend'},
+        {'method': 'getConference', 'websafeConferenceKey': wsck},
+        {'method': 'getProfile'},
+    ) == [('getConference', 200), ('getProfile', 200),
+          ('getConferencesToAttend', 200), ('getConference', 200),
+          ('getProfile', 200)]
+    # the profile is also the organizer of the conference
+    assert fetched == {ndb.Key(urlsafe=wsck): 1, prof.key: 1}
+
+
+def test_bad_input_fails_only_its_own_call(api, make_conference):
+    wsck = make_conference()
+    profile_key = ndb.Key('Profile', 'organizer@example.com').urlsafe()
+    assert _batch(api,
+        {'method': 'getConference', 'websafeConferenceKey': 'not-a-key'},
+        {'method': 'getConferenceSessions', 'websafeConferenceKey': profile_key},
+        {'method': 'getConference'},
+        {'method': 'deleteConference'},
+        {'method': 'getConference', 'websafeConferenceKey': wsck},
+    ) == [('getConference', 404), ('getConferenceSessions', 404),
+          ('getConference', 400), ('deleteConference', 400),
+          ('getConference', 200)]
+
+
+def test_unexpected_errors_are_reported_per_call(api, make_conference,
+                                                  monkeypatch):
+    import conference
+    wsck = make_conference()
+
+    @ndb.tasklet
+    def broken(self, speaker, fetch):
+        raise ValueError('boom')
+    monkeypatch.setattr(conference.ConferenceApi, '_speakerSessionsAsync', broken)
+    results = api.batch(BatchRequestForm(items=[
+        BatchRequestItemForm(method='getSessionsBySpeaker', speaker='Ada'),
+        BatchRequestItemForm(method='getConference', websafeConferenceKey=wsck)]
+    )).items
+    assert [r.code for r in results] == [500, 200]
+    assert 'boom' not in results[0].error
+
+
+def test_batch_size_is_capped(api):
+    import endpoints
+    import conference
+    with pytest.raises(endpoints.BadRequestException):
+        _batch(api, *[{'method': 'getProfile'}] * (conference.BATCH_MAX_ITEMS + 1))
@@ -0,0 +1,110 @@
+"""Tests of the compressed, chunked memcache values of cachecodec.py"""
+
+import os
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.api import memcache
+
+import cachecodec
+from cachecodec import CODEC_CHUNK_KEY
+from cachecodec import decodeValue
+from cachecodec import encodeValue
+from cachecodec import getCached
+from cachecodec import setCached
+
+KEY = 'codec-test'
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Chunk values past 1000 bytes"""
+    monkeypatch.setattr(cachecodec, 'CODEC_CHUNK_SIZE', 1000)
+
+
+def _chunkKeys(key):
+    """Return the chunk keys of the manifest cached under a key"""
+    manifest = memcache.get(key)
+    generation, count, _, _ = cachecodec._MANIFEST.unpack(
+        manifest[cachecodec._HEADER.size:])
+    return [CODEC_CHUNK_KEY % (key, generation.decode('ascii'), i)
+            for i in range(count)]
+
+
+@pytest.mark.parametrize('value', [
+    u'Announcement', {'speaker': u'Ada', 'sessions': [u'a', u'b']},
+    [{'name': 'Conference %d' % i, 'seats': i} for i in range(500)],
+    os.urandom(5000), b'', 0, None])
+def test_values_round_trip(value):
+    assert decodeValue(encodeValue(value)) == value
+    assert setCached(KEY, value)
+    assert getCached(KEY) == value
+
+
+def test_only_compressible_values_past_the_threshold_are_compressed():
+    flags = lambda data: cachecodec._decode(data)[0]
+    assert flags(encodeValue('x' * 100)) == 0
+    assert flags(encodeValue('x' * 5000)) == cachecodec._FLAG_ZLIB
+    assert len(encodeValue('x' * 5000)) < 200
+    assert flags(encodeValue(os.urandom(5000))) == 0
+
+
+def test_values_over_the_item_limit_are_chunked():
+    value = os.urandom(2500000)
+    assert setCached(KEY, value)
+    assert len(_chunkKeys(KEY)) == 3
+    assert getCached(KEY) == value
+
+
+def test_chunks_are_read_with_one_get_multi(small_chunks, monkeypatch):
+    value = os.urandom(5000)
+    setCached(KEY, value)
+    calls = []
+    get_multi = memcache.get_multi
+    monkeypatch.setattr(memcache, 'get_multi',
+        lambda keys, **kwargs: calls.append(keys) or get_multi(keys, **kwargs))
+    assert getCached(KEY) == value
+    assert calls == [_chunkKeys(KEY)]
+
+
+def test_missing_chunk_is_a_miss(small_chunks):
+    setCached(KEY, os.urandom(5000))
+    memcache.delete(_chunkKeys(KEY)[2])
+    assert getCached(KEY) is None
+
+
+def test_corrupt_chunk_is_a_miss(small_chunks):
+    setCached(KEY, os.urandom(5000))
+    key = _chunkKeys(KEY)[1]
+    chunk = memcache.get(key)
+    memcache.set(key, chunk[:10] + bytes(bytearray([ord(chunk[10:11]) ^ 1]))
+                 + chunk[11:])
+    assert getCached(KEY) is None
+
+
+def test_rewrite_uses_new_chunks(small_chunks):
+    setCached(KEY, os.urandom(5000))
+    old_keys = _chunkKeys(KEY)
+    value = os.urandom(5000)
+    setCached(KEY, value)
+    assert not set(old_keys) & set(_chunkKeys(KEY))
+    assert getCached(KEY) == value
+
+
+def test_failed_chunk_write_leaves_no_manifest(small_chunks, monkeypatch):
+    memcache.set(KEY, encodeValue('old'))
+    monkeypatch.setattr(memcache, 'set_multi',
+                        lambda mapping, **kwargs: list(mapping))
+    assert not setCached(KEY, os.urandom(5000))
+    assert getCached(KEY) is None
+
+
+def test_other_versions_and_garbage_are_misses(monkeypatch):
+    memcache.set(KEY, encodeValue('value'))
+    monkeypatch.setattr(cachecodec, 'CODEC_VERSION', cachecodec.CODEC_VERSION + 1)
+    assert getCached(KEY) is None
+    for garbage in (b'', b'\x01', u'text', 42):
+        memcache.set(KEY, garbage)
+        assert getCached(KEY) is None
@@ -0,0 +1,92 @@
+"""Tests of the bounded-staleness conference cache of getConference"""
+
+import time
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+import confcache
+from confcache import CONF_CACHE_FRESH
+from confcache import CONF_CACHE_MAX_STALENESS
+from confcache import getConferenceEventually
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Return a function moving time.time forward by some seconds"""
+    now = [time.time()]
+    monkeypatch.setattr(confcache.time, 'time', lambda: now[0])
+    monkeypatch.setattr(confcache.time, 'sleep', lambda seconds: None)
+
+    def advance(seconds):
+        now[0] += seconds
+    return advance
+
+
+def _rename(wsck, name):
+    conf = ndb.Key(urlsafe=wsck).get()
+    conf.name = name
+    conf.put()
+
+
+def _name(wsck):
+    return getConferenceEventually(ndb.Key(urlsafe=wsck))[0].name
+
+
+def test_fresh_entry_is_served_without_refresh(clock, make_conference,
+                                               queued_tasks):
+    wsck = make_conference(name='Before')
+    assert _name(wsck) == 'Before'
+    _rename(wsck, 'After')
+    clock(CONF_CACHE_FRESH)
+    assert _name(wsck) == 'Before'
+    assert queued_tasks('/tasks/refresh_conference') == []
+
+
+def test_stale_entry_is_served_while_one_task_refreshes_it(
+        clock, make_conference, queued_tasks, run_tasks):
+    wsck = make_conference(name='Before')
+    _name(wsck)
+    _rename(wsck, 'After')
+    clock(CONF_CACHE_FRESH + 1)
+    for i in range(5):
+        assert _name(wsck) == 'Before'
+    assert len(queued_tasks('/tasks/refresh_conference')) == 1
+
+    run_tasks('/tasks/refresh_conference')
+    assert _name(wsck) == 'After'
+
+
+def test_nothing_older_than_max_staleness_is_served(clock, make_conference,
+                                                    run_tasks):
+    wsck = make_conference(name='Before')
+    _name(wsck)
+    _rename(wsck, 'After')
+    # the refresh task never runs
+    clock(CONF_CACHE_FRESH + 1)
+    assert _name(wsck) == 'Before'
+    clock(CONF_CACHE_MAX_STALENESS - CONF_CACHE_FRESH)
+    assert _name(wsck) == 'After'
+
+
+def test_reader_without_the_lease_reads_the_datastore_eventually(
+        clock, make_conference, queued_tasks):
+    wsck = make_conference(name='Before')
+    assert confcache._acquireLease(wsck)
+    assert _name(wsck) == 'Before'
+    assert queued_tasks('/tasks/refresh_conference') == []
+
+
+@pytest.mark.parametrize('consistency', ['strong', 'eventual'])
+def test_malformed_or_other_kind_keys_are_not_found(api, consistency):
+    import endpoints
+    import conference
+    from models import Session
+    for wsck in ('garbage', ndb.Key(Session, 1).urlsafe()):
+        with pytest.raises(endpoints.NotFoundException):
+            api.getConference(
+                conference.CONF_READ_REQUEST.combined_message_class(
+                    websafeConferenceKey=wsck, consistency=consistency))
@@ -0,0 +1,149 @@
+"""Tests of the DATE_RANGE filter: week buckets, range parsing, overlap and indexes"""
+
+from datetime import date, timedelta
+import os
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed as gae_testbed
+
+from models import CONFERENCE_MAX_WEEKS
+from models import Conference
+from models import weekBucket
+from schedule import conferencesOverlap
+from schedule import rangeWeeks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _filters(*specs):
+    from models import ConferenceQueryForm
+    return [ConferenceQueryForm(field=field, operator=op, value=value)
+            for field, op, value in specs]
+
+
+def _query(api, *specs):
+    from models import ConferenceQueryForms
+    return api.queryConferences(ConferenceQueryForms(filters=_filters(*specs)))
+
+
+def test_week_buckets_run_monday_to_sunday():
+    monday = date(2016, 12, 26)
+    assert monday.weekday() == 0
+    week = [monday + timedelta(days=i) for i in range(7)]
+    assert set(weekBucket(day) for day in week) == set([weekBucket(monday)])
+    assert weekBucket(monday - timedelta(days=1)) == weekBucket(monday) - 1
+    # across the year boundary, Sunday 2017-01-01 is in the week of Monday
+    assert weekBucket(date(2017, 1, 1)) == weekBucket(monday)
+    assert weekBucket(date(2017, 1, 2)) == weekBucket(monday) + 1
+
+
+def test_range_weeks_cross_the_year_boundary():
+    assert rangeWeeks(date(2016, 12, 31), date(2017, 1, 2)) == \
+        [weekBucket(date(2016, 12, 31)), weekBucket(date(2017, 1, 2))]
+    assert len(rangeWeeks(date(2016, 12, 26), date(2017, 1, 1))) == 1
+
+
+def test_conference_weeks_are_capped():
+    start = date(2016, 12, 28)
+    conf = Conference(name='Short', startDate=start,
+                      endDate=date(2017, 1, 3))
+    assert conf.weeks == [weekBucket(start), weekBucket(start) + 1]
+    conf = Conference(name='Long', startDate=start,
+                      endDate=start + timedelta(days=3 * 365))
+    assert len(conf.weeks) == CONFERENCE_MAX_WEEKS
+    assert conf.weeks[0] == weekBucket(start)
+    # no end date, or one before the start: one day
+    assert Conference(name='x', startDate=start).weeks == [weekBucket(start)]
+    assert Conference(name='x', startDate=start,
+                      endDate=start - timedelta(days=5)).weeks == \
+        [weekBucket(start)]
+    assert Conference(name='x').weeks == []
+
+
+@pytest.mark.parametrize('start, end, expected', [
+    (date(2016, 12, 31), date(2017, 1, 2), True),
+    (date(2017, 1, 3), date(2017, 1, 10), True),
+    (date(2017, 1, 4), date(2017, 1, 10), False),
+    (date(2016, 12, 1), date(2016, 12, 30), True),
+    (date(2016, 12, 1), date(2016, 12, 29), False)])
+def test_overlap_includes_both_ends(start, end, expected):
+    conf = Conference(name='x', startDate=date(2016, 12, 30),
+                      endDate=date(2017, 1, 3))
+    assert conferencesOverlap(conf, start, end) is expected
+
+
+def test_overlap_of_conferences_without_dates():
+    assert not conferencesOverlap(Conference(name='x'), date(2017, 1, 1),
+                                  date(2017, 1, 2))
+    conf = Conference(name='x', startDate=date(2017, 1, 2))
+    assert conferencesOverlap(conf, date(2017, 1, 2), date(2017, 1, 2))
+
+
+def test_query_returns_the_conferences_running_in_the_range(api,
+                                                            make_conference):
+    make_conference(name='New year', startDate=date(2016, 12, 30),
+                    endDate=date(2017, 1, 2))
+    make_conference(name='Same week', startDate=date(2017, 1, 6),
+                    endDate=date(2017, 1, 7))
+    make_conference(name='Long', startDate=date(2016, 6, 1),
+                    endDate=date(2017, 3, 1))
+    make_conference(name='Undated')
+    forms = _query(api, ('DATE_RANGE', 'EQ', '2016-12-31/2017-01-04'))
+    assert sorted(form.name for form in forms.items) == ['Long', 'New year']
+
+
+@pytest.mark.parametrize('specs', [
+    [('DATE_RANGE', 'EQ', '2017-01-02')],
+    [('DATE_RANGE', 'EQ', '2017-01-02/2017-13-01')],
+    [('DATE_RANGE', 'EQ', '')],
+    [('DATE_RANGE', 'NE', '2017-01-02/2017-01-03')],
+    [('DATE_RANGE', 'EQ', '2017-01-03/2017-01-02')],
+    # 27 weeks, across the year boundary
+    [('DATE_RANGE', 'EQ', '2016-10-01/2017-04-01')],
+    [('DATE_RANGE', 'EQ', '2017-01-02/2017-01-03'),
+     ('DATE_RANGE', 'EQ', '2017-01-02/2017-01-03')],
+    # no composite index serves these
+    [('DATE_RANGE', 'EQ', '2017-01-02/2017-01-03'), ('CITY', 'GT', 'London')],
+    [('DATE_RANGE', 'EQ', '2017-01-02/2017-01-03'), ('CITY', 'EQ', 'London'),
+     ('MONTH', 'EQ', '1')]])
+def test_bad_date_ranges_are_rejected(api, specs):
+    import endpoints
+    with pytest.raises(endpoints.BadRequestException):
+        _query(api, *specs)
+
+
+def test_range_of_26_weeks_is_accepted(api):
+    assert _query(api, ('DATE_RANGE', 'EQ', '2016-12-26/2017-06-25')).items == []
+
+
+@pytest.fixture
+def indexed(testbed):
+    """Datastore stub refusing queries without a composite index in index.yaml"""
+    tb = gae_testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(require_indexes=True, root_path=ROOT,
+        consistency_policy=
+        datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    ndb.get_context().set_cache_policy(False)
+    yield tb
+    tb.deactivate()
+
+
+@pytest.mark.parametrize('specs', [
+    [],
+    [('CITY', 'EQ', 'London')],
+    [('TOPIC', 'EQ', 'Web')],
+    [('MONTH', 'EQ', '1')],
+    [('MONTH', 'LT', '3')],
+    [('MAX_ATTENDEES', 'GT', '10')],
+    [('CITY', 'EQ', 'London'), ('MAX_ATTENDEES', 'GT', '10')],
+    [('TOPIC', 'EQ', 'Web'), ('MAX_ATTENDEES', 'LTEQ', '10')],
+    [('CITY', 'EQ', 'London'), ('TOPIC', 'EQ', 'Web'),
+     ('MAX_ATTENDEES', 'GT', '10')]])
+def test_accepted_combinations_have_an_index(api, indexed, specs):
+    _query(api, ('DATE_RANGE', 'EQ', '2017-01-02/2017-01-16'), *specs)
@@ -0,0 +1,95 @@
+"""Tests of the write-behind deltas shared by stats.py and related.py"""
+
+import json
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from deltaqueue import recordDeltas
+from models import ConferenceStats
+from models import RelatedConferences
+from related import recordCoRegistration
+from stats import recordStatsDelta
+from stats import registrationDelta
+
+
+def test_named_delta_is_queued_once(make_conference, run_tasks):
+    wsck = make_conference()
+    for i in range(3):
+        recordStatsDelta(wsck, registrationDelta(), name='registration-1')
+
+    assert run_tasks('/tasks/flush_conference_stats') == 1
+    assert ndb.Key(ConferenceStats, wsck).get().attendees == 1
+
+
+def test_co_registrations_update_every_row_with_one_flush_each(
+        make_conference, run_tasks):
+    wscks = [make_conference(name='Conference %d' % i) for i in range(3)]
+    recordCoRegistration(wscks[0], wscks[1:], 1, 'task-1')
+    recordCoRegistration(wscks[0], wscks[1:], 1, 'task-2')
+    recordCoRegistration(wscks[1], wscks[2:], 1, 'task-3')
+
+    assert run_tasks('/tasks/flush_related') == 3
+    counts = dict((wsck, ndb.Key(RelatedConferences, wsck).get().counts)
+                  for wsck in wscks)
+    assert counts[wscks[0]] == {wscks[1]: 2, wscks[2]: 2}
+    assert counts[wscks[1]] == {wscks[0]: 2, wscks[2]: 1}
+    assert counts[wscks[2]] == {wscks[0]: 2, wscks[1]: 1}
+
+
+def test_rows_of_both_queues_are_flushed_separately(make_conference,
+                                                    run_tasks):
+    wscks = [make_conference(name='Conference %d' % i) for i in range(2)]
+    recordStatsDelta(wscks[0], registrationDelta())
+    recordCoRegistration(wscks[0], wscks[1:], 1, 'task-1')
+
+    assert run_tasks() == 3
+    assert ndb.Key(ConferenceStats, wscks[0]).get().attendees == 1
+    assert ndb.Key(RelatedConferences, wscks[0]).get().counts == {wscks[1]: 1}
+
+
+def test_retried_co_registration_task_counts_once(make_conference, run_tasks):
+    import webapp2
+    import main
+    wscks = [make_conference(name='Conference %d' % i) for i in range(2)]
+    for attempt in range(2):
+        request = webapp2.Request.blank('/tasks/record_coregistration',
+            POST={'conference_key': wscks[0], 'others': json.dumps(wscks[1:]),
+                  'delta': '1'},
+            headers={'X-AppEngine-TaskName': 'task-1'})
+        assert request.get_response(main.app).status_int == 204
+
+    run_tasks()
+    assert ndb.Key(RelatedConferences, wscks[0]).get().counts == {wscks[1]: 1}
+    assert ndb.Key(RelatedConferences, wscks[1]).get().counts == {wscks[0]: 1}
+
+
+def test_flush_is_scheduled_when_the_named_delta_exists(make_conference,
+                                                        queued_tasks,
+                                                        run_tasks):
+    wsck = make_conference()
+    # an earlier attempt queued the delta, then died before the flush
+    taskqueue.Queue('stats-deltas').add(taskqueue.Task(name='registration-1-0',
+        payload=json.dumps(registrationDelta()), method='PULL', tag=wsck))
+    recordStatsDelta(wsck, registrationDelta(), name='registration-1')
+
+    assert len(queued_tasks('/tasks/flush_conference_stats')) == 1
+    run_tasks()
+    assert ndb.Key(ConferenceStats, wsck).get().attendees == 1
+
+
+def test_batches_after_an_existing_one_are_queued(testbed):
+    from google.appengine.ext import testbed as gae_testbed
+    stub = testbed.get_stub(gae_testbed.TASKQUEUE_SERVICE_NAME)
+    deltas = dict(('row%03d' % i, {'x': 1}) for i in range(150))
+    # the first batch (rows 0-99) was queued by an earlier attempt
+    recordDeltas('related-deltas', dict(
+        ('row%03d' % i, {'x': 1}) for i in range(100)), '/tasks/flush_related',
+        30, name='coreg-1')
+    recordDeltas('related-deltas', deltas, '/tasks/flush_related', 30,
+                 name='coreg-1')
+    assert len(stub.get_filtered_tasks(queue_names=['related-deltas'])) == 150
@@ -0,0 +1,168 @@
+"""Tests of the columnar facet read model against the equivalent ndb queries"""
+
+from datetime import date, timedelta
+import random
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+import facets
+from facets import buildFacetSnapshot
+from facets import facetCounts
+from models import Conference
+from models import FacetSnapshot
+from models import FacetSnapshotPart
+from schedule import conferencesOverlap
+from schedule import rangeWeeks
+
+CITIES = ['London', 'Paris', 'Tokyo', None]
+TOPICS = ['Web', 'Cloud', 'Health', 'Movies']
+
+FILTERS = [
+    [],
+    [('city', '=', 'London')],
+    [('city', '!=', 'London')],
+    [('city', '>', 'London')],
+    [('topics', '=', 'Web')],
+    [('topics', '!=', 'Web')],
+    [('topics', '<', 'Health')],
+    [('month', '=', '6')],
+    [('month', '<', '4')],
+    [('month', '!=', '6')],
+    [('maxAttendees', '>=', '500')],
+    [('maxAttendees', '<', '100')],
+    [('city', '=', 'Paris'), ('topics', '=', 'Cloud')],
+    [('topics', '=', 'Web'), ('maxAttendees', '>', '200')],
+]
+
+
+@pytest.fixture(autouse=True)
+def fresh_model(monkeypatch):
+    """Start every test without the columns of another test's snapshot"""
+    monkeypatch.setattr(facets, '_state', {'model': None, 'checked': 0})
+
+
+@pytest.fixture
+def confs():
+    """Store conferences with every field sometimes unset"""
+    rng = random.Random(7)
+    entities = []
+    for i in range(60):
+        start = date(2016, 12, 1) + timedelta(days=rng.randint(0, 90)) \
+            if rng.random() < 0.8 else None
+        entities.append(Conference(
+            name='Conference %d' % i,
+            city=rng.choice(CITIES),
+            # duplicates, and no topics at all
+            topics=[rng.choice(TOPICS) for _ in range(rng.randint(0, 3))],
+            month=start.month if start else None,
+            maxAttendees=rng.choice([None, 50, 150, 600, 1500]),
+            startDate=start,
+            endDate=start + timedelta(days=rng.randint(-1, 9)) if start else None))
+    ndb.put_multi(entities)
+    return entities
+
+
+def _filters(spec):
+    return [{'field': field, 'operator': op, 'value': value}
+            for field, op, value in spec]
+
+
+def _query(spec):
+    """Return the conferences the datastore returns for filters"""
+    q = Conference.query()
+    for field, op, value in spec:
+        if field in ('month', 'maxAttendees'):
+            value = int(value)
+        q = q.filter(ndb.query.FilterNode(field, op, value))
+    return q.fetch()
+
+
+
+@pytest.mark.parametrize('spec', FILTERS)
+def test_matching_rows_are_the_query_results(confs, spec):
+    buildFacetSnapshot()
+    model = facets._loadModel()
+    rows = facets._matchingRows(model, _filters(spec))
+    assert len(rows) == len(_query(spec))
+
+
+@pytest.mark.parametrize('spec', FILTERS)
+def test_counts_are_those_of_the_query_results(confs, spec):
+    buildFacetSnapshot()
+    results = _query(spec)
+    counts = facetCounts(_filters(spec))
+
+    expected = {'city': {}, 'topics': {}, 'month': {}, 'maxAttendees': {}}
+    for conf in results:
+        if conf.city is not None:
+            expected['city'][conf.city] = expected['city'].get(conf.city, 0) + 1
+        for topic in set(conf.topics):
+            expected['topics'][topic] = expected['topics'].get(topic, 0) + 1
+        if conf.month:
+            month = str(conf.month)
+            expected['month'][month] = expected['month'].get(month, 0) + 1
+        if conf.maxAttendees is not None:
+            bucket = facets._attendeeBucket(conf.maxAttendees)
+            expected['maxAttendees'][bucket] = \
+                expected['maxAttendees'].get(bucket, 0) + 1
+    assert counts == expected
+
+
+@pytest.mark.parametrize('start, end', [
+    (date(2016, 12, 25), date(2017, 1, 8)),
+    (date(2017, 2, 1), date(2017, 2, 1)),
+    (date(2016, 11, 1), date(2016, 11, 30))])
+def test_date_range_rows_are_the_overlapping_conferences(confs, start, end):
+    buildFacetSnapshot()
+    model = facets._loadModel()
+    rows = facets._matchingRows(
+        model, [{'field': 'weeks', 'operator': '=', 'value': (start, end)}])
+    expected = [conf for conf in Conference.query(
+                    Conference.weeks.IN(rangeWeeks(start, end)))
+                if conferencesOverlap(conf, start, end)]
+    assert len(rows) == len(expected)
+
+
+def test_unset_months_and_topic_offsets_are_encoded(confs):
+    buildFacetSnapshot()
+    model = facets._loadModel()
+    unset = [i for i, conf in enumerate(Conference.query().fetch())
+             if conf.month is None]
+    assert unset and all(model['month'][i] == -1 for i in unset)
+    assert all(model['topicOffsets'][i] <= model['topicOffsets'][i + 1]
+               for i in range(len(model['city'])))
+    assert model['topicOffsets'][-1] == len(model['topicCodes'])
+
+
+def test_large_snapshots_are_split_in_parts(confs, monkeypatch):
+    monkeypatch.setattr(facets, 'FACET_PART_MAX_BYTES', 200)
+    buildFacetSnapshot()
+    snapshot = FacetSnapshot.get_by_id(facets.FACET_SNAPSHOT_ID)
+    assert snapshot.parts > 1 and snapshot.data is None
+    assert len(facets._matchingRows(facets._loadModel(), [])) == len(confs)
+
+
+class _FixedNow(object):
+    """Stands in for datetime, its now() formatting as a fixed version"""
+    def __init__(self, version):
+        self.version = version
+
+    def now(self):
+        return self
+
+    def strftime(self, fmt):
+        return self.version
+
+
+def test_rebuild_keeps_only_the_previous_version(confs, monkeypatch):
+    for version in ('20160101000000', '20160101000001', '20160101000002'):
+        monkeypatch.setattr(facets, 'datetime', _FixedNow(version))
+        buildFacetSnapshot()
+    kept = set(part.version for part in FacetSnapshotPart.query())
+    assert kept == set(['20160101000001', '20160101000002'])
+    assert FacetSnapshot.get_by_id(facets.FACET_SNAPSHOT_ID).version == \
+        '20160101000002'
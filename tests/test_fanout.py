@@ -0,0 +1,106 @@
+"""Tests of the sharded maintenance jobs of fanout.py and jobs.py"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+import fanout
+import jobs  # registers the maintenance jobs
+from cache import MEMCACHE_ANNOUNCEMENTS_KEY
+from cachecodec import getCached
+from fanout import registerJob
+from fanout import runReduce
+from fanout import runShard
+from fanout import startJob
+from models import Conference
+from models import FanoutJob
+from models import FanoutShard
+
+
+@pytest.fixture
+def counting_job(monkeypatch):
+    """Register a job counting Conferences by name, returning its reduced results"""
+    reduced = []
+    monkeypatch.setitem(fanout.JOBS, 'count', None)
+    registerJob('count', 'Conference',
+                lambda confs: {'count': len(confs),
+                               'names': [c.name for c in confs]},
+                reducer=reduced.append, batch_size=3)
+    return reduced
+
+
+@pytest.fixture
+def conferences():
+    return ndb.put_multi([Conference(name='c%02d' % i, seatsAvailable=i)
+                          for i in range(20)])
+
+
+def _split(monkeypatch, keys, shards):
+    """Split the keyspace at every len(keys) / shards-th key"""
+    step = len(keys) // shards
+    monkeypatch.setattr(fanout, '_scatterSplits',
+                        lambda kind, count: sorted(keys)[step::step][:shards - 1])
+
+
+def test_job_maps_every_entity_once(counting_job, conferences, run_tasks):
+    job_id = startJob('count')
+    run_tasks()
+    assert len(counting_job) == 1
+    assert counting_job[0]['count'] == counting_job[0]['processed'] == 20
+    assert sorted(counting_job[0]['names']) == ['c%02d' % i for i in range(20)]
+    assert ndb.Key(FanoutJob, job_id).get().status == 'done'
+
+
+def test_shards_do_not_write_the_job(counting_job, conferences, monkeypatch,
+                                     queued_tasks, run_tasks):
+    _split(monkeypatch, conferences, 4)
+    job_id = startJob('count')
+    assert FanoutShard.query(FanoutShard.jobId == job_id).count() == 4
+    run_tasks('/tasks/fanout_shard')
+    # every shard queued its own reduce check; the job is untouched
+    assert len(queued_tasks('/tasks/fanout_reduce')) == 4
+    assert ndb.Key(FanoutJob, job_id).get().status == 'running'
+    run_tasks()
+    assert len(counting_job) == 1
+    assert counting_job[0]['count'] == 20
+
+
+def test_reduce_waits_for_every_shard(counting_job, conferences, monkeypatch):
+    _split(monkeypatch, conferences, 2)
+    job_id = startJob('count')
+    while not fanout._shardKey(job_id, 0).get().done:
+        runShard(job_id, 0, fanout._shardKey(job_id, 0).get().step)
+    runReduce(job_id, 'task-0')
+    assert counting_job == []
+    assert ndb.Key(FanoutJob, job_id).get().status == 'running'
+
+
+def test_only_the_claiming_task_reduces(counting_job, conferences, run_tasks):
+    job_id = startJob('count')
+    run_tasks('/tasks/fanout_shard')
+    assert fanout._claimReduce(ndb.Key(FanoutJob, job_id), 'task-a')
+    runReduce(job_id, 'task-b')
+    assert counting_job == []
+    # the claiming task, retried, finishes the job once
+    runReduce(job_id, 'task-a')
+    runReduce(job_id, 'task-a')
+    assert len(counting_job) == 1
+
+
+def test_repeated_shard_task_is_a_no_op(counting_job, conferences, run_tasks):
+    job_id = startJob('count')
+    runShard(job_id, 0, 0)
+    runShard(job_id, 0, 0)
+    run_tasks()
+    assert counting_job[0]['count'] == 20
+
+
+def test_set_announcement_job(conferences, run_tasks):
+    startJob('set_announcement')
+    run_tasks()
+    announcement = getCached(MEMCACHE_ANNOUNCEMENTS_KEY)
+    for name in ('c01', 'c02', 'c03', 'c04', 'c05'):
+        assert name in announcement
+    assert 'c06' not in announcement and 'c00' not in announcement
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Tests of the iCalendar feed: tokens, line folding and conditional polls"""
+
+import base64
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+import feeds
+from feeds import FEED_LINE_LENGTH
+from feeds import feedToken
+from feeds import userIdFromToken
+from models import Profile
+
+USER = 'organizer@example.com'
+
+
+@pytest.fixture
+def prof():
+    return Profile(key=ndb.Key(Profile, USER), displayName='organizer',
+                   mainEmail=USER).put().get()
+
+
+def _feedPath(api):
+    from protorpc import message_types
+    return api.getCalendarFeedUrl(message_types.VoidMessage()).data
+
+
+def _poll(path, etag=None):
+    import webapp2
+    import main
+    headers = {'If-None-Match': etag} if etag else {}
+    return webapp2.Request.blank(path, headers=headers).get_response(main.app)
+
+
+def test_token_says_nothing_about_the_user(prof):
+    token = feedToken(USER)
+    assert USER not in token
+    for encoded in (base64.urlsafe_b64encode(USER.encode('utf-8')),
+                    base64.b64encode(USER.encode('utf-8'))):
+        assert encoded.decode('ascii').rstrip('=')[:8] not in token
+    assert feedToken(USER) == token
+    assert ndb.Key(Profile, USER).get().feedToken == token
+
+
+def test_token_resolves_to_its_user_only(prof):
+    token = feedToken(USER)
+    assert userIdFromToken(token) == USER
+    assert userIdFromToken(token[:-1] + ('A' if token[-1] != 'A' else 'B')) \
+        is None
+    assert userIdFromToken('') is None
+
+
+def test_new_token_resolves_before_the_query_sees_it(prof, monkeypatch):
+    token = feedToken(USER)
+
+    def query(*args, **kwargs):
+        raise AssertionError('token resolved by a query')
+    monkeypatch.setattr(Profile, 'query', query)
+    assert userIdFromToken(token) == USER
+
+
+def test_unknown_token_is_looked_up_once(prof, monkeypatch):
+    lookups = []
+    query = Profile.query
+
+    def counted(*args, **kwargs):
+        lookups.append(args)
+        return query(*args, **kwargs)
+    monkeypatch.setattr(Profile, 'query', counted)
+    for _ in range(3):
+        assert userIdFromToken('unknown') is None
+    assert len(lookups) == 1
+
+
+def test_feed_is_served_by_token_and_304_when_unchanged(api, make_conference):
+    path = _feedPath(api)
+    response = _poll(path)
+    assert response.status_int == 200
+    assert response.body.startswith(b'BEGIN:VCALENDAR')
+    assert _poll(path, response.headers['ETag']).status_int == 304
+    assert _poll('/feeds/unknown.ics').status_int == 404
+
+
+@pytest.mark.parametrize('text', [u'a' * 200, u'é' * 100, u'a' + u'日本' * 60,
+                                  u'x' * 74 + u'€' * 40, u'short'])
+def test_lines_are_folded_at_75_octets_between_characters(text):
+    folded = feeds._fold(u'SUMMARY:' + text)
+    lines = folded.split(u'\r\n')
+    assert all(len(line.encode('utf-8')) <= FEED_LINE_LENGTH for line in lines)
+    assert all(line.startswith(u' ') for line in lines[1:])
+    assert u''.join(line[1:] if i else line
+                    for i, line in enumerate(lines)) == u'SUMMARY:' + text
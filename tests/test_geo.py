@@ -0,0 +1,73 @@
+"""Tests of the geohash covering and the proximity search"""
+
+import random
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+import geo
+from geo import conferencesNear
+from geohash import GEOHASH_MAX_CELLS
+from geohash import coveringCells
+from geohash import encodeGeohash
+from geohash import haversine
+from models import Conference
+
+# (latitude, longitude, radius_km): cities, poles, the antimeridian
+SEARCHES = [
+    (52.52, 13.40, 5), (52.52, 13.40, 300), (40.71, -74.01, 2000),
+    (0.0, 0.0, 1500), (78.2, 15.6, 800), (-89.0, 40.0, 500),
+    (10.0, 179.9, 1000), (-35.0, -179.5, 250),
+]
+
+
+def _randomPoints(rng, count):
+    """Points spread over the globe, and clustered around a few of SEARCHES"""
+    points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(count)]
+    for latitude, longitude, radius in SEARCHES:
+        for _ in range(count // 10):
+            points.append((max(-90, min(90, latitude + rng.gauss(0, 3))),
+                           (longitude + rng.gauss(0, 3) + 180) % 360 - 180))
+    return points
+
+
+@pytest.mark.parametrize('latitude,longitude,radius', SEARCHES)
+def test_cells_cover_the_circle(latitude, longitude, radius):
+    cells = coveringCells(latitude, longitude, radius)
+    assert len(cells) <= GEOHASH_MAX_CELLS
+    rng = random.Random(radius)
+    inside = [p for p in _randomPoints(rng, 3000)
+              if haversine(latitude, longitude, p[0], p[1]) <= radius]
+    for p in inside:
+        assert any(encodeGeohash(p[0], p[1]).startswith(c) for c in cells), p
+
+
+def test_small_radius_uses_small_cells():
+    assert len(coveringCells(52.52, 13.40, 5)[0]) >= 5
+    assert len(coveringCells(52.52, 13.40, 2000)[0]) <= 2
+
+
+def test_search_matches_brute_force(monkeypatch):
+    # small pages, so cells are read over several of them
+    monkeypatch.setattr(geo, 'GEO_PAGE_SIZE', 7)
+    rng = random.Random(7)
+    points = _randomPoints(rng, 400)
+    ndb.put_multi([Conference(name='c%d' % i, latitude=lat, longitude=lng)
+                   for i, (lat, lng) in enumerate(points)])
+    for latitude, longitude, radius in SEARCHES:
+        expected = sorted(
+            'c%d' % i for i, (lat, lng) in enumerate(points)
+            if haversine(latitude, longitude, lat, lng) <= radius)
+        found = conferencesNear(latitude, longitude, radius, len(points))
+        assert sorted(conf.name for _, conf in found) == expected
+        assert [d for d, _ in found] == sorted(d for d, _ in found)
+
+
+def test_limit_keeps_the_nearest():
+    ndb.put_multi([Conference(name='c%d' % i, latitude=52.5 + i * 0.01,
+                              longitude=13.4) for i in range(10)])
+    found = conferencesNear(52.5, 13.4, 50, 3)
+    assert [conf.name for _, conf in found] == ['c0', 'c1', 'c2']
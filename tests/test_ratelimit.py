@@ -0,0 +1,101 @@
+"""Tests of the per-user and per-conference rate limits"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+pytest.importorskip('endpoints')
+
+import httplib
+import re
+
+import ratelimit
+from errors import TooManyRequestsException
+from ratelimit import checkRateLimit
+from settings import RATE_LIMITS
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """Freeze time.time() at the start of a window, returning a settable clock"""
+    now = [1000000.0]
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: now[0])
+    monkeypatch.setattr(ratelimit, '_blocked', set())
+    monkeypatch.setitem(RATE_LIMITS, 'limited',
+                        {'user': 3, 'conference': 5, 'window': 10})
+    return now
+
+
+def test_calls_over_the_user_limit_are_rejected():
+    for _ in range(3):
+        checkRateLimit('limited', user_id='a@example.com')
+    with pytest.raises(TooManyRequestsException) as error:
+        checkRateLimit('limited', user_id='a@example.com')
+    # other users keep their own budget
+    checkRateLimit('limited', user_id='b@example.com')
+    assert error.value.retry_after == 11
+    # the message is all Endpoints sends to clients
+    assert re.search(r'retry after (\d+) seconds\.$',
+                     error.value.message).group(1) == '11'
+
+
+def test_rejection_is_a_status_endpoints_passes_through():
+    # Endpoints v1 maps unknown 4xx (429 included) to 404
+    assert TooManyRequestsException.http_status == httplib.SERVICE_UNAVAILABLE
+
+
+def test_conference_limit_spans_users():
+    for i in range(5):
+        checkRateLimit('limited', user_id='u%d' % i, conference_key='conf')
+    with pytest.raises(TooManyRequestsException):
+        checkRateLimit('limited', user_id='u9', conference_key='conf')
+
+
+def test_budget_refills_in_the_next_window(clock):
+    for _ in range(3):
+        checkRateLimit('limited', user_id='a@example.com')
+    clock[0] += 9
+    with pytest.raises(TooManyRequestsException) as error:
+        checkRateLimit('limited', user_id='a@example.com')
+    assert error.value.retry_after == 2
+    clock[0] += 1
+    for _ in range(3):
+        checkRateLimit('limited', user_id='a@example.com')
+
+
+def test_blocked_keys_skip_memcache(monkeypatch):
+    for _ in range(4):
+        try:
+            checkRateLimit('limited', user_id='a@example.com')
+        except TooManyRequestsException:
+            pass
+    assert len(ratelimit._blocked) == 1
+
+    def unexpected(*args, **kwargs):
+        raise AssertionError('memcache called for a blocked key')
+    monkeypatch.setattr(ratelimit.memcache, 'offset_multi', unexpected)
+    with pytest.raises(TooManyRequestsException):
+        checkRateLimit('limited', user_id='a@example.com')
+
+
+def test_blocked_set_is_bounded(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'MAX_BLOCKED_KEYS', 2)
+    for user in ('a', 'b', 'c'):
+        for _ in range(4):
+            try:
+                checkRateLimit('limited', user_id=user)
+            except TooManyRequestsException:
+                pass
+    assert len(ratelimit._blocked) <= 2
+
+
+def test_memcache_failure_lets_calls_through(monkeypatch):
+    monkeypatch.setattr(ratelimit.memcache, 'offset_multi',
+                        lambda mapping, **kwargs: dict.fromkeys(mapping))
+    for _ in range(10):
+        checkRateLimit('limited', user_id='a@example.com')
+
+
+def test_malformed_session_key_has_no_conference():
+    class Request(object):
+        websafeSessionKey = 'not-a-key'
+    assert ratelimit._conferenceKeyOf(Request()) is None
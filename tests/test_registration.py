@@ -0,0 +1,161 @@
+"""Tests of registration retries, idempotency and side effects"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.api.datastore_errors import InternalError
+from google.appengine.api.datastore_errors import Timeout
+from google.appengine.api.datastore_errors import TransactionFailedError
+from google.appengine.ext import ndb
+
+import transactions
+from models import ConferenceStats
+from models import Profile
+from models import WaitlistEntry
+from registration import applyRegistrationEffects
+from stats import flushStatsDeltas
+
+USER = 'user@example.com'
+
+
+@pytest.fixture
+def faults(monkeypatch):
+    """
+    Return a function making the next transactions fail: each fault is an
+    error class and whether it is raised after the commit
+    """
+    transaction = ndb.transaction
+    pending = []
+
+    def faulty(callback, **kwargs):
+        pending_fault = pending.pop(0) if pending else None
+        if pending_fault and not pending_fault[1]:
+            raise pending_fault[0]()
+        result = transaction(callback, **kwargs)
+        if pending_fault:
+            raise pending_fault[0]()
+        return result
+    monkeypatch.setattr(transactions.ndb, 'transaction', faulty)
+    monkeypatch.setattr(transactions.time, 'sleep', lambda seconds: None)
+
+    def inject(*faults):
+        pending.extend(faults)
+        return pending
+    return inject
+
+
+def _request(wsck, request_id=None):
+    import conference
+    return conference.CONF_REGISTER_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck, requestId=request_id)
+
+
+def _attendees(wsck):
+    return sorted(p.key.id() for p in Profile.query(
+        Profile.conferenceKeysToAttend == wsck))
+
+
+def _stats(wsck):
+    flushStatsDeltas(wsck)
+    return ndb.Key(ConferenceStats, wsck).get()
+
+
+def test_retry_after_sell_out_replays(api, login, make_conference):
+    wsck = make_conference(seats=1)
+    login(USER)
+    assert api.registerForConference(_request(wsck, 'r1')).data is True
+    assert ndb.Key(urlsafe=wsck).get().seatsAvailable == 0
+    # the response was lost and the client retries
+    result = api.registerForConference(_request(wsck, 'r1'))
+    assert (result.data, result.waitlistPosition) == (True, None)
+    assert WaitlistEntry.query().count() == 0
+
+
+def test_unknown_outcome_is_replayed_with_its_effects(api, login, make_conference,
+                                                       faults, queued_tasks,
+                                                       run_tasks):
+    wsck = make_conference(seats=2)
+    login(USER)
+    faults((Timeout, True))
+    assert api.registerForConference(_request(wsck, 'r1')).data is True
+    assert ndb.Key(urlsafe=wsck).get().seatsAvailable == 1
+    # queued by the commit whose outcome looked unknown, and only by it
+    assert len(queued_tasks('/tasks/registration_effects')) == 1
+    assert len(queued_tasks('/tasks/append_seat_change')) == 1
+    run_tasks()
+    assert _stats(wsck).attendees == 1
+
+
+def test_unknown_outcome_is_not_retried_without_request_id(api, login,
+                                                           make_conference,
+                                                           faults):
+    import errors
+    wsck = make_conference(seats=2)
+    login(USER)
+    pending = faults((Timeout, False), (Timeout, False))
+    with pytest.raises(errors.ConflictException):
+        api.registerForConference(_request(wsck))
+    assert len(pending) == 1
+    assert _attendees(wsck) == []
+
+
+def test_unknown_outcome_is_retried_with_request_id(api, login, make_conference,
+                                                    faults):
+    wsck = make_conference(seats=2)
+    login(USER)
+    faults((Timeout, False), (Timeout, True))
+    assert api.registerForConference(_request(wsck, 'r1')).data is True
+    assert _attendees(wsck) == [USER]
+    assert ndb.Key(urlsafe=wsck).get().seatsAvailable == 1
+
+
+def test_unregistration_without_request_id_retries_only_failed_commits(
+        api, login, make_conference, faults):
+    import errors
+    wsck = make_conference(seats=2)
+    login(USER)
+    api.registerForConference(_request(wsck))
+    faults((TransactionFailedError, False))
+    assert api.unregisterFromConference(_request(wsck)).data is True
+    api.registerForConference(_request(wsck))
+    faults((InternalError, True))
+    with pytest.raises(errors.ConflictException):
+        api.unregisterFromConference(_request(wsck))
+    # committed once, not retried into a second, failing unregistration
+    assert _attendees(wsck) == []
+    assert ndb.Key(urlsafe=wsck).get().seatsAvailable == 2
+
+
+def test_failed_transaction_has_no_effects(api, login, make_conference,
+                                           faults, queued_tasks):
+    import errors
+    wsck = make_conference(seats=2)
+    login(USER)
+    faults(*[(TransactionFailedError, False)] * transactions.TXN_ATTEMPTS)
+    with pytest.raises(errors.ConflictException):
+        api.registerForConference(_request(wsck))
+    assert queued_tasks() == []
+
+
+def test_unregistration_promotes_and_counts(api, login, make_conference,
+                                            run_tasks):
+    wsck = make_conference(seats=1)
+    login(USER)
+    api.registerForConference(_request(wsck))
+    login('waiting@example.com')
+    assert api.registerForConference(_request(wsck)).waitlistPosition == 1
+    login(USER)
+    assert api.unregisterFromConference(_request(wsck)).data is True
+    run_tasks()
+    assert _attendees(wsck) == ['waiting@example.com']
+    assert ndb.Key(urlsafe=wsck).get().seatsAvailable == 0
+    assert _stats(wsck).attendees == 1
+
+
+def test_repeated_effects_task_counts_once(make_conference):
+    wsck = make_conference()
+    for _ in range(3):
+        applyRegistrationEffects(wsck, USER, 1, 'task-1')
+    applyRegistrationEffects(wsck, USER, 1, 'task-2')
+    assert _stats(wsck).attendees == 2
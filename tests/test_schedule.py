@@ -0,0 +1,98 @@
+"""Tests of sessions by start time: sessionsInWindow, nextSession and getSessionsInWindow"""
+
+from datetime import date, datetime, time
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+from models import Session
+from schedule import nextSession
+from schedule import sessionsInWindow
+
+
+@pytest.fixture
+def sessions(make_conference):
+    """Store sessions of two conferences, one without a start time or date"""
+    confs = [ndb.Key(urlsafe=make_conference(name=name))
+             for name in ('First', 'Second')]
+    specs = [(confs[0], 'Keynote', date(2016, 6, 1), time(9, 0), 60),
+             (confs[0], 'Lunch talk', date(2016, 6, 1), time(12, 30), 45),
+             (confs[0], 'All day', date(2016, 6, 2), None, 90),
+             (confs[1], 'Opening', date(2016, 6, 1), time(10, 0), None),
+             (confs[1], 'Undated', None, None, 30)]
+    ndb.put_multi([Session(parent=conf, name=name, speaker='Ada', date=day,
+                           startTime=start, duration=duration)
+                   for conf, name, day, start, duration in specs])
+    return confs
+
+
+def _names(query):
+    return [session.name for session in query]
+
+
+def test_start_and_end_are_computed_from_date_time_and_duration(sessions):
+    by_name = dict((s.name, s) for s in Session.query())
+    assert by_name['Lunch talk'].startDateTime == datetime(2016, 6, 1, 12, 30)
+    assert by_name['Lunch talk'].endDateTime == datetime(2016, 6, 1, 13, 15)
+    # no startTime: midnight; no duration: ends when it starts
+    assert by_name['All day'].startDateTime == datetime(2016, 6, 2)
+    assert by_name['Opening'].endDateTime == datetime(2016, 6, 1, 10, 0)
+    assert by_name['Undated'].startDateTime is None
+    assert by_name['Undated'].endDateTime is None
+
+
+def test_window_is_half_open_and_in_start_order(sessions):
+    assert _names(sessionsInWindow(datetime(2016, 6, 1, 9, 0),
+                                   datetime(2016, 6, 1, 12, 30))) == \
+        ['Keynote', 'Opening']
+    assert _names(sessionsInWindow(datetime(2016, 6, 1),
+                                   datetime(2016, 6, 3))) == \
+        ['Keynote', 'Opening', 'Lunch talk', 'All day']
+
+
+def test_window_of_one_conference(sessions):
+    assert _names(sessionsInWindow(datetime(2016, 6, 1), datetime(2016, 6, 3),
+                                   sessions[1])) == ['Opening']
+
+
+def test_next_session_starts_at_or_after_an_instant(sessions):
+    assert nextSession(datetime(2016, 6, 1, 9, 0)).name == 'Keynote'
+    assert nextSession(datetime(2016, 6, 1, 9, 1)).name == 'Opening'
+    assert nextSession(datetime(2016, 6, 2, 0, 1)) is None
+
+
+def _window(api, **fields):
+    import conference
+    return api.getSessionsInWindow(
+        conference.SESSION_WINDOW_REQUEST.combined_message_class(**fields))
+
+
+def test_endpoint_returns_the_first_sessions_up_to_limit(api, sessions):
+    forms = _window(api, start='2016-06-01T00:00', end='2016-06-03T00:00',
+                    limit=2).items
+    assert [form.name for form in forms] == ['Keynote', 'Opening']
+    assert forms[0].startDateTime == '2016-06-01 09:00:00'
+    assert forms[0].endDateTime == '2016-06-01 10:00:00'
+
+
+@pytest.mark.parametrize('fields', [
+    {'start': '2016-06-02T00:00', 'end': '2016-06-01T00:00'},
+    {'start': '2016-06-01T00:00', 'end': '2016-06-01T00:00'},
+    {'start': '2016-01-01T00:00', 'end': '2016-03-01T00:00'},
+    {'start': '2016-06-01T00:00', 'end': '2016-06-02T00:00', 'limit': 0},
+    {'start': 'yesterday', 'end': '2016-06-02T00:00'}])
+def test_endpoint_rejects_bad_windows(api, fields):
+    import endpoints
+    with pytest.raises(endpoints.BadRequestException):
+        _window(api, **fields)
+
+
+@pytest.mark.parametrize('wsck', ['garbage', 'abc'])
+def test_endpoint_rejects_bad_conference_keys(api, wsck):
+    import endpoints
+    with pytest.raises(endpoints.NotFoundException):
+        _window(api, start='2016-06-01T00:00', end='2016-06-02T00:00',
+                websafeConferenceKey=wsck)
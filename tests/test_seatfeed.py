@@ -0,0 +1,173 @@
+"""Tests of the seat changes feed"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import seatfeed
+from models import SeatChangeEvent
+from seatfeed import SEAT_FEED_BUCKET
+from seatfeed import SEAT_FEED_HEAD_KEY
+from seatfeed import SEAT_FEED_LOG_KEY
+from seatfeed import appendSeatChange
+from seatfeed import formatToken
+from seatfeed import getSeatUpdates
+
+
+class Clock(object):
+    """Stand-in for the time module of seatfeed"""
+    def __init__(self, bucket):
+        self.now = bucket * SEAT_FEED_BUCKET
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def bucket(self, bucket):
+        self.now = bucket * SEAT_FEED_BUCKET
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(100)
+    monkeypatch.setattr(seatfeed, 'time', clock)
+    return clock
+
+
+def _since(bucket, **kwargs):
+    return getSeatUpdates(formatToken(bucket, 0), **kwargs)
+
+
+def test_newest_version_wins_over_append_order(clock):
+    appendSeatChange('conf', 5, 2)
+    appendSeatChange('conf', 6, 1)
+    appendSeatChange('other', 9, 1)
+    updates, token, resync = _since(100)
+    assert updates == {'conf': (5, 2), 'other': (9, 1)}
+    assert (token, resync) == ('100:3:0', False)
+    assert _since(100, conference_keys=['other'])[0] == {'other': (9, 1)}
+
+
+def test_offsets_skip_seen_events(clock):
+    appendSeatChange('conf', 5, 1)
+    updates, token, resync = _since(100)
+    appendSeatChange('conf', 4, 2)
+    assert getSeatUpdates(token) == ({'conf': (4, 2)}, '100:2:0', False)
+
+
+def test_empty_buckets_are_not_lost(clock):
+    appendSeatChange('conf', 5, 1)
+    clock.bucket(103)
+    appendSeatChange('conf', 4, 2)
+    clock.bucket(105)
+    assert _since(100) == ({'conf': (4, 2)}, '104:0:0', False)
+
+
+def test_evicted_bucket_asks_for_resync(clock):
+    appendSeatChange('conf', 5, 1)
+    clock.bucket(101)
+    appendSeatChange('conf', 4, 2)
+    clock.bucket(102)
+    appendSeatChange('conf', 3, 3)
+    memcache.delete(SEAT_FEED_LOG_KEY % 101)
+    assert _since(100) == ({}, '102:0:0', True)
+    # readers past the evicted bucket are unaffected
+    assert _since(102) == ({'conf': (3, 3)}, '102:1:0', False)
+
+
+def test_evicted_last_bucket_asks_for_resync(clock):
+    appendSeatChange('conf', 5, 1)
+    clock.bucket(101)
+    appendSeatChange('conf', 4, 2)
+    clock.bucket(103)
+    memcache.delete(SEAT_FEED_LOG_KEY % 101)
+    assert _since(100)[2] is True
+
+
+def test_lost_head_asks_for_resync_once(clock):
+    appendSeatChange('conf', 5, 1)
+    memcache.delete(SEAT_FEED_HEAD_KEY)
+    assert _since(100)[2] is True
+    clock.bucket(101)
+    appendSeatChange('conf', 4, 2)
+    assert _since(101) == ({'conf': (4, 2)}, '101:1:0', False)
+
+
+def test_spilled_events_keep_their_version(clock, monkeypatch):
+    appendSeatChange('conf', 5, 1)
+    monkeypatch.setattr(memcache.Client, 'cas', lambda *args, **kwargs: False)
+    appendSeatChange('conf', 4, 3)
+    appendSeatChange('conf', 6, 2)
+    # spilled events show once their bucket is settled
+    assert _since(100)[0] == {'conf': (5, 1)}
+    clock.bucket(101)
+    assert _since(100)[0] == {'conf': (5, 1)}
+    clock.bucket(102)
+    assert _since(100)[0] == {'conf': (4, 3)}
+    assert ndb.Key(SeatChangeEvent, '100:2').get().seatsVersion == 2
+
+
+def _appendLate(clock, bucket, *event):
+    """Append an event from a writer that picked bucket before it closed"""
+    now = clock.now
+    clock.bucket(bucket)
+    appendSeatChange(*event)
+    clock.now = now
+
+
+def test_late_append_reaches_readers_past_its_bucket(clock):
+    appendSeatChange('conf', 5, 1)
+    clock.bucket(101)
+    appendSeatChange('other', 9, 1)
+    updates, token, resync = _since(100)
+    assert updates == {'conf': (5, 1), 'other': (9, 1)}
+    assert token == '100:1:1'
+
+    _appendLate(clock, 100, 'conf', 4, 2)
+    updates, token, resync = getSeatUpdates(token)
+    assert updates == {'conf': (4, 2)}
+    clock.bucket(102)
+    assert getSeatUpdates(token) == ({}, '101:1:0', False)
+
+
+def test_late_spill_reaches_readers_past_its_bucket(clock, monkeypatch):
+    appendSeatChange('conf', 5, 1)
+    clock.bucket(101)
+    updates, token, resync = _since(100)
+    monkeypatch.setattr(memcache.Client, 'cas', lambda *args, **kwargs: False)
+    _appendLate(clock, 100, 'conf', 4, 2)
+    assert getSeatUpdates(token)[0] == {}
+    clock.bucket(102)
+    updates, token, resync = getSeatUpdates(token)
+    assert updates == {'conf': (4, 2)}
+    assert getSeatUpdates(token)[0] == {}
+
+
+def test_two_part_tokens_are_still_read(clock):
+    appendSeatChange('conf', 5, 1)
+    appendSeatChange('conf', 4, 2)
+    assert getSeatUpdates('100:1') == ({'conf': (4, 2)}, '100:2:0', False)
+
+
+def test_registration_appends_versioned_change(api, make_conference,
+                                               run_tasks, clock):
+    import conference
+    wsck = make_conference(seats=2)
+    request = conference.CONF_REGISTER_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+    api.registerForConference(request)
+    # appended by a task queued with the registration
+    assert _since(100)[0] == {}
+    run_tasks('/tasks/append_seat_change')
+    assert _since(100)[0] == {wsck: (1, 1)}
+    api.unregisterFromConference(request)
+    run_tasks('/tasks/append_seat_change')
+    assert _since(100)[0] == {wsck: (2, 2)}
+    form = api.getConference(conference.CONF_READ_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck, consistency='strong'))
+    assert form.seatsVersion == 2
@@ -0,0 +1,79 @@
+"""Tests of the static conference catalog snapshot and its handlers"""
+
+import json
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+import snapshot
+from models import CatalogShard
+from snapshot import buildCatalogSnapshot
+from snapshot import getCatalogManifest
+from snapshot import gunzip
+
+
+def _get(path, **headers):
+    import webapp2
+    import main
+    return webapp2.Request.blank(path, headers=headers).get_response(main.app)
+
+
+def _items(version, shards):
+    return [item for shard in shards for item in json.loads(gunzip(
+        CatalogShard.get_by_id('%s/%s' % (version, shard['name'])).data
+    ).decode('utf-8'))['items']]
+
+
+def test_snapshot_shards_by_city_and_month(make_conference):
+    make_conference(name='A', city='London', month=5)
+    make_conference(name='B', city='London', month=5)
+    make_conference(name='C', city='Paris', month=6)
+    version = buildCatalogSnapshot()
+
+    manifest = getCatalogManifest()
+    assert manifest['version'] == version
+    assert [(s['name'], s['city'], s['month'], s['count'])
+            for s in manifest['shards']] == [('london-05', 'London', 5, 2),
+                                             ('paris-06', 'Paris', 6, 1)]
+    assert sorted(i['name'] for i in _items(version, manifest['shards'])) == \
+        ['A', 'B', 'C']
+
+
+def test_large_shards_are_split_under_the_entity_limit(make_conference,
+                                                       monkeypatch):
+    monkeypatch.setattr(snapshot, 'CATALOG_SHARD_MAX_BYTES', 600)
+    monkeypatch.setattr(snapshot, 'CATALOG_PUT_MAX_BYTES', 2000)
+    for i in range(40):
+        make_conference(name='Conference %d' % i, city='London', month=5,
+                        description='%d %s' % (i, 'x' * i * 7))
+    version = buildCatalogSnapshot()
+
+    shards = getCatalogManifest()['shards']
+    assert len(shards) > 1
+    assert all(s['name'].startswith('london-05-part') for s in shards)
+    assert all(s['month'] == 5 and s['city'] == 'London' for s in shards)
+    assert sum(s['count'] for s in shards) == 40
+    for s in shards:
+        shard = CatalogShard.get_by_id('%s/%s' % (version, s['name']))
+        assert len(shard.data) <= 600
+    names = sorted(i['name'] for i in _items(version, shards))
+    assert names == sorted('Conference %d' % i for i in range(40))
+
+
+def test_shard_varies_on_accept_encoding(make_conference):
+    make_conference(name='A', city='London', month=5)
+    version = buildCatalogSnapshot()
+    path = '/catalog/%s/london-05.json' % version
+
+    gzipped = _get(path, **{'Accept-Encoding': 'gzip, deflate'})
+    plain = _get(path)
+    assert gzipped.headers['Vary'] == plain.headers['Vary'] == 'Accept-Encoding'
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain.headers
+    assert gunzip(gzipped.body) == plain.body
+    assert json.loads(plain.body.decode('utf-8'))['items'][0]['name'] == 'A'
+
+
+def test_unknown_shard_is_not_found():
+    assert _get('/catalog/123/nowhere-01.json').status_int == 404
@@ -0,0 +1,69 @@
+"""Tests of the Speaker index of sessions"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+import speakers
+from models import Session
+from models import Speaker
+from speakers import getSpeakerSessions
+from speakers import putSession
+from speakers import speakerKey
+
+
+def _session(wsck, name, speaker):
+    conf_key = ndb.Key(urlsafe=wsck)
+    session_id = Session.allocate_ids(size=1, parent=conf_key)[0]
+    return Session(key=ndb.Key(Session, session_id, parent=conf_key),
+                   name=name, speaker=speaker, speakerKey=speakerKey(speaker))
+
+
+def test_spellings_share_one_speaker():
+    assert speakerKey(u'Ada  Lovelace') == speakerKey(u'ada lovelace ')
+    assert speakerKey(u'  ') is None
+    assert speakerKey(None) is None
+
+
+def test_put_session_indexes_it_under_its_speaker(make_conference):
+    wsck = make_conference()
+    first = putSession(_session(wsck, 'Intro', u'Ada Lovelace'))
+    second = putSession(_session(wsck, 'Advanced', u'ada  lovelace'))
+    speaker = speakerKey(u'Ada Lovelace').get()
+    assert speaker.sessionKeys == [first, second]
+    assert [s.name for s in getSpeakerSessions(u'ADA LOVELACE')] == \
+        ['Intro', 'Advanced']
+
+
+def test_failed_index_update_stores_no_session(make_conference, monkeypatch):
+    wsck = make_conference()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('speaker write failed')
+    monkeypatch.setattr(speakers, 'addSpeakerSessions', fail)
+    with pytest.raises(RuntimeError):
+        putSession(_session(wsck, 'Intro', u'Ada Lovelace'))
+    assert Session.query().count() == 0
+    assert Speaker.query().count() == 0
+
+
+def _request(wsck, **fields):
+    import conference
+    return conference.SessionForm(websafeConferenceKey=wsck, **fields)
+
+
+def test_blank_speaker_is_rejected(api, make_conference):
+    import endpoints
+    wsck = make_conference()
+    with pytest.raises(endpoints.BadRequestException):
+        api.createSession(_request(wsck, name='Intro', speaker=u' \t '))
+    assert Session.query().count() == 0
+
+
+def test_create_session_indexes_speaker(api, make_conference):
+    wsck = make_conference()
+    form = api.createSession(_request(wsck, name='Intro', speaker=u'Ada Lovelace'))
+    speaker = speakerKey(u'ada lovelace').get()
+    assert [k.urlsafe() for k in speaker.sessionKeys] == [form.websafeKey]
@@ -0,0 +1,36 @@
+"""Tests that the task and cron app starts without the Endpoints stack"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+# modules main.py must not load at import time
+HEAVY_MODULES = ('endpoints', 'conference', 'protorpc.remote')
+
+IMPORT_MAIN = '''
+import sys
+import main
+print(' '.join(name for name in %r if name in sys.modules))
+''' % (HEAVY_MODULES,)
+
+
+def test_main_does_not_import_endpoints():
+    # a fresh interpreter, since other tests already imported conference.py
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_MAIN],
+                                     cwd=os.path.dirname(os.path.dirname(
+                                         os.path.abspath(__file__))), env=env)
+    assert output.decode('utf-8').split() == []
+
+
+def test_warmup_loads_the_api():
+    pytest.importorskip('endpoints')
+    import webapp2
+    import main
+    response = webapp2.Request.blank('/_ah/warmup').get_response(main.app)
+    assert response.status_int == 200
+    assert 'conference' in sys.modules
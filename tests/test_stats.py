@@ -0,0 +1,90 @@
+"""Tests of the pre-aggregated ConferenceStats and getConferenceStats"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceStats
+from stats import rebuildConferenceStats
+from stats import recordStatsDelta
+from stats import registrationDelta
+
+
+def _statsRequest(wsck):
+    import conference
+    return conference.CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+
+
+def test_deltas_are_applied_by_one_flush(make_conference, run_tasks):
+    wsck = make_conference()
+    for i in range(3):
+        recordStatsDelta(wsck, registrationDelta())
+    recordStatsDelta(wsck, registrationDelta(reg=False))
+
+    assert run_tasks('/tasks/flush_conference_stats') == 1
+    stats = ndb.Key(ConferenceStats, wsck).get()
+    assert stats.attendees == 2
+    assert sum(stats.registrationsByDay.values()) == 3
+
+
+def test_registration_counted_by_a_rebuild_is_not_added_again(
+        api, make_conference, queued_tasks, run_tasks):
+    import conference
+    wsck = make_conference()
+    request = conference.CONF_REGISTER_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+    api.registerForConference(request)
+    # the rebuild counts the profile before the effects task queues its delta
+    assert queued_tasks('/tasks/registration_effects')
+    assert rebuildConferenceStats(wsck).attendees == 1
+
+    run_tasks()
+    stats = ndb.Key(ConferenceStats, wsck).get()
+    assert stats.attendees == 1
+    assert sum(stats.registrationsByDay.values()) == 1
+
+
+def test_deltas_after_a_rebuild_are_applied(make_conference, run_tasks):
+    wsck = make_conference()
+    counted_until = rebuildConferenceStats(wsck).countedUntil
+    recordStatsDelta(wsck, registrationDelta(at=counted_until - 1))
+    recordStatsDelta(wsck, registrationDelta(at=counted_until + 1))
+    recordStatsDelta(wsck, registrationDelta())
+
+    run_tasks()
+    stats = ndb.Key(ConferenceStats, wsck).get()
+    assert stats.attendees == 2
+    assert sum(stats.registrationsByDay.values()) == 3
+
+
+def test_stats_are_shown_to_the_organizer(api, make_conference, run_tasks):
+    wsck = make_conference()
+    recordStatsDelta(wsck, registrationDelta())
+    run_tasks()
+    assert api.getConferenceStats(_statsRequest(wsck)).attendees == 1
+
+
+def test_stats_are_hidden_from_others(api, login, make_conference):
+    import endpoints
+    wsck = make_conference()
+    login('someone@example.com')
+    with pytest.raises(endpoints.ForbiddenException):
+        api.getConferenceStats(_statsRequest(wsck))
+
+
+@pytest.mark.parametrize('wsck', ['garbage', 'abc', ''])
+def test_malformed_key_is_not_found(api, wsck):
+    import endpoints
+    with pytest.raises(endpoints.NotFoundException):
+        api.getConferenceStats(_statsRequest(wsck))
+
+
+def test_key_without_parent_or_of_another_kind_is_not_found(api):
+    import endpoints
+    for key in (ndb.Key(Conference, 42), ndb.Key('Session', 42)):
+        with pytest.raises(endpoints.NotFoundException):
+            api.getConferenceStats(_statsRequest(key.urlsafe()))
@@ -0,0 +1,154 @@
+"""Tests of the FIFO waitlist and the promotion of waitlisted users"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import WaitlistEntry
+from models import WaitlistShard
+from waitlist import getWaitlistPosition
+from waitlist import joinWaitlist
+from waitlist import leaveWaitlist
+from waitlist import promoteWaitlist
+
+
+def _setSeats(wsck, seats):
+    conf = ndb.Key(urlsafe=wsck).get()
+    conf.seatsAvailable = seats
+    conf.put()
+
+
+def _waiting(wsck, count):
+    """Queue count users with a Profile, returning their ids in join order"""
+    users = ['user%d@example.com' % i for i in range(count)]
+    for user_id in users:
+        Profile(id=user_id, displayName=user_id).put()
+        joinWaitlist(wsck, user_id)
+    return users
+
+
+def _attendees(wsck):
+    return sorted(p.key.id() for p in Profile.query(
+        Profile.conferenceKeysToAttend == wsck))
+
+
+def test_positions_follow_join_order(make_conference):
+    wsck = make_conference(seats=0)
+    users = _waiting(wsck, 5)
+    assert [getWaitlistPosition(wsck, u) for u in users] == [1, 2, 3, 4, 5]
+    # joining again keeps the original place
+    assert joinWaitlist(wsck, users[2]) == 3
+    assert getWaitlistPosition(wsck, 'nobody@example.com') is None
+
+
+def test_positions_are_read_from_the_shards(make_conference, monkeypatch):
+    wsck = make_conference(seats=0)
+    users = _waiting(wsck, 6)
+    assert leaveWaitlist(wsck, users[1])
+    assert not leaveWaitlist(wsck, users[1])
+
+    def query(*args, **kwargs):
+        raise AssertionError('position read queries the waitlist')
+    monkeypatch.setattr(WaitlistEntry, 'query', query)
+    assert [getWaitlistPosition(wsck, u) for u in users] == [1, None, 2, 3, 4, 5]
+    assert joinWaitlist(wsck, 'new@example.com') == 6
+
+
+def test_shards_keep_only_waiting_users(make_conference):
+    wsck = make_conference(seats=0)
+    users = _waiting(wsck, 5)
+    leaveWaitlist(wsck, users[4])
+    _setSeats(wsck, 2)
+    promoteWaitlist(wsck)
+
+    joined = sorted(t for shard in WaitlistShard.query() for t in shard.joined)
+    assert joined == sorted(e.joined for e in WaitlistEntry.query())
+    assert len(joined) == 2
+
+
+def test_promotion_is_first_come_first_served(make_conference):
+    wsck = make_conference(seats=0)
+    users = _waiting(wsck, 5)
+    _setSeats(wsck, 2)
+
+    assert promoteWaitlist(wsck) == users[:2]
+    assert _attendees(wsck) == sorted(users[:2])
+    assert [getWaitlistPosition(wsck, u) for u in users[2:]] == [1, 2, 3]
+
+
+def test_promotion_never_overbooks(make_conference):
+    wsck = make_conference(seats=0)
+    users = _waiting(wsck, 10)
+    _setSeats(wsck, 3)
+
+    # a second, duplicate promotion task finds no seats left
+    assert promoteWaitlist(wsck) == users[:3]
+    assert promoteWaitlist(wsck) == []
+    assert ndb.Key(urlsafe=wsck).get().seatsAvailable == 0
+    assert _attendees(wsck) == sorted(users[:3])
+
+
+def test_promotion_skips_users_already_registered(make_conference):
+    wsck = make_conference(seats=0)
+    users = _waiting(wsck, 2)
+    prof = ndb.Key(Profile, users[0]).get()
+    prof.conferenceKeysToAttend.append(wsck)
+    prof.put()
+    _setSeats(wsck, 1)
+
+    assert promoteWaitlist(wsck) == [users[1]]
+    assert getWaitlistPosition(wsck, users[0]) is None
+
+
+# - - - through the API - - - - - - - - - - - - - - - - - - - - - - -
+
+def _register(api, login, wsck, email):
+    import conference
+    login(email)
+    return api.registerForConference(
+        conference.CONF_REGISTER_REQUEST.combined_message_class(
+            websafeConferenceKey=wsck))
+
+
+def _unregister(api, login, wsck, email):
+    import conference
+    login(email)
+    return api.unregisterFromConference(
+        conference.CONF_REGISTER_REQUEST.combined_message_class(
+            websafeConferenceKey=wsck))
+
+
+def test_full_conference_queues_and_unregistration_promotes(
+        api, login, make_conference, run_tasks):
+    wsck = make_conference(seats=2)
+    assert _register(api, login, wsck, 'a@example.com').data
+    assert _register(api, login, wsck, 'b@example.com').data
+
+    waiting = _register(api, login, wsck, 'c@example.com')
+    assert not waiting.data and waiting.waitlistPosition == 1
+    assert _register(api, login, wsck, 'd@example.com').waitlistPosition == 2
+
+    assert _unregister(api, login, wsck, 'a@example.com').data
+    run_tasks()
+    assert _attendees(wsck) == ['b@example.com', 'c@example.com']
+    assert getWaitlistPosition(wsck, 'd@example.com') == 1
+    assert ndb.Key(urlsafe=wsck).get().seatsAvailable == 0
+
+
+def test_queueing_with_free_seats_schedules_promotion(
+        api, login, make_conference, queued_tasks, run_tasks):
+    wsck = make_conference(seats=0)
+    first = _waiting(wsck, 1)[0]
+    # a seat frees up without the waitlist being promoted
+    _setSeats(wsck, 1)
+
+    # the next user is queued behind the waiting one...
+    assert _register(api, login, wsck, 'late@example.com').waitlistPosition == 2
+    assert queued_tasks('/tasks/promote_waitlist')
+    # ...and the free seat goes to the first in line
+    run_tasks()
+    assert _attendees(wsck) == [first]
+    assert getWaitlistPosition(wsck, 'late@example.com') == 1
@@ -0,0 +1,135 @@
+"""Tests of the write-behind wishlist journal"""
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.testbed')
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import wishlist
+from models import Profile
+from wishlist import WISHLIST_JOURNAL_KEY
+from wishlist import flushWishlist
+from wishlist import getWishlist
+from wishlist import recordWishlistOp
+
+USER = 'user@example.com'
+
+
+@pytest.fixture
+def prof():
+    return Profile(id=USER, displayName='user').put().get()
+
+
+def _sessions(count):
+    conf_key = ndb.Key(Profile, 'organizer@example.com', 'Conference', 1)
+    return [ndb.Key('Session', i + 1, parent=conf_key) for i in range(count)]
+
+
+def _record(action, key):
+    recordWishlistOp(ndb.Key(Profile, USER).get(), action, key.urlsafe())
+
+
+def _stored():
+    return ndb.Key(Profile, USER).get().sessionsToAttend
+
+
+def test_mutations_are_read_back_before_the_flush(prof, run_tasks):
+    a, b = _sessions(2)
+    _record('add', a)
+    _record('add', b)
+    _record('remove', a)
+    assert _stored() == []
+    assert getWishlist(ndb.Key(Profile, USER).get()) == [b]
+    assert run_tasks('/tasks/flush_wishlist') == 1
+    assert _stored() == [b]
+
+
+def test_ops_apply_in_journal_order(prof):
+    a, = _sessions(1)
+    _record('remove', a)
+    _record('add', a)
+    _record('remove', a)
+    _record('add', a)
+    flushWishlist(USER)
+    assert _stored() == [a]
+
+
+def test_flush_is_idempotent(prof):
+    a, b = _sessions(2)
+    _record('add', a)
+    journal = memcache.get(WISHLIST_JOURNAL_KEY % USER)
+    flushWishlist(USER)
+    seq = ndb.Key(Profile, USER).get().wishlistSeq
+    # a repeated or late task, even one holding an older journal
+    flushWishlist(USER)
+    wishlist._applyJournal(USER, journal['ops'])
+    assert _stored() == [a]
+    assert ndb.Key(Profile, USER).get().wishlistSeq == seq
+
+    _record('remove', a)
+    _record('add', b)
+    flushWishlist(USER)
+    wishlist._applyJournal(USER, journal['ops'])
+    assert _stored() == [b]
+
+
+def test_flush_is_scheduled_after_the_append(prof, monkeypatch):
+    a, = _sessions(1)
+    seen = []
+    add = taskqueue.add
+
+    def recordingAdd(*args, **kwargs):
+        journal = memcache.get(WISHLIST_JOURNAL_KEY % USER)
+        seen.append([op[2] for op in journal['ops']])
+        return add(*args, **kwargs)
+    monkeypatch.setattr(wishlist.taskqueue, 'add', recordingAdd)
+    _record('add', a)
+    assert seen == [[a.urlsafe()]]
+
+
+def test_one_flush_task_per_window_due_at_its_end(prof, queued_tasks,
+                                                  monkeypatch):
+    a, b = _sessions(2)
+    countdowns = []
+    add = taskqueue.add
+
+    def recordingAdd(*args, **kwargs):
+        countdowns.append(kwargs['countdown'])
+        return add(*args, **kwargs)
+
+    class Clock(object):
+        now = 1002.0
+
+        def time(self):
+            return self.now
+    clock = Clock()
+    monkeypatch.setattr(wishlist, 'time', clock)
+    monkeypatch.setattr(wishlist.taskqueue, 'add', recordingAdd)
+    _record('add', a)
+    clock.now = 1004.5
+    _record('add', b)
+    assert countdowns == [3.0, 0.5]
+    assert len(queued_tasks('/tasks/flush_wishlist')) == 1
+
+
+def test_failed_scheduling_writes_through(prof, monkeypatch):
+    a, = _sessions(1)
+
+    def fail(*args, **kwargs):
+        raise taskqueue.TransientError()
+    monkeypatch.setattr(wishlist.taskqueue, 'add', fail)
+    _record('add', a)
+    assert _stored() == [a]
+
+
+def test_memcache_failure_writes_through(prof, monkeypatch):
+    a, b = _sessions(2)
+    _record('add', a)
+    monkeypatch.setattr(memcache.Client, 'add', lambda *args, **kwargs: False)
+    monkeypatch.setattr(memcache.Client, 'cas', lambda *args, **kwargs: False)
+    _record('add', b)
+    # the pending mutation is written first, then the new one
+    assert _stored() == [a, b]
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""transactions.py
+
+Retrying transactions with jittered exponential backoff and contention metrics
+
+ndb retries a failed transaction immediately, a few times, and then lets
+TransactionFailedError surface. runInTransaction disables that and retries
+itself, sleeping a random time up to an exponentially growing cap between
+attempts, so contending requests spread out instead of colliding again.
+
+Only errors after which the transaction is known not to have been applied
+are retried for every operation. Timeouts and internal errors, after which
+the commit may or may not have happened, are only retried for operations
+marked idempotent; others should make themselves idempotent first (see
+the requestId of registerForConference).
+
+Attempts, retries, commits and failures are counted per transaction name in
+memcache; see getTransactionMetrics().
+
+"""
+
+from datetime import datetime, timedelta
+import logging
+import random
+import time
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import IdempotencyRecord
+
+TXN_ATTEMPTS = 5
+TXN_BASE_DELAY = 0.05           # seconds, doubled after each failed attempt
+TXN_MAX_DELAY = 1.0
+TXN_METRICS_KEY = 'TXN_METRICS:%s:%s'
+TXN_METRICS = ('attempts', 'retries', 'commits', 'failures')
+IDEMPOTENCY_TTL = timedelta(days=1)
+
+# the transaction was not applied
+_NOT_APPLIED_ERRORS = (datastore_errors.TransactionFailedError,)
+# the transaction may or may not have been applied
+_UNCERTAIN_ERRORS = (datastore_errors.Timeout, datastore_errors.InternalError)
+
+
+def _recordMetrics(name, attempts, outcome):
+    """Count the attempts and outcome of a transaction, in one memcache call"""
+    memcache.offset_multi({
+        TXN_METRICS_KEY % (name, 'attempts'): attempts,
+        TXN_METRICS_KEY % (name, 'retries'): attempts - 1,
+        TXN_METRICS_KEY % (name, outcome): 1,
+    }, initial_value=0)
+
+
+def getTransactionMetrics(name):
+    """Return the counters of a transaction name, by metric"""
+    keys = dict((TXN_METRICS_KEY % (name, metric), metric)
+                for metric in TXN_METRICS)
+    counts = memcache.get_multi(list(keys))
+    return dict((metric, int(counts.get(key) or 0))
+                for key, metric in keys.items())
+
+
+def runInTransaction(name, callback, idempotent=False, xg=False,
+                     attempts=TXN_ATTEMPTS):
+    """Run callback in a transaction, retrying it with jittered backoff"""
+    retryable = _NOT_APPLIED_ERRORS
+    if idempotent:
+        retryable += _UNCERTAIN_ERRORS
+
+    for attempt in range(1, attempts + 1):
+        try:
+            result = ndb.transaction(callback, retries=0, xg=xg)
+        except retryable as e:
+            if attempt == attempts:
+                _recordMetrics(name, attempt, 'failures')
+                raise
+            logging.warning('Transaction %s failed on attempt %d: %r',
+                            name, attempt, e)
+            cap = min(TXN_MAX_DELAY, TXN_BASE_DELAY * 2 ** attempt)
+            time.sleep(random.uniform(0, cap))
+        else:
+            _recordMetrics(name, attempt, 'commits')
+            return result
+
+
+def purgeIdempotencyRecords():
+    """Delete idempotency records older than IDEMPOTENCY_TTL"""
+    expired = IdempotencyRecord.query(
+        IdempotencyRecord.created < datetime.now() - IDEMPOTENCY_TTL)
+    keys, cursor, more = expired.fetch_page(500, keys_only=True)
+    while keys:
+        ndb.delete_multi(keys)
+        if not more:
+            break
+        keys, cursor, more = expired.fetch_page(500, keys_only=True,
+                                                start_cursor=cursor)
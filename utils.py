@@ -3,8 +3,18 @@ import os
 import time
 import uuid
 
-from google.appengine.api import urlfetch
-from models import Profile
+from google.appengine.ext import ndb
+
+
+def keyFromUrlsafe(urlsafe, kind):
+    """Return the Key of a websafe key string, None if malformed or of another kind"""
+    try:
+        key = ndb.Key(urlsafe=urlsafe)
+    except Exception:
+        # bad base64, bad protocol buffers and None raise different errors
+        return None
+    return key if key.kind() == kind else None
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -12,6 +22,8 @@ def getUserId(user, id_type="email"):
 
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
+        # deferred: only this branch needs urlfetch
+        from google.appengine.api import urlfetch
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
         token_type = 'id_token'
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""waitlist.py
+
+First-come waitlist of users waiting for a seat at a sold out conference
+
+Entries are spread over WAITLIST_SHARDS entity groups per conference (the
+shard is derived from the user id), so joining the waitlist of a hot
+conference never contends with the Conference entity group nor with other
+users joining at the same time. FIFO order comes from the `joined`
+timestamp, queried across all shards.
+
+Each WaitlistShard parent also keeps the sorted join times of its waiting
+entries, updated in the transaction that adds or removes one. A position
+is then counted from the WAITLIST_SHARDS parents, one batch get, rather
+than by a query over the whole waitlist.
+
+Seats freed by unregisterFromConference are handed out by a
+/tasks/promote_waitlist task, never inline in the unregistering request.
+So are free seats when a user is queued behind others because the
+waitlist query showed them, which keeps a conference from sitting with
+free seats and a waitlist when that query lags behind.
+
+"""
+
+from bisect import bisect_left
+from bisect import insort
+from datetime import datetime
+import zlib
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import WaitlistEntry
+from models import WaitlistShard
+from registration import queueRegistrationEffects
+from related import queueCoRegistration
+from seatfeed import queueSeatChange
+from transactions import runInTransaction
+
+WAITLIST_SHARDS = 20
+WAITLIST_PROMOTE_BATCH = 50
+
+
+def _shardKey(websafeConferenceKey, shard):
+    """Return the key of a WaitlistShard of a conference"""
+    return ndb.Key(WaitlistShard, '%s:%d' % (websafeConferenceKey, shard))
+
+
+def waitlistKey(websafeConferenceKey, user_id):
+    """Return the WaitlistEntry key of a user for a conference"""
+    shard = (zlib.crc32(user_id.encode('utf-8')) & 0xffffffff) % WAITLIST_SHARDS
+    return ndb.Key(WaitlistEntry, user_id,
+                   parent=_shardKey(websafeConferenceKey, shard))
+
+
+def waitlistPosition(entry):
+    """Return the 1-based position of a WaitlistEntry in its queue"""
+    shards = ndb.get_multi([_shardKey(entry.conferenceKey, shard)
+                            for shard in range(WAITLIST_SHARDS)])
+    return sum(bisect_left(shard.joined, entry.joined)
+               for shard in shards if shard) + 1
+
+
+@ndb.transactional
+def _addEntry(key, websafeConferenceKey, user_id):
+    """Add a WaitlistEntry and its join time to its shard, unless it exists"""
+    entry = key.get()
+    if entry:
+        return entry
+    shard = key.parent().get() or WaitlistShard(key=key.parent())
+    entry = WaitlistEntry(key=key, conferenceKey=websafeConferenceKey,
+                          userId=user_id, joined=datetime.now())
+    insort(shard.joined, entry.joined)
+    ndb.put_multi([shard, entry])
+    return entry
+
+
+def _removeEntry(entry):
+    """Delete a WaitlistEntry and its join time; call inside a transaction"""
+    shard = entry.key.parent().get()
+    if shard and entry.joined in shard.joined:
+        shard.joined.remove(entry.joined)
+        shard.put()
+    entry.key.delete()
+
+
+def joinWaitlist(websafeConferenceKey, user_id):
+    """Put user on the waitlist (once) and return their position"""
+    key = waitlistKey(websafeConferenceKey, user_id)
+    return waitlistPosition(_addEntry(key, websafeConferenceKey, user_id))
+
+
+def getWaitlistPosition(websafeConferenceKey, user_id):
+    """Return the position of user on the waitlist, or None if not queued"""
+    entry = waitlistKey(websafeConferenceKey, user_id).get()
+    return waitlistPosition(entry) if entry else None
+
+
+@ndb.transactional
+def leaveWaitlist(websafeConferenceKey, user_id):
+    """Remove user from the waitlist; return True if they were queued"""
+    entry = waitlistKey(websafeConferenceKey, user_id).get()
+    if not entry:
+        return False
+    _removeEntry(entry)
+    return True
+
+
+def hasWaitlist(websafeConferenceKey):
+    """Return True if anybody is waiting for a seat at the conference"""
+    return WaitlistEntry.query(
+        WaitlistEntry.conferenceKey == websafeConferenceKey
+    ).get(keys_only=True) is not None
+
+
+def schedulePromotion(websafeConferenceKey):
+    """
+    Queue the promotion of waitlisted users to freed seats; inside a
+    transaction, once it commits
+    """
+    taskqueue.add(params={'conference_key': websafeConferenceKey},
+                  url='/tasks/promote_waitlist',
+                  transactional=ndb.in_transaction())
+
+
+def _promote(conf_key, entry_key):
+    """
+    Register the user of a WaitlistEntry, taking away one seat; return None
+    when no seats are left, otherwise whether the user got registered
+    """
+    conf, entry = ndb.get_multi([conf_key, entry_key])
+    if not conf or conf.seatsAvailable <= 0:
+        return None
+    if not entry:
+        return False
+
+    _removeEntry(entry)
+    prof = ndb.Key(Profile, entry.userId).get()
+    wsck = conf_key.urlsafe()
+    if not prof or wsck in prof.conferenceKeysToAttend:
+        return False
+
+    prof.conferenceKeysToAttend.append(wsck)
+    conf.seatsAvailable -= 1
+    conf.seatsVersion += 1
+    queueCoRegistration(wsck, prof.conferenceKeysToAttend)
+    queueSeatChange(wsck, conf.seatsAvailable, conf.seatsVersion)
+    queueRegistrationEffects(wsck, entry.userId)
+    ndb.put_multi([prof, conf])
+    return True
+
+
+def promoteWaitlist(websafeConferenceKey):
+    """Give free seats to waitlisted users, oldest first; return user ids"""
+    conf_key = ndb.Key(urlsafe=websafeConferenceKey)
+    promoted = []
+    query = WaitlistEntry.query(
+        WaitlistEntry.conferenceKey == websafeConferenceKey
+    ).order(WaitlistEntry.joined)
+    for entry in query.iter(batch_size=WAITLIST_PROMOTE_BATCH):
+        # safe to retry: a promoted entry is gone, so a replay is a no-op
+        registered = runInTransaction(
+            'promotion', lambda: _promote(conf_key, entry.key),
+            idempotent=True, xg=True)
+        if registered is None:
+            break
+        if registered:
+            promoted.append(entry.userId)
+    return promoted
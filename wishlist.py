@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""wishlist.py
+
+Write-behind buffer for wishlist mutations
+
+addSessionToWishlist and deleteSessionInWishlist do not write the Profile.
+They append the mutation to a per-user journal in memcache, then make sure
+a named /tasks/flush_wishlist task exists for the current window, and
+return; that task collapses every mutation journaled within
+WISHLIST_FLUSH_DELAY seconds into a single Profile write. Reads merge the
+pending journal over the stored wishlist, so users always see their own
+writes.
+
+Every mutation gets a sequence number above both the last one journaled
+and Profile.wishlistSeq, the last one applied to the Profile. Flushes skip
+mutations at or below wishlistSeq, which makes them safe to repeat or to
+run concurrently.
+
+Guarantees:
+- A mutation is acknowledged only once a flush task that will see it is
+  enqueued. The task of a window is due when the window ends, so if it
+  already exists when a mutation asks for it, it has not run yet. If the
+  task cannot be enqueued, the journal is written through instead.
+- If the request dies between the append and the scheduling, the
+  mutation is unacknowledged: it is applied by the next flush of the user,
+  or lost with the journal.
+- If memcache cannot take a mutation (it is down, or the journal is full),
+  it is written through to the Profile together with the pending journal.
+- If memcache evicts a journal before it is flushed, the mutations in it
+  are lost and the wishlist reverts to the stored Profile.
+
+"""
+
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from cache import bumpFeedVersion
+from models import Profile
+
+WISHLIST_JOURNAL_KEY = 'WISHLIST_JOURNAL:%s'
+WISHLIST_FLUSH_DELAY = 5        # seconds of mutations collapsed per write
+WISHLIST_JOURNAL_MAX = 100
+WISHLIST_JOURNAL_TTL = 3600
+WISHLIST_CAS_RETRIES = 5
+
+
+def applyWishlistOps(session_keys, ops):
+    """Return the session keys resulting from applying journaled ops in order"""
+    keys = list(session_keys)
+    for seq, action, wssk in ops:
+        key = ndb.Key(urlsafe=wssk)
+        if action == 'add' and key not in keys:
+            keys.append(key)
+        elif action == 'remove' and key in keys:
+            keys.remove(key)
+    return keys
+
+
+def _pendingOps(prof, journal):
+    """Return the journaled ops not yet applied to a Profile"""
+    if not journal:
+        return []
+    return [op for op in journal['ops'] if op[0] > prof.wishlistSeq]
+
+
+def getWishlist(prof):
+    """Return the wishlist session keys of a Profile, pending mutations included"""
+    journal = memcache.get(WISHLIST_JOURNAL_KEY % prof.key.id())
+    return applyWishlistOps(prof.sessionsToAttend, _pendingOps(prof, journal))
+
+
+def _scheduleFlush(user_id):
+    """Make sure a flush task runs at the end of the current window"""
+    now = time.time()
+    window = int(now / WISHLIST_FLUSH_DELAY)
+    try:
+        taskqueue.add(
+            name='wishlist-%s-%d' % (hashlib.md5(user_id.encode('utf-8')).hexdigest(), window),
+            params={'user_id': user_id},
+            url='/tasks/flush_wishlist',
+            countdown=(window + 1) * WISHLIST_FLUSH_DELAY - now)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.transactional
+def _applyJournal(user_id, ops):
+    """Apply the ops a Profile has not seen yet in one write"""
+    prof = ndb.Key(Profile, user_id).get()
+    ops = [op for op in ops if prof and op[0] > prof.wishlistSeq]
+    if not ops:
+        return
+    prof.sessionsToAttend = applyWishlistOps(prof.sessionsToAttend, ops)
+    prof.wishlistSeq = ops[-1][0]
+    prof.put()
+
+
+def _trimJournal(client, key, applied_seq):
+    """Drop applied ops from a journal, keeping those appended meanwhile"""
+    for i in range(WISHLIST_CAS_RETRIES):
+        journal = client.gets(key)
+        if journal is None:
+            return
+        ops = [op for op in journal['ops'] if op[0] > applied_seq]
+        if client.cas(key, dict(journal, ops=ops), time=WISHLIST_JOURNAL_TTL):
+            return
+
+
+def recordWishlistOp(prof, action, wssk):
+    """Journal a wishlist mutation ('add' or 'remove' of a websafe session key)"""
+    user_id = prof.key.id()
+    key = WISHLIST_JOURNAL_KEY % user_id
+    client = memcache.Client()
+
+    for i in range(WISHLIST_CAS_RETRIES):
+        journal = client.gets(key)
+        base = journal or {'seq': 0, 'ops': []}
+        seq = max(base['seq'], prof.wishlistSeq) + 1
+        if len(base['ops']) >= WISHLIST_JOURNAL_MAX:
+            break
+        updated = {'seq': seq, 'ops': base['ops'] + [(seq, action, wssk)]}
+        if journal is None:
+            stored = client.add(key, updated, time=WISHLIST_JOURNAL_TTL)
+        else:
+            stored = client.cas(key, updated, time=WISHLIST_JOURNAL_TTL)
+        if stored:
+            # after the append, so the task found or added is due later
+            try:
+                _scheduleFlush(user_id)
+            except taskqueue.Error:
+                flushWishlist(user_id)
+            bumpFeedVersion(user_id)
+            return
+
+    # memcache can't take it: write it through, after what is still pending
+    journal = client.get(key)
+    ops = _pendingOps(prof, journal)
+    seq = max([prof.wishlistSeq] + [op[0] for op in ops]) + 1
+    _applyJournal(user_id, ops + [(seq, action, wssk)])
+    if journal:
+        _trimJournal(client, key, seq)
+    bumpFeedVersion(user_id)
+
+
+def flushWishlist(user_id):
+    """Collapse the journaled mutations of a user into one Profile write"""
+    key = WISHLIST_JOURNAL_KEY % user_id
+    client = memcache.Client()
+    journal = client.get(key)
+    if not journal or not journal['ops']:
+        return
+    _applyJournal(user_id, journal['ops'])
+    _trimJournal(client, key, journal['ops'][-1][0])